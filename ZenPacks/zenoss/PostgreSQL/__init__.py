@@ -32,6 +32,12 @@ class ZenPack(ZenPackBase):
         ('zPostgreSQLUseSSL', False, 'boolean'),
         ('zPostgreSQLDefaultDB', 'postgres', 'string'),
         ('zPostgreSQLTableRegex', [], 'lines'),
+        ('zPostgreSQLTableShards', 1, 'int'),
+        ('zPostgreSQLSizeInterval', 3600, 'int'),
+        ('zPostgreSQLTableRefresh', 1, 'int'),
+        ('zPostgreSQLLatencySamples', 1, 'int'),
+        ('zPostgreSQLLongRunningThreshold', 300, 'int'),
+        ('zPostgreSQLBlockingThreshold', 60, 'int'),
     ]
 
     packZProperties_data = {
@@ -39,6 +45,30 @@ class ZenPack(ZenPackBase):
             'description': "List of regular expressions (matched against table names) to control which tables are NOT modeled from All databases.",
             'label': "Regex Table Filter",
             'type': "lines" },
+        'zPostgreSQLTableShards': {
+            'description': "Number of polls each database's tables are spread over. Large and active tables are collected by every poll, the others are estimated between polls.",
+            'label': "Table Shards",
+            'type': "int" },
+        'zPostgreSQLSizeInterval': {
+            'description': "Seconds between collections of database and total table sizes, which are repeated by the polls in between. 0 collects them every poll.",
+            'label': "Size Interval",
+            'type': "int" },
+        'zPostgreSQLTableRefresh': {
+            'description': "Above 1, only tables whose stats are changing are sent for storage, and all of them every this many polls. 1, the default, sends all of them every poll.",
+            'label': "Table Refresh",
+            'type': "int" },
+        'zPostgreSQLLatencySamples': {
+            'description': "Samples of each database's connection and query latency taken per poll, reported as their median, minimum, 95th percentile and maximum. Each sample above 1 opens another connection.",
+            'label': "Latency Samples",
+            'type': "int" },
+        'zPostgreSQLLongRunningThreshold': {
+            'description': "Seconds a query may run, or a session stay idle in transaction, before an event names it. 0 disables these events.",
+            'label': "Long Running Threshold",
+            'type': "int" },
+        'zPostgreSQLBlockingThreshold': {
+            'description': "Seconds a session may wait on a lock before an event names the session heading its chain of blockers. 0 disables these events.",
+            'label': "Blocking Threshold",
+            'type': "int" },
     }
 
     def install(self, app):
@@ -100,3 +130,12 @@ def getPostgreSQL(self):
 
     return False
 
+
+@monkeypatch('Products.ZenModel.BasicDataSource.BasicDataSource')
+def getPostgreSQLDatapoints(self):
+    """
+    Comma-separated ids of this datasource's datapoints.
+
+    Passed to poll_postgres.py so it only collects what the template uses.
+    """
+    return ','.join(sorted(dp.id for dp in self.datapoints()))
@@ -0,0 +1,386 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Twisted versions of the PgHelper queries used by the modeler.
+
+Queries run on psycopg2 connections in asynchronous mode. Each connection
+hands its socket to the reactor, which calls back when it is ready to be
+read or written, so any number of queries can be in flight without
+blocking the reactor or tying up a thread each.
+
+Kept apart from util so the command poller, which only polls synchronously,
+does not have to import Twisted on every run.
+"""
+
+import logging
+import re
+
+from zope.interface import implementer
+
+from twisted.internet import defer
+from twisted.internet.interfaces import IReadWriteDescriptor
+
+from util import PgHelper, TABLES_QUERY, is_suppressed, psycopg2, tableFromRow
+
+LOG = logging.getLogger('zen.PostgreSQL.utils')
+
+# Connections an AsyncPgHelper has open at once unless given maxConnections.
+ASYNC_CONNECTIONS = 10
+
+# Seconds to wait for a connection to be established.
+CONNECT_TIMEOUT = 10
+
+
+def asyncArgument(dbapi):
+    """
+    Return the connect() keyword argument asking dbapi for an asynchronous
+    connection. psycopg2 2.7 renamed async to async_.
+    """
+    version = getattr(dbapi, '__version__', '')
+    version = tuple(int(x) for x in re.findall(r'\d+', version)[:2])
+
+    return 'async_' if version >= (2, 7) else 'async'
+
+
+@implementer(IReadWriteDescriptor)
+class AsyncConnection(object):
+    """
+    A psycopg2 connection in asynchronous mode driven by the reactor.
+
+    Only one query runs on a connection at a time. Each method returns a
+    Deferred that fires when the server has answered.
+    """
+
+    def __init__(self, dbapi, reactor=None, timeout=CONNECT_TIMEOUT,
+                 **kwargs):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self._dbapi = dbapi
+        self._reactor = reactor
+        self._timeout = timeout
+        self._kwargs = kwargs
+        self._connection = None
+        self._deferred = None
+        self._timer = None
+
+    def connect(self):
+        """Connect, firing with this AsyncConnection once connected."""
+        kwargs = dict(self._kwargs)
+        kwargs[asyncArgument(self._dbapi)] = 1
+        self._connection = self._dbapi.connect(**kwargs)
+
+        d = self._wait(timeout=self._timeout)
+        d.addCallback(lambda _: self)
+        return d
+
+    def runOperation(self, sql, params=None):
+        """Run sql, firing with None once it has completed."""
+        cursor = self._connection.cursor()
+        cursor.execute(sql, params)
+
+        d = self._wait()
+        d.addBoth(self._closeCursor, cursor)
+        return d
+
+    def runQuery(self, sql, params=None):
+        """Run sql, firing with the list of rows it returned."""
+        cursor = self._connection.cursor()
+        cursor.execute(sql, params)
+
+        d = self._wait()
+        d.addCallback(lambda _: cursor.fetchall())
+        d.addBoth(self._closeCursor, cursor)
+        return d
+
+    def close(self):
+        self._stopWatching()
+
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+
+        self._fail(psycopg2.OperationalError("connection closed"))
+
+    def _closeCursor(self, result, cursor):
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+        return result
+
+    def _wait(self, timeout=None):
+        """Return a Deferred firing when the connection is ready again."""
+        self._deferred = defer.Deferred()
+        if timeout:
+            self._timer = self._reactor.callLater(
+                timeout, self._timedOut, timeout)
+
+        d = self._deferred
+        self._poll()
+        return d
+
+    def _timedOut(self, timeout):
+        self._timer = None
+        self._fail(psycopg2.OperationalError(
+            "timed out after {0} seconds".format(timeout)))
+        self.close()
+
+    def _poll(self):
+        """Advance the connection and watch its socket as libpq asks."""
+        if self._deferred is None:
+            return
+
+        try:
+            state = self._connection.poll()
+        except Exception:
+            self._stopWatching()
+            self._fail()
+            return
+
+        extensions = psycopg2.extensions
+        if state == extensions.POLL_OK:
+            self._stopWatching()
+            d, self._deferred = self._deferred, None
+            self._cancelTimer()
+            d.callback(None)
+        elif state == extensions.POLL_READ:
+            self._reactor.removeWriter(self)
+            self._reactor.addReader(self)
+        elif state == extensions.POLL_WRITE:
+            self._reactor.removeReader(self)
+            self._reactor.addWriter(self)
+        else:
+            self._stopWatching()
+            self._fail(psycopg2.OperationalError(
+                "bad poll state: {0}".format(state)))
+
+    def _fail(self, error=None):
+        """
+        Errback the pending Deferred, if any, with error or the exception
+        being handled.
+        """
+        d, self._deferred = self._deferred, None
+        self._cancelTimer()
+        if d is not None:
+            d.errback(error)
+
+    def _cancelTimer(self):
+        timer, self._timer = self._timer, None
+        if timer is not None and timer.active():
+            timer.cancel()
+
+    def _stopWatching(self):
+        self._reactor.removeReader(self)
+        self._reactor.removeWriter(self)
+
+    # IReadWriteDescriptor
+
+    def fileno(self):
+        try:
+            return self._connection.fileno()
+        except Exception:
+            return -1
+
+    def doRead(self):
+        self._poll()
+
+    def doWrite(self):
+        self._poll()
+
+    def connectionLost(self, reason):
+        self._stopWatching()
+
+        # libpq knows better than the reactor why the socket failed.
+        if self._deferred is not None and self._connection is not None:
+            try:
+                self._connection.poll()
+            except Exception:
+                self._fail()
+                return
+
+        self._fail(reason)
+
+    def logPrefix(self):
+        return 'PostgreSQL'
+
+
+class AsyncPgHelper(PgHelper):
+    """
+    PgHelper with Deferred-returning queries run on asynchronous
+    connections. Each query opens its own connection, and no more than
+    maxConnections are open at once.
+    """
+
+    _semaphore = None
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncPgHelper, self).__init__(*args, **kwargs)
+        self._semaphore = defer.DeferredSemaphore(
+            self._maxConnections or ASYNC_CONNECTIONS)
+
+    def _connectionArguments(self, db):
+        conn_kwargs = {
+            'host': self._host,
+            'port': int(self._port),
+            'user': self._username,
+            'password': self._password,
+            'database': str(db),
+        }
+
+        if self._ssl:
+            conn_kwargs['sslmode'] = 'require'
+        else:
+            conn_kwargs['sslmode'] = 'disable'
+
+        return conn_kwargs
+
+    def _runAsync(self, db, interaction, *args):
+        """
+        Return a Deferred firing with the result of interaction(connection,
+        *args) run on a new connection to db, which is closed afterwards.
+        """
+        return self._semaphore.run(self._interact, db, interaction, *args)
+
+    @defer.inlineCallbacks
+    def _interact(self, db, interaction, *args):
+        connection = AsyncConnection(
+            self._dbapi(psycopg2), **self._connectionArguments(db))
+
+        try:
+            yield connection.connect()
+            result = yield interaction(connection, *args)
+        finally:
+            connection.close()
+
+        defer.returnValue(result)
+
+    def _fetchDatabases(self, connection):
+        return connection.runQuery(
+            "SELECT d.datname, s.datid, pg_database_size(s.datid) AS size"
+            "  FROM pg_database AS d"
+            "  JOIN pg_stat_database AS s ON s.datname = d.datname"
+            " WHERE NOT datistemplate AND datallowconn"
+            "   AND d.datname != 'bdr_supervisordb'"
+        )
+
+    @defer.inlineCallbacks
+    def getDatabasesAsync(self):
+        """Async version of getDatabases() - returns Deferred."""
+        try:
+            LOG.debug("Running async query for databases")
+            rows = yield self._runAsync(
+                self._default_db, self._fetchDatabases)
+
+            LOG.debug("Processing {0} database rows".format(len(rows)))
+            databases = {}
+            for row in rows:
+                databases[row[0]] = dict(
+                    oid=row[1],
+                    size=row[2]
+                )
+
+            LOG.debug("Async getDatabases successful, returning {0} databases".format(len(databases)))
+            defer.returnValue(databases)
+        except Exception as ex:
+            msg = str(ex).strip()
+            fatal_errors = [
+                "no pg_hba.conf entry",
+                "password authentication failed"
+            ]
+            if any(err in msg for err in fatal_errors):
+                LOG.error("Async getDatabases failed due to fatal config error: %s. Skipping sync fallback.", msg)
+                defer.returnValue({})
+
+            LOG.error("Async getDatabases failed: %s, falling back to sync", ex)
+            import traceback
+            LOG.error("Traceback: %s", traceback.format_exc())
+            try:
+                LOG.info("Attempting sync fallback for getDatabases")
+                result = self.getDatabases()
+                LOG.info("Sync fallback successful, got {0} databases".format(len(result)))
+                defer.returnValue(result)
+            except Exception as ex2:
+                LOG.error("Sync fallback also failed: %s", ex2)
+                defer.returnValue({})
+
+    @defer.inlineCallbacks
+    def _fetchTables(self, connection, exclude_patterns=None):
+        """
+        Build the tables dict, fetching itersize rows at a time through an
+        explicit server-side cursor. Tables matching exclude_patterns are
+        never stored. Asynchronous connections are in autocommit mode, so
+        the cursor gets a transaction of its own.
+        """
+        tables = {}
+
+        yield connection.runOperation("BEGIN")
+        yield connection.runOperation(
+            "DECLARE zenoss_tables NO SCROLL CURSOR FOR {0}".format(
+                TABLES_QUERY))
+
+        while True:
+            rows = yield connection.runQuery(
+                "FETCH FORWARD {0:d} FROM zenoss_tables".format(
+                    self._itersize))
+
+            if not rows:
+                break
+
+            tables.update(
+                tableFromRow(row) for row in rows
+                if not is_suppressed(row[0], exclude_patterns or ()))
+
+        yield connection.runOperation("CLOSE zenoss_tables")
+        yield connection.runOperation("COMMIT")
+
+        defer.returnValue(tables)
+
+    @defer.inlineCallbacks
+    def getTablesInDatabaseAsync(self, db, exclude_patterns=None):
+        """
+        Async version of getTablesInDatabase() - returns Deferred.
+
+        Tables matching exclude_patterns are dropped as rows are fetched.
+        """
+        try:
+            LOG.debug("Getting tables for database: %s (async)", db)
+            tables = yield self._runAsync(
+                db, self._fetchTables, exclude_patterns)
+
+            LOG.debug("Got %d tables from database %s (async)", len(tables), db)
+            defer.returnValue(tables)
+        except Exception as ex:
+            msg = str(ex).strip()
+            fatal_errors = [
+                "no pg_hba.conf entry",
+                "password authentication failed"
+            ]
+            if any(err in msg for err in fatal_errors):
+                LOG.error("Async getTablesInDatabase(%s) failed due to fatal config error: %s. Skipping sync fallback.",
+                          db, msg)
+                defer.returnValue({})
+
+            LOG.error("Async getTablesInDatabase(%s) failed: %s, falling back to sync", db, ex)
+            import traceback
+            LOG.error("Traceback: %s", traceback.format_exc())
+
+            try:
+                result = dict(
+                    table for table in self.iterTablesInDatabase(db)
+                    if not is_suppressed(table[0], exclude_patterns or ()))
+                LOG.info("Sync fallback successful for database %s, got %d tables", db, len(result))
+                defer.returnValue(result)
+            except Exception as ex2:
+                LOG.error("Sync fallback also failed for database %s: %s", db, ex2)
+                defer.returnValue({})
@@ -0,0 +1,466 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Record the queries PgHelper sends, and replay them without a server.
+
+A Recorder wraps the psycopg2 module (or the dbapi of a Twisted connection
+pool) and writes every query and the rows the client fetched for it to a
+capture file. The file has one JSON document per line and is gzipped if its
+name ends with .gz. Database, schema and table names and other identifying
+text can be replaced by stable pseudonyms while recording.
+
+Replay reads a capture file and stands in for the psycopg2 module: its
+connections answer each query with the rows recorded for it, in the order
+they were recorded, starting over when they run out. That reproduces a
+catalog's exact shape, such as a customer's, for benchmarks and tests.
+
+Rows the server aggregates into JSON arrays of objects, as getServerStats
+has it do for the server sections on 9.3 and newer, are anonymized by the
+keys of their objects like columns are. Other server-built JSON documents
+(--server-json) are recorded as they are and are not anonymized.
+
+This module has no dependencies so the command poller can import it.
+"""
+
+import datetime
+import decimal
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+FORMAT = 'zenoss-postgresql-capture'
+VERSION = 1
+
+# Columns holding names or text that may identify the customer, and the
+# prefix of their pseudonyms.
+ANONYMIZED_COLUMNS = {
+    'datname': 'db',
+    'relname': 'table',
+    'schemaname': 'schema',
+    'usename': 'user',
+    'application_name': 'app',
+    'client_addr': 'addr',
+    'client_hostname': 'host',
+    'query': 'query',
+}
+
+# Query parameters holding sorted lists of names, and their pseudonym
+# prefixes. The pseudonyms are sorted again, as the names would be on replay.
+ANONYMIZED_PARAMS = {
+    'hot': 'table',
+}
+
+
+class ReplayError(Exception):
+    """A query or database was not in the capture."""
+
+
+class _Pairs(list):
+    """The (key, value) pairs of a JSON object, in order and repeating."""
+
+
+def encodePairs(value):
+    """Return JSON of value, decoded with _Pairs for objects."""
+    if isinstance(value, _Pairs):
+        return '{' + ','.join(
+            json.dumps(k) + ':' + encodePairs(v) for k, v in value) + '}'
+
+    if isinstance(value, list):
+        return '[' + ','.join(encodePairs(v) for v in value) + ']'
+
+    return json.dumps(value)
+
+
+class FixedOffset(datetime.tzinfo):
+    """Timezone at a fixed offset from UTC, in minutes."""
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def utcoffset(self, dt):
+        return datetime.timedelta(minutes=self.offset)
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+
+def encodeValue(value):
+    """Return value in a form JSON can hold and decodeValue restores."""
+    if isinstance(value, decimal.Decimal):
+        return {'$decimal': str(value)}
+
+    if isinstance(value, datetime.datetime):
+        encoded = {'$datetime': value.replace(tzinfo=None).isoformat()}
+        offset = value.utcoffset()
+        if offset is not None:
+            encoded['offset'] = offset.days * 1440 + offset.seconds // 60
+        return encoded
+
+    return value
+
+
+def decodeValue(value):
+    if isinstance(value, dict):
+        if '$decimal' in value:
+            return decimal.Decimal(value['$decimal'])
+
+        if '$datetime' in value:
+            text = value['$datetime']
+            dt = datetime.datetime.strptime(
+                text, '%Y-%m-%dT%H:%M:%S.%f' if '.' in text
+                else '%Y-%m-%dT%H:%M:%S')
+            if 'offset' in value:
+                dt = dt.replace(tzinfo=FixedOffset(value['offset']))
+            return dt
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+
+    return value
+
+
+def openCapture(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+
+    return open(path, mode)
+
+
+class Recorder(object):
+    """Writes the queries of every connection it wraps to a capture file."""
+
+    def __init__(self, path, anonymize=False, salt=None):
+        self.path = path
+        self.anonymize = anonymize
+        self.salt = salt if salt is not None else os.urandom(16)
+        self._lock = threading.Lock()
+        self._file = openCapture(path, 'wb')
+        self._write(dict(
+            format=FORMAT,
+            version=VERSION,
+            anonymized=anonymize,
+            created=time.time()))
+
+    def _write(self, document):
+        line = json.dumps(document, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def pseudonym(self, value, prefix='x'):
+        """Return a stable stand-in for value, unique within this capture."""
+        if not self.anonymize or value is None:
+            return value
+
+        digest = hashlib.sha1(self.salt + str(value)).hexdigest()
+        return '{0}_{1}'.format(prefix, digest[:12])
+
+    def wrap(self, dbapi):
+        """Return a stand-in for the dbapi module that records queries."""
+        return RecordingDBAPI(dbapi, self)
+
+    def recordConnect(self, database, serverVersion):
+        self._write(dict(connect=dict(
+            database=self.pseudonym(database, 'db'),
+            serverVersion=serverVersion)))
+
+    def pseudonymRows(self, value):
+        """
+        Return value with the values of ANONYMIZED_COLUMNS keys replaced if
+        it is a JSON array of rows aggregated into objects, such as by
+        json_agg, or else as it is.
+        """
+        if not isinstance(value, basestring) or \
+                not value.lstrip().startswith('[{'):
+            return value
+
+        try:
+            rows = json.loads(value, object_pairs_hook=_Pairs)
+        except ValueError:
+            return value
+
+        for row in rows if isinstance(rows, list) else ():
+            for i, (k, v) in enumerate(row):
+                if k in ANONYMIZED_COLUMNS:
+                    if isinstance(v, unicode):
+                        v = v.encode('utf-8')
+                    row[i] = (k, self.pseudonym(v, ANONYMIZED_COLUMNS[k]))
+
+        return encodePairs(rows)
+
+    def recordQuery(self, database, sql, params, columns, rows):
+        if self.anonymize and columns:
+            prefixes = [ANONYMIZED_COLUMNS.get(c) for c in columns]
+            rows = [
+                [self.pseudonym(v, p) if p else self.pseudonymRows(v)
+                 for v, p in zip(row, prefixes)]
+                for row in rows]
+
+        if self.anonymize and isinstance(params, dict):
+            params = dict(
+                (k, sorted(
+                    self.pseudonym(v, ANONYMIZED_PARAMS[k]) for v in value)
+                 if k in ANONYMIZED_PARAMS else value)
+                for k, value in params.iteritems())
+
+        self._write(dict(
+            database=self.pseudonym(database, 'db'),
+            sql=sql,
+            params=params,
+            columns=columns,
+            rows=[[encodeValue(v) for v in row] for row in rows]))
+
+
+class RecordingDBAPI(object):
+    def __init__(self, dbapi, recorder):
+        self._dbapi = dbapi
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._dbapi, name)
+
+    def connect(self, *args, **kwargs):
+        connection = self._dbapi.connect(*args, **kwargs)
+        database = kwargs.get('database')
+        self._recorder.recordConnect(
+            database, getattr(connection, 'server_version', None))
+
+        return RecordingConnection(connection, database, self._recorder)
+
+
+class RecordingConnection(object):
+    def __init__(self, connection, database, recorder):
+        self._connection = connection
+        self._database = database
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(
+            self._connection.cursor(*args, **kwargs), self)
+
+
+class RecordingCursor(object):
+    """Records each query with the rows fetched for it by the client."""
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+        self._query = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+    def _flush(self):
+        query, self._query = self._query, None
+        if query is None:
+            return
+
+        description = self._cursor.description
+        self._connection._recorder.recordQuery(
+            self._connection._database,
+            query[0],
+            query[1],
+            [c[0] for c in description] if description else None,
+            query[2])
+
+    def execute(self, sql, params=None):
+        self._flush()
+        self._cursor.execute(sql, params)
+        self._query = (sql, params, [])
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._query[2].append(row)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._query[2].extend(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._query[2].extend(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._query[2].append(row)
+            yield row
+
+    def close(self):
+        self._flush()
+        self._cursor.close()
+
+
+class Replay(object):
+    """
+    Stands in for the psycopg2 module, serving the queries of a capture.
+
+    databases lists the databases connected to, in the order they were
+    first connected to. The first is normally the default database.
+    """
+
+    def __init__(self, path):
+        self.databases = []
+        self.serverVersions = {}
+        self._results = {}
+        self._next = {}
+
+        with openCapture(path, 'rb') as f:
+            header = json.loads(f.readline())
+            if header.get('format') != FORMAT:
+                raise ReplayError("{0} is not a capture file".format(path))
+
+            self.anonymized = header.get('anonymized', False)
+
+            for line in f:
+                document = json.loads(line)
+                if 'connect' in document:
+                    database = decodeValue(document['connect']['database'])
+                    if database not in self.serverVersions:
+                        self.databases.append(database)
+                    self.serverVersions[database] = \
+                        document['connect']['serverVersion']
+                    continue
+
+                key = self.key(
+                    decodeValue(document['database']),
+                    document['sql'],
+                    document['params'])
+
+                self._results.setdefault(key, []).append((
+                    document['columns'],
+                    [tuple(decodeValue(v) for v in row)
+                     for row in document['rows']]))
+
+    @property
+    def defaultDatabase(self):
+        return self.databases[0] if self.databases else None
+
+    def key(self, database, sql, params):
+        if params is not None:
+            params = json.dumps(params, sort_keys=True, default=str)
+
+        return (database, sql, params)
+
+    def result(self, database, sql, params):
+        """Return the (columns, rows) recorded next for a query."""
+        key = self.key(database, sql, params)
+        results = self._results.get(key)
+        if not results:
+            raise ReplayError("query not in capture: {0}".format(sql))
+
+        i = self._next.get(key, 0)
+        self._next[key] = (i + 1) % len(results)
+        return results[i]
+
+    def connect(self, *args, **kwargs):
+        database = kwargs.get('database')
+        if database not in self.serverVersions:
+            raise ReplayError(
+                "database not in capture: {0}".format(database))
+
+        return ReplayConnection(self, database)
+
+
+class ReplayConnection(object):
+    def __init__(self, replay, database):
+        self.replay = replay
+        self.database = database
+        self.server_version = replay.serverVersions[database]
+        self.closed = 0
+
+    def cursor(self, *args, **kwargs):
+        return ReplayCursor(self)
+
+    def set_session(self, **kwargs):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class ReplayCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.itersize = 2000
+        self.arraysize = 1
+        self.description = None
+        self.rowcount = -1
+        self._rows = iter(())
+
+    def execute(self, sql, params=None):
+        columns, rows = self.connection.replay.result(
+            self.connection.database, sql, params)
+
+        self.description = tuple(
+            (c, None, None, None, None, None, None)
+            for c in columns) if columns is not None else None
+        self.rowcount = len(rows)
+        self._rows = iter(rows)
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        return [row for _, row in zip(range(size), self._rows)]
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def close(self):
+        self._rows = iter(())
+
+
+def recorderFromEnvironment(name):
+    """
+    Return a Recorder if ZP_POSTGRESQL_CAPTURE names a directory to record
+    into, otherwise None. The capture is named after name and the time.
+    Set ZP_POSTGRESQL_CAPTURE_ANONYMIZE to anonymize it.
+    """
+    directory = os.environ.get('ZP_POSTGRESQL_CAPTURE')
+    if not directory:
+        return None
+
+    return Recorder(
+        os.path.join(directory, '{0}-{1}.jsonl.gz'.format(
+            name, time.strftime('%Y%m%d-%H%M%S'))),
+        anonymize=bool(os.environ.get('ZP_POSTGRESQL_CAPTURE_ANONYMIZE')))
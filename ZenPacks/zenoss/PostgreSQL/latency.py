@@ -0,0 +1,192 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Latency of connecting to each database and of a round trip on it, sampled
+several times per poll so that one slow sample doesn't make the graph.
+
+Each database is sampled the first time with the connection its other
+queries use. Further samples open and close a connection of their own and
+run SELECT 1 on the kept one, no closer together than SAMPLE_SPACING so
+they don't arrive as one burst.
+
+libpq doesn't tell how long each part of connecting took, so connecting is
+broken down by a probe of its own: it opens a TCP connection, negotiates
+TLS on it like libpq does, and closes it before sending a startup packet,
+which PostgreSQL drops without logging. Whatever the real connection took
+beyond that is authentication and starting the backend. The handshake is
+the same for every database, so it is probed once per poll.
+"""
+
+import math
+import socket
+import ssl
+import struct
+import time
+
+# Seconds between the start of two samples of the same database.
+SAMPLE_SPACING = 0.2
+
+# Stats summarizing all samples of connecting and SELECT 1.
+CONNECTION_LATENCY_STATS = (
+    'connectionLatency', 'connectionLatencyMin', 'connectionLatencyP95',
+    'connectionLatencyMax')
+
+QUERY_LATENCY_STATS = (
+    'queryLatency', 'queryLatencyMin', 'queryLatencyP95', 'queryLatencyMax')
+
+# Medians of the parts of connecting.
+BREAKDOWN_STATS = ('tcpLatency', 'tlsLatency', 'authLatency')
+
+LATENCY_STATS = CONNECTION_LATENCY_STATS + QUERY_LATENCY_STATS + \
+    BREAKDOWN_STATS
+
+# Sent by libpq before the startup packet to ask for TLS.
+SSL_REQUEST = struct.pack('!ii', 8, 80877103)
+
+
+def median(values):
+    """Return the median of values."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of values at fraction."""
+    values = sorted(values)
+    rank = int(math.ceil(fraction * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summarize(name, values):
+    """
+    Return the median of values as name, and their minimum, 95th
+    percentile and maximum as name with Min, P95 and Max appended.
+    """
+    return {
+        name: median(values),
+        name + 'Min': min(values),
+        name + 'P95': percentile(values, 0.95),
+        name + 'Max': max(values),
+        }
+
+
+def probeHandshake(host, port, useSSL, timeout=10):
+    """
+    Return the seconds taken to open a TCP connection to host:port, and to
+    then negotiate TLS on it if useSSL, or None if not or the server
+    refuses.
+    """
+    begin = time.time()
+    sock = socket.create_connection((host, int(port)), timeout)
+    try:
+        tcp = time.time() - begin
+        if not useSSL:
+            return tcp, None
+
+        begin = time.time()
+        sock.sendall(SSL_REQUEST)
+        if sock.recv(1) != 'S':
+            return tcp, None
+
+        # Like sslmode=require, which doesn't verify the certificate.
+        tlsSock = ssl.wrap_socket(sock, cert_reqs=ssl.CERT_NONE)
+        tls = time.time() - begin
+
+        try:
+            # Shut down cleanly so the server sees an empty connection.
+            sock = tlsSock.unwrap()
+        except Exception:
+            sock = tlsSock
+
+        return tcp, tls
+    finally:
+        sock.close()
+
+
+class LatencyProbe(object):
+    """
+    Samples of the latencies of each database, taken with pg. With
+    breakdown, the parts of connecting are probed along with the first
+    sample, and each sample is broken down by them.
+    """
+
+    def __init__(self, pg, breakdown=False, spacing=SAMPLE_SPACING):
+        self._pg = pg
+        self._breakdown = breakdown
+        self._spacing = spacing
+        self._samples = {}
+        self._started = {}
+        self._handshake = None
+        self.databases = []
+
+    def count(self, db):
+        """Return how many samples of db have been taken."""
+        return len(self._samples.get(db, {}).get('connectionLatency', ()))
+
+    def sample(self, db):
+        """Take another sample of db's latencies."""
+        if db in self._samples:
+            wait = self._started[db] + self._spacing - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+        self._started[db] = time.time()
+
+        if db not in self._samples:
+            # The first sample is the connection the other queries use.
+            connection = self._pg.getConnectionLatencyForDatabase(db)
+            query = self._pg.getQueryLatencyForDatabase(db)
+        else:
+            connection = self._pg.sampleConnection(db)
+            query = self._pg.sampleQuery(db)
+
+        values = dict(connectionLatency=connection, queryLatency=query)
+        if self._breakdown:
+            if self._handshake is None:
+                try:
+                    self._handshake = self._pg.sampleHandshake()
+                except (socket.error, ssl.SSLError):
+                    # The samples still count, only without a breakdown.
+                    self._handshake = (None, None)
+
+            tcp, tls = self._handshake
+            if tcp is not None:
+                values.update(
+                    tcpLatency=tcp,
+                    authLatency=max(0.0, connection - tcp - (tls or 0.0)))
+                if tls is not None:
+                    values['tlsLatency'] = tls
+
+        if db not in self._samples:
+            self._samples[db] = {}
+            self.databases.append(db)
+
+        for name, value in values.iteritems():
+            self._samples[db].setdefault(name, []).append(value)
+
+    def stats(self, db):
+        """Return the latency stats of db's samples."""
+        samples = self._samples.get(db)
+        if not samples:
+            return {}
+
+        stats = {}
+        for name in ('connectionLatency', 'queryLatency'):
+            stats.update(summarize(name, samples[name]))
+
+        for name in BREAKDOWN_STATS:
+            if samples.get(name):
+                stats[name] = median(samples[name])
+
+        return stats
@@ -12,14 +12,60 @@
 #
 ###########################################################################
 
-import copy
 import json
+import optparse
+import os
 import sys
+import time
 import decimal
 
 from os import path
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
-from util import PgHelper
+from util import (
+    PgHelper,
+    RawJSON,
+    RawJSONObject,
+    StatsRecord,
+    TableShard,
+    encodeJSON,
+    spanStats,
+    BLOCKING_STATS,
+    CONNECTION_STATS,
+    DATABASE_DERIVED_STATS,
+    DATABASE_ERRORS,
+    DATABASE_ROLLUPS,
+    DATABASE_SIZE_STAT,
+    ITERSIZE,
+    DATABASE_STAT_COLUMNS,
+    LOCK_STATS,
+    TABLE_ROLLUPS,
+    TABLE_SIZE_STAT,
+    TABLE_STAT_COLUMNS,
+    TABLE_SUMMARY_STATS,
+    TIMEOUT_ERRORS,
+)
+from latency import BREAKDOWN_STATS, LATENCY_STATS, LatencyProbe
+from rollup import Rollups, batches
+import snapshots as store
+
+# Values of the <type> argument, matching the parser that will consume the
+# output.
+LEVELS = ('server', 'database', 'table')
+
+# Share of --timeout spent querying. The rest is left for printing what was
+# collected before zencommand kills the poller.
+DEADLINE_FRACTION = 0.9
+
+# Databases named for each section in the skipped and deferred event.
+SKIPPED_SHOWN = 5
+
+# The event raised for each kind of long running session, and what it calls
+# them.
+LONG_RUNNING_EVENTS = (
+    ('active', 'postgresLongQuery', 'query running'),
+    ('idle in transaction', 'postgresIdleInTransaction',
+     'session idle in transaction'),
+)
 
 
 def clean_dict_data(d):
@@ -28,6 +74,12 @@ def clean_dict_data(d):
         if isinstance(v, decimal.Decimal):
             # convert decimal to string
             fixed.update({k: str(v)})
+        elif isinstance(v, StatsRecord):
+            # records clean themselves up when serialized
+            fixed.update({k: v})
+        elif isinstance(v, RawJSONObject):
+            # recurse, keeping the server-encoded members
+            fixed.update({k: RawJSONObject(v.text, clean_dict_data(v))})
         elif isinstance(v, dict):
             # recurse
             fixed.update({k: clean_dict_data(v)})
@@ -39,127 +91,949 @@ def clean_dict_data(d):
             fixed.update({k: v})
     return fixed
 
+
+def prune_data(d, datapoints, level=None):
+    """
+    Drop values that none of the requested datapoints will consume.
+
+    The server parser only reads top-level values, the database parser only
+    per-database values and the table parser only per-table values, so the
+    other levels are dropped entirely when level is known.
+    """
+    pruned = dict(events=d.get('events', []))
+
+    if level in (None, 'server'):
+        pruned.update(
+            (k, v) for k, v in d.iteritems() if k in datapoints)
+
+    if level == 'server' or 'databases' not in d:
+        return pruned
+
+    pruned['databases'] = {}
+    for dbName, dbStats in d['databases'].iteritems():
+        database = {}
+        if level in (None, 'database'):
+            if isinstance(dbStats, RawJSONObject):
+                # Server-built documents only contain requested stats.
+                database = RawJSONObject(dbStats.text)
+
+            database.update(
+                (k, v) for k, v in dbStats.iteritems() if k in datapoints)
+
+        if level in (None, 'table') and 'tables' in dbStats:
+            if isinstance(dbStats['tables'], RawJSON):
+                database['tables'] = dbStats['tables']
+            else:
+                # Table records only hold the stats that were selected.
+                database['tables'] = dict(
+                    (tableName, tableStats
+                     if isinstance(tableStats, StatsRecord)
+                     else dict(
+                         (k, v) for k, v in tableStats.iteritems()
+                         if k in datapoints))
+                    for tableName, tableStats
+                    in dbStats['tables'].iteritems())
+
+        pruned['databases'][dbName] = database
+
+    return pruned
+
+
+def merge_stats(data, stats):
+    """Merge server and per-database connection or lock stats into data."""
+    for k, v in stats.items():
+        if k == 'databases':
+            for dbName, dbStats in v.items():
+                # Backends without a database, like background workers,
+                # only count towards the server.
+                if dbName is not None:
+                    data['databases'].setdefault(dbName, {}).update(dbStats)
+        else:
+            data[k] = v
+
+
+def addTotalSizes(tables, totalSizes):
+    """Set the total size of each of tables found in totalSizes."""
+    if totalSizes is None:
+        return
+
+    for tableName, tableStats in tables.iteritems():
+        tableStats.totalSize = totalSizes.get(tableName)
+
+
+def skipped_event(skipped, deferred=()):
+    """
+    Return the event listing the (section, database) pairs that were
+    skipped for running out of time or deferred for lack of it, or clearing
+    it if there are none.
+    """
+    event = dict(eventKey='postgresTimeout', eventClassKey='postgresTimeout')
+    if not skipped and not deferred:
+        event.update(severity=0, summary='postgres poll completed in time')
+        return event
+
+    parts = []
+    for label, pairs in (('skipped', skipped), ('deferred', deferred)):
+        if pairs:
+            parts.append('{0}: {1}'.format(label, describe_sections(pairs)))
+
+    event.update(
+        severity=3,
+        summary='postgres poll ran out of time, {0}'.format(
+            '; '.join(parts)))
+
+    return event
+
+
+def failure_events(failed, dbNames=()):
+    """
+    Return an event for the server and for each database, raising them for
+    the sections in failed, as (section, database, error) with None for the
+    server, and clearing them for the server and those of dbNames without.
+    """
+    failures = {}
+    for section, dbName, ex in failed:
+        failures.setdefault(dbName, []).append(
+            '{0}: {1}'.format(section, describe_error(ex)))
+
+    event = dict(
+        eventKey='postgresSectionFailure',
+        eventClassKey='postgresSectionFailure')
+    if None in failures:
+        event.update(
+            severity=4,
+            summary='postgres collection failed, {0}'.format(
+                '; '.join(failures[None])))
+    else:
+        event.update(severity=0, summary='postgres collection succeeded')
+
+    events = [event]
+    for dbName in sorted(set(dbNames) | (set(failures) - set([None]))):
+        event = dict(
+            component=dbName,
+            eventKey='postgresDatabaseFailure',
+            eventClassKey='postgresDatabaseFailure')
+        if dbName in failures:
+            event.update(
+                severity=4,
+                summary='postgres database {0} failed, {1}'.format(
+                    dbName, '; '.join(failures[dbName])))
+        else:
+            event.update(
+                severity=0,
+                summary='postgres database {0} collected'.format(dbName))
+
+        events.append(event)
+
+    return events
+
+
+def long_running_events(longRunning, threshold, dbNames=()):
+    """
+    Return an event for each kind of session of each database, raising it
+    for the sessions in longRunning running for longer than threshold
+    seconds, and clearing it for the databases of dbNames without.
+    """
+    events = []
+    for dbName in sorted(set(dbNames) | set(longRunning)):
+        sessions = longRunning.get(dbName, [])
+        for kind, eventKey, label in LONG_RUNNING_EVENTS:
+            over = [
+                session for session in sessions
+                if session['kind'] == kind and session['seconds'] > threshold]
+
+            event = dict(
+                component=dbName,
+                eventKey=eventKey,
+                eventClassKey=eventKey)
+            if over:
+                summary = 'postgres {0} in {1}: {2}'.format(
+                    label, dbName, describe_session(over[0]))
+                if len(over) > 1:
+                    summary += ' (and {0} more)'.format(len(over) - 1)
+
+                event.update(
+                    severity=3,
+                    summary=summary,
+                    message='\n'.join(
+                        describe_session(session) for session in over))
+            else:
+                event.update(
+                    severity=0,
+                    summary='postgres no {0} in {1} over {2:g}s'.format(
+                        label, dbName, threshold))
+
+            events.append(event)
+
+    return events
+
+
+def describe_session(session):
+    """Return a line describing a session of longRunningFromRows."""
+    parts = ['pid {0} for {1:.0f}s'.format(session['pid'], session['seconds'])]
+    for label, name in (('user', 'user'), ('application', 'application'),
+                        ('waiting on', 'waitEvent')):
+        if session.get(name):
+            parts.append('{0} {1}'.format(label, session[name]))
+
+    if session.get('query'):
+        parts.append('query: {0}'.format(' '.join(session['query'].split())))
+
+    return ', '.join(parts)
+
+
+def blocking_events(blocking, threshold, dbNames=()):
+    """
+    Return an event for each database, raising it for the head blockers of
+    blocking in it with a session waiting on them for longer than threshold
+    seconds, and clearing it for the databases of dbNames without.
+    """
+    heads = {}
+    for head in blocking['heads']:
+        if head['maxWait'] > threshold:
+            heads.setdefault(head['datname'], []).append(head)
+
+    events = []
+    for dbName in sorted(set(dbNames) | set(heads)):
+        event = dict(
+            eventKey='postgresBlocking',
+            eventClassKey='postgresBlocking')
+
+        # Sessions of no database are blocked on the server.
+        if dbName is not None:
+            event['component'] = dbName
+
+        if dbName in heads:
+            summary = 'postgres sessions blocked in {0}: {1}'.format(
+                dbName or 'the server', describe_blocker(heads[dbName][0]))
+            if len(heads[dbName]) > 1:
+                summary += ' (and {0} more)'.format(len(heads[dbName]) - 1)
+
+            event.update(
+                severity=3,
+                summary=summary,
+                message='\n'.join(
+                    describe_blocker(head) for head in heads[dbName]))
+        else:
+            event.update(
+                severity=0,
+                summary='postgres no blocking in {0} over {1:g}s'.format(
+                    dbName, threshold))
+
+        events.append(event)
+
+    return events
+
+
+def describe_blocker(head):
+    """Return a line describing a head blocker of blockingFromRows."""
+    parts = [
+        'pid {0} blocking {1} sessions up to {2:.0f}s, chain depth {3}'.format(
+            head['pid'], head['blocked'], head['maxWait'], head['depth'])]
+    for label, name in (('user', 'user'), ('application', 'application'),
+                        ('state', 'state')):
+        if head.get(name):
+            parts.append('{0} {1}'.format(label, head[name]))
+
+    if head.get('query'):
+        parts.append('query: {0}'.format(' '.join(head['query'].split())))
+
+    return ', '.join(parts)
+
+
+def describe_error(ex):
+    """Return the first line of the message of ex."""
+    lines = str(ex).strip().splitlines()
+    return lines[0] if lines else ex.__class__.__name__
+
+
+def describe_sections(pairs):
+    """Return a summary of (section, database) pairs for an event."""
+    sections = []
+    databases = {}
+    for section, dbName in pairs:
+        if section not in databases:
+            sections.append(section)
+            databases[section] = []
+
+        if dbName is not None:
+            databases[section].append(dbName)
+
+    parts = []
+    for section in sections:
+        dbNames = sorted(databases[section])
+        if not dbNames:
+            parts.append(section)
+            continue
+
+        shown = ', '.join(dbNames[:SKIPPED_SHOWN])
+        if len(dbNames) > SKIPPED_SHOWN:
+            shown += ' and {0} more'.format(len(dbNames) - SKIPPED_SHOWN)
+
+        parts.append('{0} ({1})'.format(section, shown))
+
+    return '; '.join(parts)
+
+
 class PostgresPoller(object):
     _host = None
     _port = None
     _username = None
     _password = None
     _default_db = None
+    _datapoints = None
+    _level = None
+    _serverJSON = False
+    _itersize = None
+    _capture = None
+    _maxConnections = None
+    _timeout = None
+    _statementTimeout = None
+    _tableShards = 1
+    _sizeInterval = None
+    _tableRefresh = 1
+    _snapshotDir = None
+    _snapshotTarget = None
+    _latencySamples = 1
 
-    def __init__(self, host, port, username, password, ssl, default_db):
+    def __init__(self, host, port, username, password, ssl, default_db,
+                 datapoints=None, level=None, serverJSON=False,
+                 itersize=ITERSIZE, capture=None, maxConnections=None,
+                 timeout=None, statementTimeout=None, tableShards=1,
+                 sizeInterval=None, tableRefresh=1, snapshotDir=None,
+                 latencySamples=1, consistent=False,
+                 longRunningThreshold=None, blockingThreshold=None,
+                 snapshotTarget=None):
         self._host = host
         self._port = port
         self._username = username
         self._password = password
         self._ssl = ssl
         self._default_db = default_db
+        self._datapoints = datapoints
+        self._level = level if level in LEVELS else None
+        self._serverJSON = serverJSON
+        self._itersize = itersize
+        self._capture = capture
+        self._maxConnections = maxConnections
+        self._timeout = timeout
+        self._statementTimeout = statementTimeout
+        self._tableShards = max(1, int(tableShards or 1))
+        self._sizeInterval = sizeInterval
+        self._tableRefresh = max(1, int(tableRefresh or 1))
+        self._snapshotDir = snapshotDir
+        self._snapshotTarget = snapshotTarget
+        self._latencySamples = max(1, int(latencySamples or 1))
+        self._consistent = consistent
+        self._longRunningThreshold = longRunningThreshold
+        self._blockingThreshold = blockingThreshold
+
+    def wantedStats(self, stats, levels=LEVELS):
+        """
+        Return the subset of stats that must be collected, or None for all.
+
+        Stats only printed at levels other than the one being polled are
+        never needed.
+        """
+        if self._datapoints is None:
+            return None
+
+        if self._level is not None and self._level not in levels:
+            return []
 
-    def getData(self, pg):
+        return [stat for stat in stats if stat in self._datapoints]
+
+    def needs(self, stats, levels=LEVELS):
+        """Return True if any of stats must be collected."""
+        return self.wantedStats(stats, levels) != []
+
+    def getData(self, pg, snapshots=None, sizes=None, digests=None):
+        """
+        Collect the stats in order of priority: latency, database stats,
+        connection stats, lock stats and then table stats, the most costly
+        and least critical. Work that is projected not to finish before the
+        deadline isn't started, and work that doesn't finish is dropped, so
+        higher priority stats are never lost to lower priority ones.
+        Errors likewise only cost the section and database they happened
+        in, except failing to connect to the default database. Where the
+        server can, the database, connection and lock stats and long
+        running sessions are collected by a single query.
+
+        With snapshots, each database's tables are collected in shards.
+        With sizes, database and total table sizes are only collected when
+        they are due, and repeated from sizes in between. With digests, only
+        tables whose stats are changing are printed, but all of them are
+        still summed up.
+
+        With consistent, the database, connection and lock stats are read
+        from one snapshot, so the other databases' latencies are only
+        sampled after them.
+        """
+        begin = time.time()
         data = dict(events=[])
+        budget = pg.budget
 
-        data.update(
-            connectionLatency=pg.getConnectionLatencyForDatabase(self._default_db),
-            queryLatency=pg.getQueryLatencyForDatabase(self._default_db),
-            )
+        # Sections that ran out of time, and sections not started for lack
+        # of it, are reported keeping whatever else was collected.
+        skipped = []
+        deferred = []
 
-        # Calculated server-level stats.
-        databaseSummaries = dict(
-            size=0,
-            numBackends=0,
-            xactCommit=0,
-            xactRollback=0,
-            xactTotal=0,
-            blksRead=0,
-            blksHit=0,
-            tupReturned=0,
-            tupFetched=0,
-            tupTotal=0,
-            tupInserted=0,
-            tupUpdated=0,
-            tupDeleted=0,
-        )
-
-        tableSummaries = dict(
-            seqScan=0,
-            seqTupRead=0,
-            idxScan=0,
-            idxTupFetch=0,
-            nTupIns=0,
-            nTupUpd=0,
-            nTupDel=0,
-            nTupHotUpd=0,
-            nLiveTup=0,
-            nDeadTup=0,
-        )
-
-        dbTableSummaries = copy.copy(tableSummaries)
+        # Sections that failed, as (section, database, error), are reported
+        # by events of the server and of each database.
+        failed = []
 
-        # Catch exception in DB query to close open pg connection
-        databases = pg.getDatabaseStats()
+        # Nothing can be collected without the default database, which
+        # fails the poll as a whole.
+        pg.getConnection(self._default_db)
 
-        for dbName, dbStats in databases.items():
-            databases[dbName].update(
-                connectionLatency=pg.getConnectionLatencyForDatabase(dbName),
-                queryLatency=pg.getQueryLatencyForDatabase(dbName),
-                )
+        latencyStats = self.wantedStats(
+            LATENCY_STATS, levels=('server', 'database'))
+        wantLatency = latencyStats != []
+        probe = LatencyProbe(pg, breakdown=latencyStats is None or any(
+            name in latencyStats for name in BREAKDOWN_STATS))
+        if wantLatency:
+            try:
+                with budget.measure('latency'):
+                    probe.sample(self._default_db)
+            except TIMEOUT_ERRORS:
+                skipped.append(('latency', self._default_db))
+            except DATABASE_ERRORS, ex:
+                pg.rollback(self._default_db)
+                failed.append(('latency', self._default_db, ex))
 
-            local_dbTableSummaries = copy.copy(dbTableSummaries)
+        # Let the server build the stat documents if asked to and able to.
+        useJSON = self._serverJSON and pg.supportsServerJSON()
 
-            for statName in databaseSummaries.keys():
-                if statName in dbStats and dbStats[statName] is not None:
-                    databaseSummaries[statName] += dbStats[statName]
+        allDbStatNames = (
+            [name for name, _ in DATABASE_STAT_COLUMNS] +
+            DATABASE_DERIVED_STATS.keys())
+        dbStatNames = self.wantedStats(
+            allDbStatNames, levels=('server', 'database'))
 
-            # Average percentage summaries.
-            for statName in ('xactRollbackPct', 'tupFetchedPct'):
-                if statName in dbStats and dbStats[statName] is not None:
-                    if statName in databaseSummaries:
-                        databaseSummaries[statName] = (
-                            (databaseSummaries[statName] +
-                            dbStats[statName]) / 2.0)
-                    else:
-                        databaseSummaries[statName] = \
-                            dbStats[statName]
+        # With sizes, database sizes are collected on a cadence of their
+        # own and repeated in between.
+        wantDatabaseSizes = sizes is not None and (
+            dbStatNames is None or DATABASE_SIZE_STAT in dbStatNames)
+        if wantDatabaseSizes:
+            dbStatNames = [
+                name for name in dbStatNames or allDbStatNames
+                if name != DATABASE_SIZE_STAT]
 
-            # Catch exception in table query to close open pg connection
-            tables = pg.getTableStatsForDatabase(dbName)
+        wantConnections = self.needs(
+            CONNECTION_STATS, levels=('server', 'database'))
+        wantLocks = self.needs(LOCK_STATS, levels=('server', 'database'))
 
-            for tableName, tableStats in tables.items():
-                for statName in tableSummaries.keys():
-                    if statName in tableStats \
-                            and tableStats[statName] is not None:
-                        tableSummaries[statName] += tableStats[statName]
-                        local_dbTableSummaries[statName] += \
-                            tableStats[statName]
+        # Long running sessions are only reported by events, which only the
+        # server's parser sends on.
+        wantLongRunning = bool(self._longRunningThreshold) and \
+            self._level in (None, 'server')
 
-            databases[dbName].update(local_dbTableSummaries)
-            databases[dbName]['tables'] = tables
+        # Blocking chains are server stats, and name their head blockers
+        # by events.
+        blockingEvents = bool(self._blockingThreshold) and \
+            self._level in (None, 'server')
+        wantBlocking = blockingEvents or self.needs(
+            BLOCKING_STATS, levels=('server',))
+
+        # The server sections are combined into one query where the server
+        # can, saving a round trip for each.
+        sections = [
+            section for section, wanted in (
+                ('databaseStats', not useJSON),
+                ('connectionStats', wantConnections),
+                ('locks', wantLocks),
+                ('longRunning', wantLongRunning),
+                ('blocking', wantBlocking))
+            if wanted]
+        serverStats = self.getServerStats(pg, sections, dbStatNames, skipped)
+
+        if 'databaseStats' in serverStats:
+            databases = serverStats['databaseStats']
+            databaseSummaries = None
+        elif ('databaseStats', None) in skipped:
+            databases, databaseSummaries = {}, {}
+        else:
+            databases, databaseSummaries = self.getDatabaseStats(
+                pg, useJSON, dbStatNames, skipped, failed)
+
+        if sizes is not None and databases:
+            # Table sizes of databases no longer there are forgotten.
+            sizes.retain(databases)
+
+        # A server size summing up only some databases would dip.
+        missingSizes = False
+        if wantDatabaseSizes and databases:
+            databaseSizes = self.getSizes(
+                pg, sizes, skipped, deferred, failed)
+            missingSizes = any(
+                dbName not in databaseSizes for dbName in databases)
+            if missingSizes:
+                # A new database, or sizes not collected yet. Get them next
+                # time.
+                sizes.expire()
+
+            for dbName, dbStats in databases.iteritems():
+                if dbName not in databaseSizes:
+                    continue
+
+                if useJSON:
+                    dbStats.update(size=databaseSizes[dbName])
+                else:
+                    dbStats.size = databaseSizes[dbName]
+
+            if useJSON and not missingSizes:
+                databaseSummaries[DATABASE_SIZE_STAT] = sum(
+                    databaseSizes[dbName] for dbName in databases)
+
+        if databaseSummaries is None:
+            databaseSummaries = Rollups(DATABASE_ROLLUPS).evaluate(
+                databases.values())
+            if missingSizes:
+                databaseSummaries.pop(DATABASE_SIZE_STAT, None)
+
+            # Connection, lock and table stats get merged in below.
+            databases = dict(
+                (dbName, dict(dbStats.iteritems()))
+                for dbName, dbStats in databases.iteritems())
 
         data.update(databaseSummaries)
-        data.update(tableSummaries)
         data['databases'] = databases
 
+        # Consistent stats are read before the other databases are sampled,
+        # not to wait on their connections.
+        if wantLatency and not self._consistent:
+            self.getLatency(pg, probe, data, skipped, deferred, failed)
+
         # Connection stats.
-        for k, v in pg.getConnectionStats().items():
-            if k == 'databases':
-                for dbName, stats in v.items():
-                    data['databases'][dbName].update(stats)
+        if 'connectionStats' in serverStats:
+            merge_stats(data, serverStats['connectionStats'])
+        elif wantConnections and ('connectionStats', None) not in skipped:
+            if not budget.allows('connectionStats'):
+                deferred.append(('connectionStats', None))
             else:
-                data[k] = v
+                try:
+                    with budget.measure('connectionStats'):
+                        merge_stats(data, pg.getConnectionStats())
+                except TIMEOUT_ERRORS:
+                    pg.rollback(self._default_db)
+                    skipped.append(('connectionStats', None))
+                except DATABASE_ERRORS, ex:
+                    pg.rollback(self._default_db)
+                    failed.append(('connectionStats', None, ex))
 
         # Lock stats.
-        for k, v in pg.getLocks().items():
-            if k == 'databases':
-                for dbName, stats in v.items():
-                    data['databases'][dbName].update(stats)
+        if 'locks' in serverStats:
+            merge_stats(data, serverStats['locks'])
+        elif wantLocks and ('locks', None) not in skipped:
+            if not budget.allows('locks'):
+                deferred.append(('locks', None))
+            else:
+                try:
+                    with budget.measure('locks'):
+                        merge_stats(data, pg.getLocks())
+                except TIMEOUT_ERRORS:
+                    pg.rollback(self._default_db)
+                    skipped.append(('locks', None))
+                except DATABASE_ERRORS, ex:
+                    pg.rollback(self._default_db)
+                    failed.append(('locks', None, ex))
+
+        # Long running queries and transactions.
+        longRunning = None
+        if 'longRunning' in serverStats:
+            longRunning = serverStats['longRunning']
+        elif wantLongRunning and ('longRunning', None) not in skipped:
+            if not budget.allows('longRunning'):
+                deferred.append(('longRunning', None))
+            else:
+                try:
+                    with budget.measure('longRunning'):
+                        longRunning = pg.getLongRunning()
+                except TIMEOUT_ERRORS:
+                    pg.rollback(self._default_db)
+                    skipped.append(('longRunning', None))
+                except DATABASE_ERRORS, ex:
+                    pg.rollback(self._default_db)
+                    failed.append(('longRunning', None, ex))
+
+        # Sessions waiting on locks and what blocks them.
+        blocking = None
+        if 'blocking' in serverStats:
+            blocking = serverStats['blocking']
+        elif wantBlocking and ('blocking', None) not in skipped:
+            if not budget.allows('blocking'):
+                deferred.append(('blocking', None))
             else:
-                data[k] = v
+                try:
+                    with budget.measure('blocking'):
+                        blocking = pg.getBlocking()
+                except TIMEOUT_ERRORS:
+                    pg.rollback(self._default_db)
+                    skipped.append(('blocking', None))
+                except DATABASE_ERRORS, ex:
+                    pg.rollback(self._default_db)
+                    failed.append(('blocking', None, ex))
+
+        if blocking is not None:
+            for name in BLOCKING_STATS:
+                data[name] = blocking[name]
+
+        if self._consistent:
+            pg.endSnapshot()
+            if wantLatency:
+                self.getLatency(pg, probe, data, skipped, deferred, failed)
+
+        # The server and database levels only print table summaries. Only
+        # the table level needs the rest of the table stats.
+        tableDocuments = self._level not in ('server', 'database')
+        if tableDocuments:
+            tableStatNames = self.wantedStats(
+                [name for name, _ in TABLE_STAT_COLUMNS])
+        else:
+            tableStatNames = self.wantedStats(TABLE_SUMMARY_STATS)
+
+        tableRollups = Rollups(TABLE_ROLLUPS, names=tableStatNames)
+        tableStates = []
+
+        # Filling in or leaving out tables needs their stats decoded.
+        tableJSON = useJSON and snapshots is None and (
+            digests is None or not tableDocuments)
+
+        # Total sizes are only printed with the tables, and with sizes are
+        # collected on a cadence of their own.
+        wantTotalSizes = sizes is not None and tableDocuments and (
+            tableStatNames is None or TABLE_SIZE_STAT in tableStatNames)
+
+        failedLatency = set(
+            dbName for section, dbName, _ in failed if section == 'latency')
+
+        # Databases whose shards haven't all been collected yet.
+        warmingUp = []
+
+        # No datapoint using table stats means not connecting at all.
+        wantTables = tableStatNames is None or tableStatNames
+        for dbName in sorted(databases) if wantTables else ():
+            if ('latency', dbName) in skipped:
+                # Its connection already ran out of time.
+                skipped.append(('tableStats', dbName))
+                continue
+
+            if dbName in failedLatency:
+                # Its connection already failed, as its event says.
+                continue
+
+            if not budget.allows('tableStats'):
+                deferred.append(('tableStats', dbName))
+                continue
+
+            totalSizes = None
+            if wantTotalSizes:
+                totalSizes = self.getSizes(
+                    pg, sizes, skipped, deferred, failed, dbName=dbName)
+
+            # Catch exception in table query to close open pg connection
+            try:
+                with budget.measure('tableStats'):
+                    tables, state = self.getTableStats(
+                        pg, dbName, tableRollups, tableStatNames,
+                        tableDocuments, tableJSON, snapshots, totalSizes)
+            except TIMEOUT_ERRORS:
+                # Partial tables would make their sums dip, so the
+                # database gets none.
+                pg.rollback(dbName)
+                skipped.append(('tableStats', dbName))
+                continue
+            except DATABASE_ERRORS, ex:
+                pg.rollback(dbName)
+                failed.append(('tableStats', dbName, ex))
+                continue
+
+            if digests is not None and tableDocuments:
+                tables = digests.changed(dbName, tables)
+
+            databases[dbName]['tables'] = tables
+            if state is None:
+                warmingUp.append(dbName)
+                continue
+
+            tableStates.append(state)
+            databases[dbName].update(tableRollups.results(state))
+
+        missingTables = [
+            dbName for section, dbName in skipped + deferred
+            if section == 'tableStats'] + [
+            dbName for section, dbName, _ in failed
+            if section in ('latency', 'tableStats') and dbName in databases]
+        if not missingTables and not warmingUp:
+            data.update(
+                tableRollups.results(tableRollups.merge(*tableStates)))
+
+        data['events'].append(skipped_event(skipped, deferred))
+        data['events'].extend(failure_events(failed, databases))
+        if longRunning is not None:
+            data['events'].extend(long_running_events(
+                longRunning, self._longRunningThreshold, databases))
+        if blocking is not None and blockingEvents:
+            data['events'].extend(blocking_events(
+                blocking, self._blockingThreshold, databases))
+
+        # What this poll cost, from the spans recorded by each query.
+        data.update(spanStats(pg.spans))
+        data['collectionDuration'] = time.time() - begin
+
+        if self._datapoints is not None:
+            data = prune_data(data, self._datapoints, self._level)
 
         return data
 
-    def printJSON(self):
+    def getDatabaseStats(self, pg, useJSON, dbStatNames, skipped, failed):
+        """
+        Return the stats of each database and their summaries, or None
+        for the summaries if they are left to be calculated.
+        """
+        # Catch exception in DB query to close open pg connection
+        try:
+            with pg.budget.measure('databaseStats'):
+                if useJSON:
+                    # Summaries are calculated by the server.
+                    return pg.getDatabaseStatsJSON(stats=dbStatNames)
+
+                return pg.getDatabaseStats(stats=dbStatNames), None
+        except TIMEOUT_ERRORS:
+            pg.rollback(self._default_db)
+            skipped.append(('databaseStats', None))
+        except DATABASE_ERRORS, ex:
+            pg.rollback(self._default_db)
+            failed.append(('databaseStats', None, ex))
+
+        return {}, {}
+
+    def getServerStats(self, pg, sections, dbStatNames, skipped):
+        """
+        Return the stats of each of sections, collected by one query, or
+        none if the server can't combine them or there is only one. They
+        are then each queried on their own, which also tells which of them
+        failed if the combined query does. Running out of time skips all
+        of them.
+        """
+        if len(sections) < 2 or not pg.supportsServerBatch():
+            return {}
+
+        try:
+            with pg.budget.measure('serverStats'):
+                return pg.getServerStats(sections, stats=dbStatNames)
+        except TIMEOUT_ERRORS:
+            pg.rollback(self._default_db)
+            skipped.extend((section, None) for section in sections)
+        except DATABASE_ERRORS:
+            pg.rollback(self._default_db)
+
+        return {}
+
+    def getLatency(self, pg, probe, data, skipped, deferred, failed):
+        """
+        Sample the latencies of each database in data the level prints and
+        not sampled yet, and then the rest of the samples of all of them,
+        adding their stats to data.
+        """
+        budget = pg.budget
+        databases = data['databases']
+
+        if self._level == 'server':
+            # Only the default database's latency is printed.
+            sampled = [self._default_db]
+        else:
+            sampled = sorted(databases)
+
+        # Each database's latency takes a connection of its own, which its
+        # table stats reuse.
+        for dbName in sampled:
+            if probe.count(dbName):
+                continue
+
+            if not budget.allows('latency'):
+                deferred.append(('latency', dbName))
+                continue
+
+            try:
+                with budget.measure('latency'):
+                    probe.sample(dbName)
+            except TIMEOUT_ERRORS:
+                skipped.append(('latency', dbName))
+            except DATABASE_ERRORS, ex:
+                pg.rollback(dbName)
+                failed.append(('latency', dbName, ex))
+
+        self.sampleLatency(pg, probe)
+
+        data.update(probe.stats(self._default_db))
+        for dbName in databases:
+            databases[dbName].update(probe.stats(dbName))
+
+    def sampleLatency(self, pg, probe):
+        """
+        Take the rest of the latency samples of each database probe has
+        sampled, a round of all of them at a time so the samples of each
+        are spread out. Samples are only taken while there is time for
+        them, and stats are summarized from however many were.
+        """
+        for _ in range(1, self._latencySamples):
+            for dbName in probe.databases:
+                if not pg.budget.allows('latencySample'):
+                    return
+
+                try:
+                    with pg.budget.measure('latencySample'):
+                        probe.sample(dbName)
+                except TIMEOUT_ERRORS:
+                    return
+                except DATABASE_ERRORS:
+                    # Only costs the sample. Its stats come from the others.
+                    pg.rollback(dbName)
+
+    def getSizes(self, pg, sizes, skipped, deferred, failed, dbName=None):
+        """
+        Return the sizes of dbName's tables, or of the databases, from
+        sizes, collecting them first if they are due and there is time.
+        """
+        kind = 'databaseSizes' if dbName is None else 'tableSizes'
+        if not sizes.due(dbName):
+            return sizes.get(dbName)
+
+        if not pg.budget.allows(kind):
+            deferred.append((kind, dbName))
+            return sizes.get(dbName)
+
+        try:
+            with pg.budget.measure(kind):
+                if dbName is None:
+                    sizes.set(pg.getDatabaseSizes())
+                else:
+                    sizes.set(pg.getTableSizes(dbName), dbName=dbName)
+        except TIMEOUT_ERRORS:
+            # The last sizes collected are used until the next poll.
+            pg.rollback(dbName or self._default_db)
+            skipped.append((kind, dbName))
+        except DATABASE_ERRORS, ex:
+            pg.rollback(dbName or self._default_db)
+            failed.append((kind, dbName, ex))
+
+        return sizes.get(dbName)
+
+    def getTableStats(self, pg, dbName, tableRollups, tableStatNames,
+                      tableDocuments, useJSON, snapshots=None,
+                      totalSizes=None):
+        """
+        Return the tables of dbName to print, and the tableRollups state
+        summing them up, or None while snapshots are still being filled
+        in. Given totalSizes, tables get their total sizes from it instead
+        of calculating them.
+        """
+        if useJSON:
+            tables, summaries = pg.getTableStatsForDatabaseJSON(
+                dbName,
+                stats=tableStatNames,
+                summaries=TABLE_SUMMARY_STATS,
+                documents=tableDocuments,
+                totalSizes=totalSizes)
+
+            # The server summed the tables up. Sums are their own state.
+            return tables, [
+                summaries.get(r.name) for r in tableRollups.rollups]
+
+        if totalSizes is not None:
+            tableStatNames = [
+                name for name in tableStatNames or
+                [name for name, _ in TABLE_STAT_COLUMNS]
+                if name != TABLE_SIZE_STAT]
+
+        if snapshots is not None:
+            # Only this cycle's shard is collected. The other tables are
+            # filled in from snapshots.
+            shard = TableShard(
+                snapshots.shard(self._tableShards),
+                self._tableShards,
+                hot=snapshots.hotTables(dbName))
+
+            fresh = pg.getTableStatsForDatabase(
+                dbName, stats=tableStatNames, shard=shard)
+            addTotalSizes(fresh, totalSizes)
+
+            tables = snapshots.merge(dbName, fresh, self._tableShards)
+
+            # Sums of the tables known so far would jump as the rest are
+            # collected.
+            state = None
+            if snapshots.complete(dbName, self._tableShards):
+                state = tableRollups.state(tables.itervalues())
+
+            return tables if tableDocuments else {}, state
+
+        tables = {}
+        batchStates = []
+
+        # Rows are streamed and rolled up a batch at a time. Only keep them
+        # if they will be printed.
+        for batch in batches(
+                pg.iterTableStatsForDatabase(dbName, stats=tableStatNames),
+                self._itersize):
+            # Each batch is fetched by a query of its own.
+            pg.checkDeadline()
+
+            batchStates.append(tableRollups.state(
+                tableStats for _, tableStats in batch))
+
+            if tableDocuments:
+                tables.update(batch)
+
+        addTotalSizes(tables, totalSizes)
+        return tables, tableRollups.merge(*batchStates)
+
+    def encode(self, data):
+        """Serialize data that has been through clean_dict_data."""
+        if self._serverJSON:
+            return encodeJSON(data)
+
+        return json.dumps(data, default=lambda o: o.toJSON())
+
+    def poll(self):
+        """Poll the server and return the JSON document to print."""
         pg = None
         data = None
 
+        # Queries stop at the deadline. Without a statement timeout of its
+        # own, a single query may use up to half of the time before then.
+        deadline = statementTimeout = None
+        if self._timeout:
+            deadline = time.time() + self._timeout * DEADLINE_FRACTION
+            statementTimeout = self._timeout * DEADLINE_FRACTION / 2
+
+        if self._statementTimeout:
+            statementTimeout = self._statementTimeout
+
+        # Stats kept between polls, for collecting tables in shards, sizes
+        # less often and printing only the tables that changed, and the
+        # events raised, to only clear those.
+        directory = self._snapshotDir or store.defaultDirectory()
+
+        def path(suffix=''):
+            return store.snapshotPath(
+                directory, self._host, self._port, self._level,
+                suffix=suffix, target=self._snapshotTarget)
+
+        raised = store.RaisedEvents(path('-events'))
+
+        snapshots = sizes = digests = None
+        if self._tableShards > 1:
+            snapshots = store.TableSnapshots(path())
+
+        if self._sizeInterval:
+            sizes = store.SizeCache(path('-sizes'), self._sizeInterval)
+
+        if self._tableRefresh > 1:
+            digests = store.TableDigests(
+                path('-digests'), self._tableRefresh)
+
         try:
             pg = PgHelper(
                 self._host,
@@ -167,10 +1041,22 @@ class PostgresPoller(object):
                 self._username,
                 self._password,
                 self._ssl,
-                self._default_db
+                self._default_db,
+                itersize=self._itersize,
+                capture=self._capture,
+                maxConnections=self._maxConnections,
+                statementTimeout=statementTimeout,
+                deadline=deadline,
+                consistent=self._consistent,
                 )
 
-            data = self.getData(pg)
+            data = self.getData(
+                pg, snapshots=snapshots, sizes=sizes, digests=digests)
+            data['events'] = raised.filter(data['events'])
+            for kept in (snapshots, sizes, digests, raised):
+                if kept is not None:
+                    kept.save()
+
             data['events'].append(dict(
                 severity=0,
                 summary='postgres connectivity restored',
@@ -199,10 +1085,16 @@ class PostgresPoller(object):
             if pg:
                 pg.close()
 
-        print json.dumps(clean_dict_data(data))
+        return self.encode(clean_dict_data(data))
+
+    def printJSON(self):
+        print self.poll()
+
 
 if __name__ == '__main__':
-    usage = "Usage: {0} <host> <port> <username> <password <ssl> <defaultDB>"
+    usage = (
+        "Usage: {0} <host> <port> <username> <password <ssl> <defaultDB>"
+        " [<type> [<datapoint,...>]] [options]")
 
     host = port = username = password = ssl = default_db = None
     try:
@@ -214,5 +1106,127 @@ if __name__ == '__main__':
     if ssl == 'False':
         ssl = False
 
-    poller = PostgresPoller(host, port, username, password, ssl, default_db)
-    poller.printJSON()
+    # Options are only parsed after the connection arguments so that a
+    # password starting with a dash isn't mistaken for one.
+    parser = optparse.OptionParser(usage=usage.format(sys.argv[0]))
+    parser.add_option(
+        '--server-json', dest='serverJSON', action='store_true',
+        default=False,
+        help="Have PostgreSQL build the stat documents with json_agg")
+
+    parser.add_option(
+        '--itersize', dest='itersize', type='int', default=ITERSIZE,
+        help="Table rows fetched per round trip [default: %default]")
+
+    parser.add_option(
+        '--timeout', dest='timeout', type='float',
+        help="Seconds zencommand allows the poll (zCommandCommandTimeout)."
+             " Querying stops in time to print what was collected")
+
+    parser.add_option(
+        '--statement-timeout', dest='statementTimeout', type='float',
+        help="Seconds a single query may run [default: half of the"
+             " querying time with --timeout]")
+
+    parser.add_option(
+        '--table-shards', dest='tableShards', type='int', default=1,
+        help="Collect each database's tables over this many polls, plus"
+             " the large and active ones every poll [default: %default]")
+
+    parser.add_option(
+        '--size-interval', dest='sizeInterval', type='float',
+        help="Seconds between collections of database and total table"
+             " sizes, which are repeated in between [default: every poll]")
+
+    parser.add_option(
+        '--table-refresh', dest='tableRefresh', type='int', default=1,
+        help="Only print the tables whose stats are changing, and all of"
+             " them every this many polls [default: %default, all of them"
+             " every poll]")
+
+    parser.add_option(
+        '--snapshot-dir', dest='snapshotDir',
+        help="Keep stats between polls here, for --table-shards,"
+             " --size-interval and --table-refresh, and the events raised"
+             " [default: $ZENHOME/var/postgresql]")
+
+    parser.add_option(
+        '--latency-samples', dest='latencySamples', type='int', default=1,
+        help="Samples of each database's connection and SELECT 1 latency"
+             " per poll [default: %default]")
+
+    parser.add_option(
+        '--consistent', dest='consistent', action='store_true',
+        default=False,
+        help="Read the database, connection and lock stats from one"
+             " snapshot")
+
+    parser.add_option(
+        '--long-running-threshold', dest='longRunningThreshold',
+        type='float',
+        help="Raise events for queries running and sessions idle in"
+             " transaction for longer than this many seconds")
+
+    parser.add_option(
+        '--blocking-threshold', dest='blockingThreshold', type='float',
+        help="Raise events naming the sessions blocking others waiting on"
+             " a lock for longer than this many seconds")
+
+    parser.add_option(
+        '--capture', dest='capture',
+        help="Record the queries and results to this capture file")
+
+    parser.add_option(
+        '--anonymize', dest='anonymize', action='store_true', default=False,
+        help="Replace names in the capture file with pseudonyms")
+
+    parser.add_option(
+        '--profile', dest='profile',
+        default=os.environ.get('ZP_POSTGRESQL_PROFILE'),
+        help="Write a profile of the poll to this directory"
+             " [default: $ZP_POSTGRESQL_PROFILE]")
+
+    options, args = parser.parse_args(sys.argv[7:])
+
+    level = args[0] if len(args) > 0 else None
+
+    # Optional comma-separated list of the datapoints the calling datasource
+    # defines. Only the stats they need are collected and printed.
+    datapoints = None
+    if len(args) > 1 and args[1]:
+        datapoints = set(x.strip() for x in args[1].split(',') if x.strip())
+
+    # Capturing and profiling are rare, so their modules are only imported
+    # when asked for.
+    capture = None
+    if options.capture:
+        from capture import Recorder
+        capture = Recorder(options.capture, anonymize=options.anonymize)
+
+    poller = PostgresPoller(
+        host, port, username, password, ssl, default_db, datapoints, level,
+        serverJSON=options.serverJSON, itersize=options.itersize,
+        capture=capture, timeout=options.timeout,
+        statementTimeout=options.statementTimeout,
+        tableShards=options.tableShards, sizeInterval=options.sizeInterval,
+        tableRefresh=options.tableRefresh, snapshotDir=options.snapshotDir,
+        latencySamples=options.latencySamples,
+        consistent=options.consistent,
+        longRunningThreshold=options.longRunningThreshold,
+        blockingThreshold=options.blockingThreshold)
+
+    profile = None
+    if options.profile:
+        from profiling import Profile
+        profile = Profile(
+            options.profile, '{0}-{1}'.format(host, level or 'all'))
+
+    try:
+        if profile:
+            with profile:
+                poller.printJSON()
+        else:
+            poller.printJSON()
+    finally:
+        if capture:
+            capture.close()
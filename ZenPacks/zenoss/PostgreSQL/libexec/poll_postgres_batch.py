@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Poll many PostgreSQL servers from one process.
+
+Starting poll_postgres.py once per device and template costs an interpreter
+and a psycopg2 import each time. This polls a list of targets concurrently
+from one process instead, producing for each target the same document
+poll_postgres.py prints for it.
+
+Targets are read as JSON lines from a file, or stdin for -, with the same
+settings poll_postgres.py takes as arguments:
+
+    {"id": "pg1-server", "host": "10.0.0.1", "port": 5432,
+     "username": "zenoss", "password": "...", "ssl": false,
+     "defaultDB": "postgres", "type": "server",
+     "datapoints": "connectionLatency,queryLatency"}
+
+id names the target's results and must be unique. type, datapoints, and
+timeout, statementTimeout, tableShards, sizeInterval, tableRefresh,
+latencySamples, consistent, longRunningThreshold and blockingThreshold for
+poll_postgres.py's options of the same names, are optional. Each target's
+result is printed as one line as it completes:
+
+    {"id": "pg1-server", "seconds": 0.42, "output": {...}}
+
+and with --output-dir also written to <output-dir>/<id>.json on its own,
+replaced atomically, for per-device consumers.
+
+Stats kept between polls are kept per target id, as targets polling the
+same server and level at the same time would overwrite each other's.
+
+--concurrency targets are polled at a time, by threads since polling
+mostly waits on the network. No more than --max-connections connections
+are open at once: each poll gets an equal share and closes its least
+recently used connection when it needs another.
+"""
+
+import json
+import optparse
+import os
+import Queue
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from poll_postgres import PostgresPoller
+from util import ITERSIZE
+
+# Target settings, in the order poll_postgres.py takes them as arguments.
+CONNECTION_SETTINGS = (
+    'host', 'port', 'username', 'password', 'ssl', 'defaultDB')
+
+
+def readTargets(lines):
+    """Return the target dicts in lines of JSON, skipping blank lines."""
+    targets = []
+    ids = set()
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        target = json.loads(line)
+        missing = [
+            name for name in ('id',) + CONNECTION_SETTINGS
+            if name not in target]
+        if missing:
+            raise ValueError("target on line {0} has no {1}".format(
+                number, ', '.join(missing)))
+
+        if target['id'] in ids:
+            raise ValueError("target id {0!r} on line {1} is repeated".format(
+                target['id'], number))
+
+        ids.add(target['id'])
+        targets.append(target)
+
+    return targets
+
+
+def poller(target, options, maxConnections):
+    """Return a PostgresPoller for target."""
+    datapoints = target.get('datapoints')
+    if isinstance(datapoints, basestring):
+        datapoints = [x.strip() for x in datapoints.split(',')]
+    if datapoints is not None:
+        datapoints = set(x for x in datapoints if x)
+
+    ssl = target['ssl']
+    if ssl == 'False':
+        ssl = False
+
+    return PostgresPoller(
+        *[target[name] for name in CONNECTION_SETTINGS],
+        datapoints=datapoints or None,
+        level=target.get('type'),
+        serverJSON=target.get('serverJSON', options.serverJSON),
+        itersize=options.itersize,
+        maxConnections=maxConnections,
+        timeout=target.get('timeout'),
+        statementTimeout=target.get('statementTimeout'),
+        tableShards=target.get('tableShards', 1),
+        sizeInterval=target.get('sizeInterval'),
+        tableRefresh=target.get('tableRefresh', 1),
+        snapshotDir=options.snapshotDir,
+        snapshotTarget=target['id'],
+        latencySamples=target.get('latencySamples', 1),
+        consistent=target.get('consistent', False),
+        longRunningThreshold=target.get('longRunningThreshold'),
+        blockingThreshold=target.get('blockingThreshold'))
+
+
+def failure(ex):
+    """Return the document poll_postgres.py prints when it fails."""
+    return json.dumps(dict(events=[dict(
+        severity=4,
+        summary='postgres failure: {0}'.format(ex),
+        eventKey='postgresFailure',
+        eventClassKey='postgresFailure',
+    )]))
+
+
+def work(targets, results, options, maxConnections):
+    """Poll targets until there are none left, putting results on results."""
+    while True:
+        try:
+            target = targets.get_nowait()
+        except Queue.Empty:
+            return
+
+        begin = time.time()
+        try:
+            output = poller(target, options, maxConnections).poll()
+        except Exception, ex:
+            output = failure(ex)
+
+        results.put((target['id'], time.time() - begin, output))
+
+
+def writeOutput(directory, id, output):
+    """Atomically replace directory/<id>.json with output."""
+    name = re.sub(r'[^\w.-]', '_', id)
+    fd, path = tempfile.mkstemp(prefix='.' + name, dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        f.write(output)
+        f.write('\n')
+
+    os.rename(path, os.path.join(directory, name + '.json'))
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] <targets file>")
+    parser.add_option(
+        '--concurrency', type='int', default=10,
+        help="Targets polled at the same time [default: %default]")
+    parser.add_option(
+        '--max-connections', dest='maxConnections', type='int', default=50,
+        help="Connections open at the same time [default: %default]")
+    parser.add_option(
+        '--output-dir', dest='outputDir',
+        help="Also write each target's document to <id>.json here")
+    parser.add_option(
+        '--server-json', dest='serverJSON', action='store_true',
+        default=False,
+        help="Have PostgreSQL build the stat documents with json_agg")
+    parser.add_option(
+        '--itersize', dest='itersize', type='int', default=ITERSIZE,
+        help="Table rows fetched per round trip [default: %default]")
+    parser.add_option(
+        '--snapshot-dir', dest='snapshotDir',
+        help="Keep stats between polls here, for tableShards,"
+             " sizeInterval and tableRefresh"
+             " [default: $ZENHOME/var/postgresql]")
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("a targets file is required")
+
+    if args[0] == '-':
+        targets = readTargets(sys.stdin)
+    else:
+        with open(args[0]) as f:
+            targets = readTargets(f)
+
+    # Every poll gets an equal share of the connections, so polls never
+    # wait on each other for one.
+    workers = max(1, min(
+        options.concurrency, options.maxConnections, len(targets)))
+    maxConnections = max(1, options.maxConnections // workers)
+
+    queue = Queue.Queue()
+    for target in targets:
+        queue.put(target)
+
+    results = Queue.Queue()
+    threads = [
+        threading.Thread(
+            target=work, args=(queue, results, options, maxConnections))
+        for _ in range(workers)]
+
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    for _ in targets:
+        id, seconds, output = results.get()
+        if options.outputDir:
+            writeOutput(options.outputDir, id, output)
+
+        print '{{"id": {0}, "seconds": {1:.3f}, "output": {2}}}'.format(
+            json.dumps(id), seconds, output)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
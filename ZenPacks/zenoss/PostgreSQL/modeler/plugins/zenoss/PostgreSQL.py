@@ -19,7 +19,10 @@ from Products.DataCollector.plugins.CollectorPlugin import PythonPlugin
 from Products.DataCollector.plugins.DataMaps import ObjectMap, RelationshipMap
 from Products.ZenUtils.Utils import prepId
 
-from ZenPacks.zenoss.PostgreSQL.util import PgHelper, exclude_patterns_list, is_suppressed
+from ZenPacks.zenoss.PostgreSQL.asyncutil import AsyncPgHelper
+from ZenPacks.zenoss.PostgreSQL.capture import recorderFromEnvironment
+from ZenPacks.zenoss.PostgreSQL.profiling import profiled
+from ZenPacks.zenoss.PostgreSQL.util import exclude_patterns_list
 
 from twisted.internet import defer
 
@@ -34,16 +37,29 @@ class PostgreSQL(PythonPlugin):
         'zPostgreSQLTableRegex',
     )
 
+    @profiled('collect')
     @defer.inlineCallbacks
     def collect(self, device, unused):
         """Async collect using Twisted Deferred for better performance."""
-        pg = PgHelper(
+        capture = recorderFromEnvironment('{0}-model'.format(device.id))
+        try:
+            results = yield self.collectWith(device, capture)
+        finally:
+            if capture:
+                capture.close()
+
+        defer.returnValue(results)
+
+    @defer.inlineCallbacks
+    def collectWith(self, device, capture=None):
+        pg = AsyncPgHelper(
             device.manageIp,
             device.zPostgreSQLPort,
             device.zPostgreSQLUsername,
             device.zPostgreSQLPassword,
             device.zPostgreSQLUseSSL,
-            device.zPostgreSQLDefaultDB)
+            device.zPostgreSQLDefaultDB,
+            capture=capture)
 
         results = {}
         exclude_patterns = exclude_patterns_list(getattr(device, 'zPostgreSQLTableRegex', []))
@@ -70,7 +86,8 @@ class PostgreSQL(PythonPlugin):
 
             results['databases'][dbName]['tables'] = {}
             db_names.append(dbName)
-            table_deferreds.append(pg.getTablesInDatabaseAsync(dbName))
+            table_deferreds.append(
+                pg.getTablesInDatabaseAsync(dbName, exclude_patterns))
 
         if table_deferreds:
             log.info("Getting tables list for {0} databases in parallel".format(len(db_names)))
@@ -85,13 +102,8 @@ class PostgreSQL(PythonPlugin):
                         dbName, result.getErrorMessage() if hasattr(result, 'getErrorMessage') else result))
                     continue
 
-                tables = result
-                if exclude_patterns:
-                    for key in tables.keys():
-                        if is_suppressed(key, exclude_patterns):
-                            del tables[key]
-
-                results['databases'][dbName]['tables'] = tables
+                # Excluded tables were already dropped as rows streamed in.
+                results['databases'][dbName]['tables'] = result
 
         # Close pool after collection
         try:
@@ -101,6 +113,7 @@ class PostgreSQL(PythonPlugin):
 
         defer.returnValue(results)
 
+    @profiled('process')
     def process(self, devices, results, unused):
         if results is None:
             return None
@@ -127,15 +140,15 @@ class PostgreSQL(PythonPlugin):
                 continue
 
             tables = []
-            for tableName, tableDetail in dbDetail['tables'].items():
+            for tableName, tableDetail in dbDetail['tables'].iteritems():
                 tables.append(ObjectMap(data=dict(
                     id='{0}_{1}'.format(prepId(dbName), prepId(tableName)),
                     title=tableName,
                     tableName=tableName,
-                    tableOid=tableDetail['oid'],
-                    tableSchema=tableDetail['schema'],
-                    modeled_size=tableDetail['size'],
-                    modeled_totalSize=tableDetail['totalSize'],
+                    tableOid=tableDetail.oid,
+                    tableSchema=tableDetail.schema,
+                    modeled_size=tableDetail.size,
+                    modeled_totalSize=tableDetail.totalSize,
                 )))
 
             maps.append(RelationshipMap(
@@ -14,6 +14,7 @@
 import json
 
 from Products.ZenRRD.CommandParser import CommandParser
+from Products.ZenUtils.Utils import prepId
 
 class server(CommandParser):
     def processResults(self, cmd, result):
@@ -33,5 +34,11 @@ class server(CommandParser):
             for event in data['events']:
                 # Keys must be converted from unicode to str.
                 event = dict((str(k), v) for k, v in event.iteritems())
+
+                # Events of a database name it, which its component's id is
+                # made from.
+                if 'component' in event:
+                    event['component'] = prepId(event['component'])
+
                 result.events.append(event)
 
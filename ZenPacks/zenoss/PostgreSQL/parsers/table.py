@@ -34,14 +34,17 @@ class table(CommandParser):
                 if table is not None:
                     break
 
-                for tableName, tableStats in dbStats['tables'].items():
+                for tableName, tableStats in dbStats.get('tables', {}).items():
                     component_id = '{0}_{1}'.format(dbName, tableName)
                     if component_id == component:
                         table = tableStats
                         break
 
             if table is None:
-                # No matching table found.
+                # No matching table found, or its stats were not printed
+                # because they haven't changed. Nothing is stored for it
+                # until they do, which keeps the rates of its counters
+                # right.
                 continue
 
             if point.id in table:
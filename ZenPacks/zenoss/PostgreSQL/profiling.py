@@ -0,0 +1,219 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Opt-in profiling of polls and modeling runs.
+
+A Profile runs cProfile while it is active and then writes two files named
+after the device, the kind of run, the time, the process id and a sequence
+number to its directory, which is created if need be:
+
+    <name>-<time>-<pid>-<seq>.pstats  the raw profile, for pstats or
+                                      snakeviz
+    <name>-<time>-<pid>-<seq>.txt     wall time, RSS at the start and end of
+                                      the run and the peak of the process,
+                                      growth in the number of objects of
+                                      each type, and the top functions by
+                                      cumulative time
+
+The peak RSS is the highest of the whole process so far, so in a long
+running zenmodeler it only tells of the run that raised it.
+
+Profiling is enabled for the poller with --profile <directory> and for the
+modeler by setting ZP_POSTGRESQL_PROFILE to a directory. A profile that
+can't be written is logged and dropped, never failing what was profiled.
+
+cProfile has one hook per thread, so only one Profile is active at a time.
+zenmodeler models several devices at once, and a run that starts while
+another is being profiled isn't profiled itself, as its log message says.
+Model one device per run to profile each.
+
+Only objects tracked by the garbage collector (containers and instances)
+are counted, which covers the dicts, lists and records collection builds.
+
+This module has no dependencies so the command poller can import it.
+"""
+
+import cProfile
+import functools
+import gc
+import itertools
+import logging
+import os
+import pstats
+import resource
+import threading
+import time
+
+log = logging.getLogger('zen.PostgreSQL.profiling')
+
+# Number of functions and object types listed in the text report.
+REPORT_LIMIT = 40
+
+# Held by the active Profile.
+_active = threading.Lock()
+
+# Tells apart the profiles a process starts within the same second.
+_sequence = itertools.count(1)
+
+
+def objectCounts():
+    """Return a dict of type name to number of live objects of the type."""
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+
+    return counts
+
+
+def peakRSS():
+    """Peak resident set size of this process in KiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def currentRSS():
+    """Resident set size of this process in KiB, or None if unknown."""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, ValueError, IndexError):
+        return None
+
+    return pages * resource.getpagesize() // 1024
+
+
+class Profile(object):
+    """Profiles everything between start() and stop()."""
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.path = os.path.join(directory, '{0}-{1}-{2}-{3}'.format(
+            name, time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+            next(_sequence)))
+        self._profiler = None
+
+    def start(self):
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                log.warn(
+                    "Not profiling %s: can't create %s",
+                    os.path.basename(self.path), self.directory)
+                return self
+
+        if not _active.acquire(False):
+            log.info(
+                "Not profiling %s: another profile is active",
+                os.path.basename(self.path))
+            return self
+
+        self._counts = objectCounts()
+        self._rss = currentRSS()
+        self._begin = time.time()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        return self
+
+    def stop(self):
+        if self._profiler is None:
+            return
+
+        self._profiler.disable()
+        _active.release()
+
+        try:
+            self._write()
+        except (IOError, OSError), ex:
+            log.warn("Can't write profile %s: %s", self.path, ex)
+
+        self._profiler = None
+
+    def _write(self):
+        seconds = time.time() - self._begin
+
+        counts = objectCounts()
+        growth = sorted(
+            ((count - self._counts.get(name, 0), name)
+             for name, count in counts.iteritems()),
+            reverse=True)
+
+        self._profiler.dump_stats(self.path + '.pstats')
+
+        with open(self.path + '.txt', 'w') as report:
+            report.write('wall seconds: {0:.3f}\n'.format(seconds))
+            report.write('RSS at start: {0} KiB\n'.format(self._rss))
+            report.write('RSS at end: {0} KiB\n'.format(currentRSS()))
+            report.write('process peak RSS: {0} KiB\n'.format(peakRSS()))
+            report.write('\nobject growth by type:\n')
+            for delta, name in growth[:REPORT_LIMIT]:
+                if delta <= 0:
+                    break
+                report.write('  {0:>10} {1:>10}  {2}\n'.format(
+                    delta, counts[name], name))
+
+            report.write('\n')
+            stats = pstats.Stats(self._profiler, stream=report)
+            stats.sort_stats('cumulative').print_stats(REPORT_LIMIT)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def profileFromEnvironment(name):
+    """
+    Return a Profile if ZP_POSTGRESQL_PROFILE names a directory to write
+    profiles to, otherwise None.
+    """
+    directory = os.environ.get('ZP_POSTGRESQL_PROFILE')
+    if not directory:
+        return None
+
+    return Profile(directory, name)
+
+
+def profiled(kind):
+    """
+    Decorate a modeler plugin method taking the device as its first argument
+    so it is profiled when ZP_POSTGRESQL_PROFILE is set. Methods returning a
+    Deferred are profiled until it fires, which includes whatever else the
+    reactor runs in the meantime.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, device, *args, **kwargs):
+            profile = profileFromEnvironment('{0}-{1}'.format(
+                getattr(device, 'id', 'device'), kind))
+            if profile is None:
+                return method(self, device, *args, **kwargs)
+
+            profile.start()
+            try:
+                result = method(self, device, *args, **kwargs)
+            except Exception:
+                profile.stop()
+                raise
+
+            if hasattr(result, 'addBoth'):
+                def stop(result):
+                    profile.stop()
+                    return result
+
+                return result.addBoth(stop)
+
+            profile.stop()
+            return result
+
+        return wrapper
+
+    return decorator
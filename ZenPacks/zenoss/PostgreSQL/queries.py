@@ -0,0 +1,259 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+The queries whose SQL depends on what the server can do.
+
+Servers are told apart by capability rather than by version number where
+the queries are used. CAPABILITIES gives the first server_version having
+each, and QUERIES lists the variants of each query with the capability
+each needs, most capable first. Capabilities answers both for one server,
+and is worked out once from the server_version psycopg2 reports for a
+connection, without a query of its own.
+
+Every variant of a query is tested against a capture of its results in
+tests/fixtures.
+
+This module has no dependencies so the command poller can import it.
+"""
+
+import collections
+
+# The first server_version with each capability.
+CAPABILITIES = {
+    # pg_stat_activity.state and state_change.
+    'activityState': 90200,
+
+    # json_agg, to combine the results of several queries.
+    'jsonAgg': 90300,
+
+    # json_build_object and json_strip_nulls.
+    'serverJSON': 90500,
+
+    # The stats_fetch_consistency setting.
+    'statsFetchConsistency': 150000,
+
+    # pg_stat_activity.wait_event_type and wait_event.
+    'waitEvent': 90600,
+
+    # pg_blocking_pids.
+    'blockingPids': 90600,
+}
+
+QueryVariant = collections.namedtuple(
+    'QueryVariant', ('name', 'capability', 'sql'))
+
+# Durations of each backend in seconds. extract() returns numeric since
+# 14, which would be decoded as Decimal.
+_SECONDS = "greatest(extract(epoch FROM now() - {0}), 0)::float8"
+
+
+def _longRunning(sessions):
+    """
+    Return the SQL ranking the backends selected by sessions, with their
+    datname, pid, usename, application_name, kind, wait, query and
+    seconds, by how long each kind of them has been running.
+    """
+    return (
+        "SELECT datname, kind, pid, usename, application_name, wait,"
+        "       substr(query, 1, {length}) AS query, seconds"
+        "  FROM (SELECT a.*, row_number() OVER ("
+        "                 PARTITION BY datname, kind"
+        "                 ORDER BY seconds DESC) AS rank"
+        "          FROM (" + sessions + ") AS a) AS r"
+        " WHERE rank <= {top}")
+
+
+# The active and idle in transaction backends _longRunning ranks, told
+# apart by state, with what they are waiting on as {wait}.
+_STATE_SESSIONS = (
+    "SELECT datname, pid, usename, application_name,"
+    "       CASE WHEN state = 'active' THEN 'active'"
+    "            ELSE 'idle in transaction' END AS kind,"
+    "       {wait} AS wait, query,"
+    "       CASE WHEN state = 'active' THEN " +
+    _SECONDS.format('query_start') +
+    "            ELSE " + _SECONDS.format('state_change') + " END AS seconds"
+    "  FROM pg_stat_activity"
+    " WHERE (state = 'active' OR state LIKE 'idle in transaction%')"
+    "   AND pid <> pg_backend_pid()"
+    "   AND datname != 'bdr_supervisordb'")
+
+
+# The granted locks of other backends on what each waiting lock is for. Mode
+# conflicts aren't checked, so these are only the backends that may be
+# blocking it.
+_LOCK_BLOCKERS = (
+    "SELECT w.pid, b.pid AS blocker"
+    "  FROM pg_locks AS w"
+    "  JOIN pg_locks AS b ON b.granted AND b.pid <> w.pid"
+    "   AND b.locktype = w.locktype"
+    "   AND b.database IS NOT DISTINCT FROM w.database"
+    "   AND b.relation IS NOT DISTINCT FROM w.relation"
+    "   AND b.page IS NOT DISTINCT FROM w.page"
+    "   AND b.tuple IS NOT DISTINCT FROM w.tuple"
+    "   AND b.virtualxid IS NOT DISTINCT FROM w.virtualxid"
+    "   AND b.transactionid IS NOT DISTINCT FROM w.transactionid"
+    "   AND b.classid IS NOT DISTINCT FROM w.classid"
+    "   AND b.objid IS NOT DISTINCT FROM w.objid"
+    "   AND b.objsubid IS NOT DISTINCT FROM w.objsubid"
+    " WHERE NOT w.granted")
+
+
+def _lockBlocking(pid, state, query):
+    """
+    Return the SQL of the blocking variants without pg_blocking_pids, for
+    the pid, state and query columns of pg_stat_activity.
+    """
+    return (
+        "WITH l AS (" + _LOCK_BLOCKERS + "),"
+        " e AS (SELECT pid, array_agg(DISTINCT blocker) AS blockers"
+        "         FROM l GROUP BY pid) "
+        "SELECT a." + pid + " AS pid,"
+        "       coalesce(e.blockers, '{{}}'::integer[]) AS blockers,"
+        "       a.datname, a.usename, a.application_name,"
+        "       " + state + " AS state,"
+        "       CASE WHEN e.pid IS NULL"
+        "            THEN substr(a." + query + ", 1, {length}) END AS query,"
+        "       CASE WHEN e.pid IS NULL THEN " +
+        _SECONDS.format('a.xact_start') +
+        "            ELSE " + _SECONDS.format('a.query_start') + " END"
+        "       AS seconds"
+        "  FROM pg_stat_activity AS a"
+        "  LEFT JOIN e ON e.pid = a." + pid +
+        " WHERE e.pid IS NOT NULL OR a." + pid + " IN (SELECT blocker FROM l)")
+
+
+QUERIES = {
+    # Backends of each database. Counting them and summarizing how long
+    # they have been running queries, in transactions and idle in them is
+    # done by the server where it can tell them apart by state.
+    'connectionStats': (
+        QueryVariant('aggregate', 'activityState', (
+            "SELECT datname, count(*),"
+            "       count(CASE WHEN state IN"
+            "             ('active', 'fastpath function call') THEN 1 END),"
+            "       count(CASE WHEN state LIKE 'idle%' THEN 1 END),"
+            "       min(query), max(query), sum(query), count(query),"
+            "       min(txn), max(txn), sum(txn), count(txn),"
+            "       min(idle), max(idle), sum(idle), count(idle)"
+            "  FROM (SELECT datname, state,"
+            "               CASE WHEN state = 'active'"
+            "                    THEN {0} END AS query,"
+            "               CASE WHEN xact_start IS NOT NULL"
+            "                    THEN {1} END AS txn,"
+            "               CASE WHEN state LIKE 'idle in transaction%'"
+            "                    THEN {2} END AS idle"
+            "          FROM pg_stat_activity"
+            "         WHERE datname != 'bdr_supervisordb') AS a"
+            " GROUP BY datname".format(
+                _SECONDS.format('query_start'),
+                _SECONDS.format('xact_start'),
+                _SECONDS.format('state_change')))),
+
+        QueryVariant('backends', None, (
+            "SELECT datname, xact_start, query_start, backend_start,"
+            "       now() AS now"
+            "  FROM pg_stat_activity"
+            "  WHERE datname !='bdr_supervisordb'")),
+    ),
+
+    # The {top} longest running active queries and the {top} sessions idle
+    # in transaction the longest of each database, with the text of their
+    # query cut to {length} characters. Only waiting for a lock is known
+    # before wait events.
+    'longRunning': (
+        QueryVariant('waitEvent', 'waitEvent', _longRunning(
+            _STATE_SESSIONS.format(
+                wait="wait_event_type || ': ' || wait_event"))),
+
+        QueryVariant('waiting', 'activityState', _longRunning(
+            _STATE_SESSIONS.format(
+                wait="CASE WHEN waiting THEN 'Lock' END"))),
+
+        # Before state, idle in transaction is only told by the query text,
+        # and counted from the start of the last query.
+        QueryVariant('currentQuery', None, _longRunning(
+            "SELECT datname, procpid AS pid, usename, application_name,"
+            "       CASE WHEN current_query = '<IDLE> in transaction'"
+            "            THEN 'idle in transaction'"
+            "            ELSE 'active' END AS kind,"
+            "       CASE WHEN waiting THEN 'Lock' END AS wait,"
+            "       current_query AS query, " +
+            _SECONDS.format('query_start') + " AS seconds"
+            "  FROM pg_stat_activity"
+            " WHERE (current_query NOT LIKE '<IDLE>%'"
+            "        OR current_query = '<IDLE> in transaction')"
+            "   AND procpid <> pg_backend_pid()"
+            "   AND datname != 'bdr_supervisordb'")),
+    ),
+
+    # The backends waiting on a lock and the backends holding what they wait
+    # on. Each row has the pid, the pids blocking it, datname, usename,
+    # application_name, state, the first {length} characters of the query
+    # of backends not waiting, and the seconds waiting backends have been
+    # running their query and the others their transaction.
+    # pg_blocking_pids is only called for backends waiting on a lock.
+    'blocking': (
+        QueryVariant('blockingPids', 'blockingPids', (
+            "WITH a AS ("
+            "SELECT pid, datname, usename, application_name, state, query,"
+            "       xact_start, query_start,"
+            "       CASE WHEN wait_event_type = 'Lock'"
+            "            THEN pg_blocking_pids(pid)"
+            "            ELSE '{{}}'::integer[] END AS blockers"
+            "  FROM pg_stat_activity) "
+            "SELECT pid, blockers, datname, usename, application_name, state,"
+            "       CASE WHEN cardinality(blockers) = 0"
+            "            THEN substr(query, 1, {length}) END AS query,"
+            "       CASE WHEN cardinality(blockers) = 0 THEN " +
+            _SECONDS.format('xact_start') +
+            "            ELSE " + _SECONDS.format('query_start') + " END"
+            "       AS seconds"
+            "  FROM a"
+            " WHERE cardinality(blockers) > 0"
+            "    OR pid IN (SELECT unnest(blockers) FROM a)")),
+
+        QueryVariant('lockJoin', 'activityState', _lockBlocking(
+            'pid', 'a.state', 'query')),
+
+        QueryVariant('lockJoinProcpid', None, _lockBlocking(
+            'procpid', 'NULL', 'current_query')),
+    ),
+}
+
+
+class Capabilities(object):
+    """What a server of version, its server_version, can do."""
+
+    def __init__(self, version):
+        self.version = version or 0
+
+    def __contains__(self, capability):
+        return self.version >= CAPABILITIES[capability]
+
+    def query(self, name):
+        """Return the QueryVariant of name to run on this server."""
+        for variant in QUERIES[name]:
+            if variant.capability is None or variant.capability in self:
+                return variant
+
+        raise KeyError("no variant of {0} for server version {1}".format(
+            name, self.version))
+
+    def options(self):
+        """Return the settings to connect to this server with."""
+        settings = []
+
+        # Stats are read once per poll, so caching them in the backend for
+        # the rest of the transaction is wasted work.
+        if 'statsFetchConsistency' in self:
+            settings.append('stats_fetch_consistency=none')
+
+        return settings
@@ -0,0 +1,269 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Declarative rollups of per-table and per-database stats into summaries.
+
+Each summary stat is described by a Rollup naming the function and the
+member stats ("sources") it is calculated from. A Rollups instance
+evaluates a set of them column-at-a-time: each batch of members is turned
+into one list per source and reduced with builtins, and the partial state
+of every rollup can be merged with others. That way database summaries
+can be merged into server summaries, and streamed rows can be rolled up
+in batches, without ever revisiting the members.
+
+This module has no dependencies so the command poller can import it.
+"""
+
+from operator import attrgetter
+
+
+class Rollup(object):
+    """
+    How one summary stat is calculated from a column of member values.
+
+    Subclasses implement partial(), which reduces the columns of one batch
+    to a state, merge(), which combines two states, and result(), which
+    turns a state into the summary value. None is the state for no values.
+    """
+
+    def __init__(self, name, source=None):
+        self.name = name
+        self.source = source or name
+
+    @property
+    def sources(self):
+        return (self.source,)
+
+    def partial(self, columns):
+        raise NotImplementedError
+
+    def merge(self, a, b):
+        raise NotImplementedError
+
+    def result(self, state):
+        return state
+
+
+class Sum(Rollup):
+    """Sum of the source values. Zero if there were none."""
+
+    def partial(self, columns):
+        values = columns[self.source]
+        return sum(values) if values else None
+
+    def merge(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return a + b
+
+    def result(self, state):
+        return 0 if state is None else state
+
+
+class Min(Rollup):
+    """Smallest source value. Left out if there were none."""
+
+    def partial(self, columns):
+        values = columns[self.source]
+        return min(values) if values else None
+
+    def merge(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return min(a, b)
+
+
+class Max(Rollup):
+    """Largest source value. Left out if there were none."""
+
+    def partial(self, columns):
+        values = columns[self.source]
+        return max(values) if values else None
+
+    def merge(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return max(a, b)
+
+
+class _PairRollup(Rollup):
+    """Rollup whose state is a pair of sums that merge by addition."""
+
+    def merge(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return (a[0] + b[0], a[1] + b[1])
+
+
+class Mean(_PairRollup):
+    """Arithmetic mean of the source values. Left out if there were none."""
+
+    def partial(self, columns):
+        values = columns[self.source]
+        return (sum(values), len(values)) if values else None
+
+    def result(self, state):
+        if state is None:
+            return None
+
+        return float(state[0]) / state[1]
+
+
+class WeightedMean(_PairRollup):
+    """
+    Mean of the source values weighted by the weight stat of each member.
+    Left out if the weights add up to zero.
+    """
+
+    def __init__(self, name, weight, source=None):
+        super(WeightedMean, self).__init__(name, source)
+        self.weight = weight
+
+    @property
+    def sources(self):
+        return (self.source, self.weight)
+
+    def partial(self, columns):
+        pairs = columns[(self.source, self.weight)]
+        if not pairs:
+            return None
+
+        return (sum(v * w for v, w in pairs), sum(w for _, w in pairs))
+
+    def result(self, state):
+        if state is None or not state[1]:
+            return None
+
+        return float(state[0]) / state[1]
+
+
+class Ratio(_PairRollup):
+    """
+    Ratio of the sum of the numerator stat to the sum of the denominator
+    stat, multiplied by scale. Zero if the denominator adds up to zero.
+
+    This is the correct way to combine percentages such as xactRollbackPct:
+    each member's percentage is weighted by its own denominator.
+    """
+
+    def __init__(self, name, numerator, denominator, scale=1):
+        super(Ratio, self).__init__(name, numerator)
+        self.numerator = numerator
+        self.denominator = denominator
+        self.scale = scale
+
+    @property
+    def sources(self):
+        return (self.numerator, self.denominator)
+
+    def partial(self, columns):
+        return (sum(columns[self.numerator]), sum(columns[self.denominator]))
+
+    def result(self, state):
+        if state is None or not state[1]:
+            return 0
+
+        return (float(state[0]) / state[1]) * self.scale
+
+
+class Rollups(object):
+    """
+    A set of rollups evaluated together over batches of members.
+
+    Members are records or any objects with their stats as attributes, or
+    dicts if mapping=True. Missing and None stats are ignored.
+    """
+
+    def __init__(self, rollups, names=None, mapping=False):
+        self.rollups = [
+            r for r in rollups if names is None or r.name in names]
+
+        self.sources = sorted(set(
+            source for r in self.rollups for source in r.sources))
+
+        self._mapping = mapping
+
+    def columns(self, members):
+        """
+        Return a dict of source name to its list of non-None values.
+
+        Rollups over a pair of sources also get a list of the (source,
+        weight) pairs where neither is None, keyed by that tuple.
+        """
+        members = list(members)
+        if self._mapping:
+            def get(*names):
+                if len(names) == 1:
+                    return [m.get(names[0]) for m in members]
+                return [tuple(m.get(n) for n in names) for m in members]
+        else:
+            def get(*names):
+                return map(attrgetter(*names), members)
+
+        columns = {}
+        for source in self.sources:
+            columns[source] = [v for v in get(source) if v is not None]
+
+        for rollup in self.rollups:
+            if isinstance(rollup, WeightedMean):
+                key = (rollup.source, rollup.weight)
+                columns[key] = [p for p in get(*key) if None not in p]
+
+        return columns
+
+    def state(self, members=()):
+        """Return the partial state of every rollup over members."""
+        columns = self.columns(members)
+        return [r.partial(columns) for r in self.rollups]
+
+    def merge(self, *states):
+        """Merge the states of several batches into one."""
+        merged = [None] * len(self.rollups)
+        for state in states:
+            merged = [
+                r.merge(a, b)
+                for r, a, b in zip(self.rollups, merged, state)]
+
+        return merged
+
+    def results(self, state):
+        """Return a dict of summary name to value, leaving out None."""
+        results = {}
+        for rollup, s in zip(self.rollups, state):
+            value = rollup.result(s)
+            if value is not None:
+                results[rollup.name] = value
+
+        return results
+
+    def evaluate(self, members):
+        """Return the summaries of members in one step."""
+        return self.results(self.state(members))
+
+
+def batches(iterable, size):
+    """Yield lists of up to size items from iterable."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
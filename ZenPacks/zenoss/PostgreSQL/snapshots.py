@@ -0,0 +1,390 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Stats kept between polls: table stats for collecting a database's tables
+in shards, sizes collected on a slower cadence than the other stats, and
+digests of the table stats printed, for printing only those that changed.
+
+When a database's tables are spread over several polls, each poll collects
+only some of them, so the others are filled in from earlier polls for every
+table to have values each cycle. The counters of a table that wasn't
+collected are extrapolated at the rate they grew between its last two
+samples, and never go backwards, so the rates graphed from them neither
+drop out nor spike when the table is collected again. Its other stats keep
+their last values. Until every shard of a database has been collected
+once, its tables are only partly known, so their sums are left out.
+
+Adding up the sizes of the files of each database and table is the
+costliest part of a poll on large servers, and sizes change slowly, so
+they can be collected only every so often and repeated from SizeCache in
+between.
+
+Most tables are idle most of the time, and printing the same stats for them
+every poll only has zencommand store them again. TableDigests keeps a
+checksum of each table's stats to leave those out. A table is still printed
+the first poll its stats are unchanged, so the rates graphed from its
+counters drop to zero, and every table is printed every so many polls.
+
+Every poll reports whether each database failed, and has long running or
+blocked sessions, by raising or clearing an event. Clearing events that
+were never raised is most of them on large servers, so RaisedEvents keeps
+the events that are raised to only clear those.
+
+They are all kept in JSON files per device and level, replaced atomically
+after each poll.
+"""
+
+import json
+import os
+import re
+import tempfile
+import time
+import zlib
+
+from util import TABLE_COUNTER_STATS, TableStats
+
+
+def defaultDirectory():
+    """Return the directory snapshot files are kept in by default."""
+    if 'ZENHOME' in os.environ:
+        return os.path.join(os.environ['ZENHOME'], 'var', 'postgresql')
+
+    return os.path.join(tempfile.gettempdir(), 'zenoss-postgresql')
+
+
+def snapshotPath(directory, host, port, level, suffix='', target=None):
+    """
+    Return the snapshot file for polls of level on host:port, or of target
+    if it is named, for targets polling the same server and level to keep
+    their own.
+    """
+    name = re.sub(r'[^\w.-]', '_', '{0}_{1}_{2}{3}{4}'.format(
+        host, port, level or 'all',
+        '_' + target if target is not None else '', suffix))
+
+    return os.path.join(directory, name + '.json')
+
+
+def readDocument(path):
+    """
+    Return the JSON document in path, or None if there is none or it can't
+    be trusted. Names are returned as UTF-8 strings, like psycopg2's.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f, object_pairs_hook=lambda pairs: dict(
+                (k.encode('utf-8'), v) for k, v in pairs))
+    except (IOError, ValueError):
+        return None
+
+
+def writeDocument(path, document):
+    """Atomically replace path with document."""
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+
+    fd, temporary = tempfile.mkstemp(
+        prefix='.' + os.path.basename(path), dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(document, f)
+
+    os.rename(temporary, path)
+
+
+class TableSnapshots(object):
+    """
+    The stats of each table of each database as of the last poll, and how
+    fast its counters were growing.
+
+    Each poll is one cycle. A table that isn't collected again within as
+    many cycles as there are shards is taken to have been dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.cycle = 0
+        self._databases = {}
+
+        # The cycle each database's snapshots were started in.
+        self._started = {}
+
+        document = readDocument(path)
+        if document is None:
+            # Tables are only estimated once they have been collected again.
+            return
+
+        self.cycle = document.get('cycle', -1) + 1
+        self._databases = document.get('databases', {})
+        self._started = document.get('started', {})
+
+    def shard(self, count):
+        """Return the shard of count to collect this cycle."""
+        return self.cycle % count
+
+    def complete(self, dbName, shards):
+        """
+        Return True if every one of shards of dbName's tables has been
+        collected since its snapshots were started.
+        """
+        started = self._started.get(dbName, self.cycle)
+        return self.cycle - started >= shards - 1
+
+    def hotTables(self, dbName):
+        """Return the tables of dbName that were active when last seen."""
+        return sorted(
+            name for name, snapshot in
+            self._databases.get(dbName, {}).iteritems()
+            if snapshot['hot'])
+
+    def merge(self, dbName, fresh, shards, now=None):
+        """
+        Record the tables collected from dbName this cycle in fresh, and
+        return the stats of all of its tables, estimating the others.
+        """
+        if now is None:
+            now = time.time()
+
+        snapshots = self._databases.setdefault(dbName, {})
+        self._started.setdefault(dbName, self.cycle)
+        tables = {}
+
+        for name, stats in fresh.iteritems():
+            snapshot = self._sample(snapshots.get(name), stats.toJSON(), now)
+            snapshots[name] = snapshot
+            tables[name] = TableStats(**snapshot['emitted'])
+
+        for name in snapshots.keys():
+            if name in fresh:
+                continue
+
+            snapshot = snapshots[name]
+            if self.cycle - snapshot['cycle'] > shards:
+                del snapshots[name]
+                continue
+
+            tables[name] = TableStats(**self._estimate(snapshot, now))
+
+        return tables
+
+    def _sample(self, snapshot, values, now):
+        """Return the snapshot of a table collected with values at now."""
+        rates = {}
+        emitted = dict(values)
+        hot = False
+
+        for name in TABLE_COUNTER_STATS:
+            value = values.get(name)
+            if value is None or snapshot is None:
+                continue
+
+            previous = snapshot['values'].get(name)
+            if previous is None or value < previous:
+                # The server's stats were reset.
+                continue
+
+            elapsed = now - snapshot['time']
+            if elapsed > 0:
+                rates[name] = (value - previous) / float(elapsed)
+
+            if value > previous:
+                hot = True
+
+            # Estimates ran ahead of the table. Hold them until it catches
+            # up rather than going backwards.
+            emitted[name] = max(value, snapshot['emitted'].get(name, value))
+
+        return dict(
+            cycle=self.cycle,
+            time=now,
+            values=values,
+            rates=rates,
+            emitted=emitted,
+            hot=hot)
+
+    def _estimate(self, snapshot, now):
+        """Return the stats of a table that wasn't collected at now."""
+        emitted = snapshot['emitted']
+        elapsed = now - snapshot['time']
+
+        for name, rate in snapshot['rates'].iteritems():
+            estimate = int(snapshot['values'][name] + rate * elapsed)
+            emitted[name] = max(estimate, emitted.get(name, estimate))
+
+        return emitted
+
+    def save(self):
+        """Atomically replace the snapshot file."""
+        writeDocument(self.path, dict(
+            cycle=self.cycle,
+            databases=self._databases,
+            started=dict(
+                (dbName, cycle) for dbName, cycle in self._started.iteritems()
+                if dbName in self._databases)))
+
+
+class SizeCache(object):
+    """
+    The sizes of the databases, and of the tables of each database, as of
+    when they were last collected, which is due again every interval
+    seconds.
+    """
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self._databases = {}
+        self._tables = {}
+
+        # The databases of this poll, if known.
+        self._retained = None
+
+        document = readDocument(path)
+        if document is not None:
+            self._databases = document.get('databases', {})
+            self._tables = document.get('tables', {})
+
+    def _entry(self, dbName):
+        if dbName is None:
+            return self._databases
+
+        return self._tables.get(dbName, {})
+
+    def due(self, dbName=None, now=None):
+        """
+        Return True if the sizes of dbName's tables, or of the databases
+        without dbName, should be collected again.
+        """
+        if now is None:
+            now = time.time()
+
+        entry = self._entry(dbName)
+        return 'time' not in entry or now - entry['time'] >= self.interval
+
+    def get(self, dbName=None):
+        """Return the last sizes of dbName's tables, or of the databases."""
+        return self._entry(dbName).get('sizes', {})
+
+    def set(self, sizes, dbName=None, now=None):
+        """Record the sizes just collected of dbName's tables or databases."""
+        entry = dict(time=time.time() if now is None else now, sizes=sizes)
+        if dbName is None:
+            self._databases = entry
+        else:
+            self._tables[dbName] = entry
+
+    def expire(self, dbName=None):
+        """Have the sizes of dbName's tables, or of the databases, be due."""
+        self._entry(dbName).pop('time', None)
+
+    def retain(self, dbNames):
+        """Have save forget the table sizes of databases not in dbNames."""
+        self._retained = set(dbNames)
+
+    def save(self):
+        """Atomically replace the cache file, forgetting dropped databases."""
+        tables = self._tables
+        if self._retained is not None:
+            tables = dict(
+                (dbName, entry) for dbName, entry in tables.iteritems()
+                if dbName in self._retained)
+
+        writeDocument(
+            self.path, dict(databases=self._databases, tables=tables))
+
+
+class TableDigests(object):
+    """
+    A checksum of each table's stats as of the last poll, and whether they
+    had changed then, to print only the tables whose stats are changing.
+    All tables are printed every refresh polls.
+    """
+
+    def __init__(self, path, refresh):
+        self.path = path
+        self.refresh = refresh
+        self.cycle = 0
+        self._databases = {}
+
+        document = readDocument(path)
+        if document is not None:
+            self.cycle = document.get('cycle', -1) + 1
+            self._databases = document.get('databases', {})
+
+    def changed(self, dbName, tables):
+        """Return the subset of dbName's tables to print this poll."""
+        full = self.cycle % self.refresh == 0
+        previous = self._databases.get(dbName, {})
+        digests = {}
+        printed = {}
+
+        for name, stats in tables.iteritems():
+            digest = zlib.crc32(repr(stats)) & 0xffffffff
+            last, changed = previous.get(name, (None, True))
+
+            # Printing the first unchanged stats too has rates drop to zero.
+            if full or changed or digest != last:
+                printed[name] = stats
+
+            digests[name] = (digest, digest != last)
+
+        self._databases[dbName] = digests
+        return printed
+
+    def save(self):
+        """Atomically replace the digest file."""
+        writeDocument(
+            self.path, dict(cycle=self.cycle, databases=self._databases))
+
+
+class RaisedEvents(object):
+    """
+    The events raised and not cleared yet, by component and event key, to
+    leave out clearing the others. Until the first poll has saved which it
+    raised, every event is cleared.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._raised = None
+        self._raising = set()
+        self._clearing = set()
+
+        document = readDocument(path)
+        if document is not None:
+            self._raised = set(
+                tuple(key) for key in document.get('raised', []))
+
+    def filter(self, events):
+        """Return events without the clears of events not raised."""
+        kept = []
+        for event in events:
+            key = (event.get('component'), event['eventKey'])
+            if event['severity']:
+                self._raising.add(key)
+            else:
+                self._clearing.add(key)
+                if self._raised is not None and key not in self._raised:
+                    continue
+
+            kept.append(event)
+
+        return kept
+
+    def save(self):
+        """
+        Atomically replace the event file. Events neither raised nor
+        cleared, such as of a section that was skipped, stay raised.
+        """
+        raised = (self._raised or set()) - self._clearing | self._raising
+        writeDocument(self.path, dict(raised=sorted(raised)))
@@ -7,16 +7,65 @@
 #
 ##############################################################################
 
+import os
+import subprocess
+import sys
+
 import Globals
-from mock import patch
+from mock import MagicMock
+from psycopg2.extensions import POLL_OK, POLL_READ, POLL_WRITE
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
-from ZenPacks.zenoss.PostgreSQL.util import PgHelper
+from ZenPacks.zenoss.PostgreSQL.asyncutil import (
+    AsyncConnection,
+    AsyncPgHelper,
+    asyncArgument,
+)
+
+
+class FakeReactor(object):
+    """Records the descriptors and timers an AsyncConnection registers."""
+
+    def __init__(self):
+        self.readers = set()
+        self.writers = set()
+        self.timers = []
+
+    def addReader(self, reader):
+        self.readers.add(reader)
+
+    def removeReader(self, reader):
+        self.readers.discard(reader)
+
+    def addWriter(self, writer):
+        self.writers.add(writer)
+
+    def removeWriter(self, writer):
+        self.writers.discard(writer)
+
+    def callLater(self, seconds, f, *args):
+        timer = MagicMock()
+        timer.active.return_value = True
+        timer.call = lambda: f(*args)
+        self.timers.append(timer)
+        return timer
+
+
+def fakeDBAPI(states):
+    """Return a mock psycopg2 whose connection polls through states."""
+    connection = MagicMock()
+    connection.poll.side_effect = states
+    connection.fileno.return_value = 7
+
+    dbapi = MagicMock()
+    dbapi.__version__ = '2.8.6 (dt dec pq3 ext lo64)'
+    dbapi.connect.return_value = connection
+    return dbapi
 
 
 class TestPgHelperInitialization(BaseTestCase):
     """
-    Tests for Async Connection Pool configuration logic.
-    Focuses on how PgHelper prepares arguments for adbapi.ConnectionPool.
+    Tests for Async Connection configuration logic.
+    Focuses on how AsyncPgHelper prepares arguments for psycopg2.connect.
     """
 
     def setUp(self):
@@ -28,36 +77,115 @@ class TestPgHelperInitialization(BaseTestCase):
             'default_db': 'postgres'
         }
 
-    @patch('ZenPacks.zenoss.PostgreSQL.util.adbapi.ConnectionPool')
-    def test_pool_creation_parameters(self, mock_pool):
+    def test_connection_parameters(self):
         """
-        Verify that _getConnectionPool correctly translates configuration
-        parameters into arguments for adbapi.ConnectionPool.
-        This covers both SSL transformation logic and basic driver selection.
+        Verify that _connectionArguments correctly translates configuration
+        parameters into arguments for psycopg2.connect.
         """
         # Case 1: SSL Enabled -> sslmode='require'
-        helper_ssl = PgHelper(ssl=True, **self.base_config)
-        helper_ssl._getConnectionPool()
+        helper_ssl = AsyncPgHelper(ssl=True, **self.base_config)
+        kwargs = helper_ssl._connectionArguments('db1')
 
-        args, kwargs = mock_pool.call_args
-        self.assertEqual(args[0], 'psycopg2')
+        self.assertEqual(kwargs.get('database'), 'db1')
         self.assertEqual(kwargs.get('sslmode'), 'require',
                          "SSL=True should map to sslmode='require'")
 
-        # Reset mock for next assertion
-        mock_pool.reset_mock()
-
         # Case 2: SSL Disabled -> sslmode='disable'
-        helper_no_ssl = PgHelper(ssl=False, **self.base_config)
-        helper_no_ssl._getConnectionPool()
+        helper_no_ssl = AsyncPgHelper(ssl=False, **self.base_config)
+        kwargs = helper_no_ssl._connectionArguments('db1')
 
-        _, kwargs = mock_pool.call_args
         self.assertEqual(kwargs.get('sslmode'), 'disable',
                          "SSL=False should map to sslmode='disable'")
 
+    def test_async_argument(self):
+        self.assertEqual(asyncArgument(fakeDBAPI([])), 'async_')
+
+        dbapi = fakeDBAPI([])
+        dbapi.__version__ = '2.6.2 (dt dec pq3 ext lo64)'
+        self.assertEqual(asyncArgument(dbapi), 'async')
+
+
+class TestAsyncConnection(BaseTestCase):
+    """Tests for driving psycopg2 asynchronous connections by the reactor"""
+
+    def test_polling(self):
+        """Test that the socket is watched as poll() asks until it's done"""
+        dbapi = fakeDBAPI([
+            POLL_WRITE, POLL_READ, POLL_OK,
+            POLL_READ, POLL_OK,
+        ])
+        reactor = FakeReactor()
+        connection = AsyncConnection(
+            dbapi, reactor=reactor, host='localhost', database='db1')
+
+        connected = []
+        connection.connect().addCallback(connected.append)
+        self.assertEqual(dbapi.connect.call_args[1]['async_'], 1)
+        self.assertEqual(connection.fileno(), 7)
+        self.assertEqual(reactor.writers, set([connection]))
+
+        connection.doWrite()
+        self.assertEqual(reactor.readers, set([connection]))
+        self.assertEqual(reactor.writers, set())
+
+        connection.doRead()
+        self.assertEqual(connected, [connection])
+        self.assertEqual(reactor.readers, set())
+        self.assertTrue(reactor.timers[0].cancel.called)
+
+        cursor = dbapi.connect.return_value.cursor.return_value
+        cursor.fetchall.return_value = [(1,)]
+
+        rows = []
+        connection.runQuery("SELECT 1").addCallback(rows.append)
+        self.assertEqual(rows, [])
+
+        connection.doRead()
+        self.assertEqual(rows, [[(1,)]])
+        self.assertTrue(cursor.close.called)
+
+    def test_timeout(self):
+        """Test that connecting fails and closes when it takes too long"""
+        dbapi = fakeDBAPI(lambda: POLL_READ)
+        reactor = FakeReactor()
+        connection = AsyncConnection(dbapi, reactor=reactor, timeout=5)
+
+        failures = []
+        connection.connect().addErrback(failures.append)
+        reactor.timers[0].call()
+
+        self.assertEqual(len(failures), 1)
+        self.assertIn('timed out', failures[0].getErrorMessage())
+        self.assertTrue(dbapi.connect.return_value.close.called)
+        self.assertEqual(reactor.readers, set())
+
+
+class TestPollerImports(BaseTestCase):
+    """The command poller must start without the Twisted code."""
+
+    def test_poller_does_not_import_twisted(self):
+        poller = os.path.join(
+            os.path.dirname(os.path.dirname(__file__)),
+            'libexec', 'poll_postgres.py')
+
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            "import imp, sys;"
+            " imp.load_source('poll_postgres', sys.argv[1]);"
+            " print ' '.join(sorted(sys.modules))",
+            poller])
+
+        modules = output.split()
+        self.assertIn('util', modules)
+        self.assertFalse(
+            [m for m in modules if m.split('.')[0] == 'twisted'])
+        self.assertNotIn('asyncutil', modules)
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(TestPgHelperInitialization))
+    suite.addTest(makeSuite(TestAsyncConnection))
+    suite.addTest(makeSuite(TestPollerImports))
     return suite
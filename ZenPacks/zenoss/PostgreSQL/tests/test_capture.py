@@ -0,0 +1,242 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import datetime
+import decimal
+import os
+import shutil
+import tempfile
+
+import mock
+
+import Globals
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.PostgreSQL.capture import (
+    FixedOffset,
+    Recorder,
+    Replay,
+    ReplayError,
+)
+from ZenPacks.zenoss.PostgreSQL.util import PgHelper, TableShard
+
+TABLES = [
+    ('orders', decimal.Decimal('8192'),
+     datetime.datetime(2026, 1, 2, 3, 4, 5, 6000, tzinfo=FixedOffset(60))),
+    ('customers', decimal.Decimal('16384'), None),
+]
+
+
+def fakeDBAPI():
+    """Return a mock psycopg2 module whose cursors return TABLES."""
+    cursor = mock.MagicMock()
+    cursor.description = (('relname',), ('size',), ('last_vacuum',))
+    cursor.fetchall.return_value = TABLES
+
+    connection = mock.MagicMock()
+    connection.server_version = 90600
+    connection.cursor.return_value = cursor
+
+    dbapi = mock.MagicMock()
+    dbapi.connect.return_value = connection
+    return dbapi
+
+
+class TestCapture(BaseTestCase):
+    """Tests for recording and replaying queries"""
+
+    def setUp(self):
+        super(TestCapture, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestCapture, self).tearDown()
+
+    def record(self, anonymize=False):
+        path = os.path.join(self.directory, 'capture.jsonl.gz')
+        recorder = Recorder(path, anonymize=anonymize)
+        dbapi = recorder.wrap(fakeDBAPI())
+
+        cursor = dbapi.connect(database='shop').cursor()
+        cursor.execute("SELECT relname, size, last_vacuum FROM t")
+        cursor.fetchall()
+        cursor.close()
+        recorder.close()
+
+        return Replay(path)
+
+    def test_replay(self):
+        """Test that replayed rows are the recorded ones with their types"""
+        replay = self.record()
+
+        self.assertEqual(replay.databases, ['shop'])
+        self.assertEqual(replay.defaultDatabase, 'shop')
+
+        connection = replay.connect(database='shop')
+        self.assertEqual(connection.server_version, 90600)
+
+        for _ in range(2):
+            cursor = connection.cursor()
+            cursor.execute("SELECT relname, size, last_vacuum FROM t")
+            self.assertEqual(
+                [c[0] for c in cursor.description],
+                ['relname', 'size', 'last_vacuum'])
+
+            rows = cursor.fetchall()
+            self.assertEqual(rows, TABLES)
+            self.assertEqual(
+                rows[0][2].utcoffset(), datetime.timedelta(minutes=60))
+
+        self.assertRaises(ReplayError, connection.cursor().execute, "SELECT 2")
+        self.assertRaises(ReplayError, replay.connect, database='other')
+
+    def test_anonymize(self):
+        """Test that names are replaced consistently and stats are kept"""
+        replay = self.record(anonymize=True)
+
+        self.assertTrue(replay.anonymized)
+        database = replay.defaultDatabase
+        self.assertTrue(database.startswith('db_'))
+
+        cursor = replay.connect(database=database).cursor()
+        cursor.execute("SELECT relname, size, last_vacuum FROM t")
+        rows = cursor.fetchall()
+
+        self.assertTrue(all(r[0].startswith('table_') for r in rows))
+        self.assertNotIn('orders', [r[0] for r in rows])
+        self.assertEqual([r[1:] for r in rows], [t[1:] for t in TABLES])
+
+    def test_anonymize_params(self):
+        """Test that names passed as query parameters are replaced"""
+        path = os.path.join(self.directory, 'capture.jsonl')
+        recorder = Recorder(path, anonymize=True)
+        dbapi = recorder.wrap(fakeDBAPI())
+
+        params = dict(index=1, count=4, hot=['orders'])
+        cursor = dbapi.connect(database='shop').cursor()
+        cursor.execute("SELECT relname FROM t WHERE relname = ANY(%(hot)s)",
+                       params)
+        cursor.fetchall()
+        cursor.close()
+        recorder.close()
+
+        with open(path) as f:
+            self.assertNotIn('orders', f.read())
+
+        params['hot'] = [recorder.pseudonym('orders', 'table')]
+        replay = Replay(path)
+        cursor = replay.connect(database=replay.defaultDatabase).cursor()
+        cursor.execute("SELECT relname FROM t WHERE relname = ANY(%(hot)s)",
+                       params)
+        self.assertEqual(len(cursor.fetchall()), len(TABLES))
+
+    def test_anonymize_shard(self):
+        """Test that a shard's hot tables are found again on replay"""
+        path = os.path.join(self.directory, 'capture.jsonl')
+        recorder = Recorder(path, anonymize=True)
+        dbapi = recorder.wrap(fakeDBAPI())
+
+        hot = ['audit', 'customers', 'orders', 'payments']
+        sql = "SELECT relname FROM t" + TableShard.WHERE
+        cursor = dbapi.connect(database='shop').cursor()
+        cursor.execute(sql, TableShard(1, 4, hot).params())
+        cursor.fetchall()
+        cursor.close()
+        recorder.close()
+
+        # The hot tables are named by the pseudonyms of the replayed rows.
+        replay = Replay(path)
+        shard = TableShard(
+            1, 4, [recorder.pseudonym(name, 'table') for name in hot])
+        cursor = replay.connect(database=replay.defaultDatabase).cursor()
+        cursor.execute(sql, shard.params())
+        self.assertEqual(len(cursor.fetchall()), len(TABLES))
+
+    def test_pghelper_capture(self):
+        """Test that PgHelper records its queries when given a Recorder"""
+        path = os.path.join(self.directory, 'capture.jsonl')
+        recorder = Recorder(path)
+
+        with mock.patch('psycopg2.connect') as mock_connect:
+            mock_connect.return_value = fakeDBAPI().connect()
+
+            pg = PgHelper('localhost', 5432, 'user', 'pass', False, 'shop',
+                          capture=recorder)
+            pg.getConnection('shop')
+            pg.close()
+
+        recorder.close()
+
+        cursor = Replay(path).connect(database='shop').cursor()
+        cursor.execute("SELECT 1")
+        self.assertEqual(cursor.fetchall(), TABLES)
+
+    def test_anonymize_server_stats(self):
+        """Test that the rows of combined server sections are anonymized"""
+        path = os.path.join(self.directory, 'capture.jsonl')
+        recorder = Recorder(path, anonymize=True)
+
+        # json_agg names every key, repeating those of unnamed columns.
+        documents = (
+            '[{"datname":"shop","count":3,"count":1,"count":2,'
+            '"min":2.0,"max":2.0,"sum":2.0,"count":1,'
+            '"min":12.0,"max":30.0,"sum":42.0,"count":2,'
+            '"min":25.0,"max":25.0,"sum":25.0,"count":1}]',
+            '[{"datname":"shop","kind":"active","pid":101,"usename":"web",'
+            '"application_name":"shop-api","wait":"Lock: transactionid",'
+            '"query":"SELECT * FROM orders FOR UPDATE","seconds":45.0}]',
+        )
+        dbapi = fakeDBAPI()
+        connection = dbapi.connect.return_value
+        cursor = connection.cursor.return_value
+        connection.server_version = 90624
+        cursor.description = (('json_agg',), ('json_agg',))
+        cursor.fetchall.return_value = [(1,)]
+        cursor.fetchone.return_value = documents
+
+        sections = ['connectionStats', 'longRunning']
+        with mock.patch('psycopg2.connect', dbapi.connect):
+            pg = PgHelper('localhost', 5432, 'user', 'pass', False, 'shop',
+                          capture=recorder)
+            recorded = pg.getServerStats(sections)
+            pg.close()
+
+        recorder.close()
+
+        with open(path) as f:
+            text = f.read()
+
+        for name in ('shop', 'web', 'shop-api', 'orders'):
+            self.assertNotIn(name, text)
+
+        database = recorder.pseudonym('shop', 'db')
+        with mock.patch('ZenPacks.zenoss.PostgreSQL.util.psycopg2',
+                        Replay(path)):
+            pg = PgHelper('localhost', 5432, 'user', 'pass', False, database)
+            replayed = pg.getServerStats(sections)
+
+        self.assertEqual(
+            replayed['connectionStats']['databases'].keys(), [database])
+        self.assertEqual(
+            replayed['connectionStats']['databases'][database],
+            recorded['connectionStats']['databases']['shop'])
+
+        session, = replayed['longRunning'][database]
+        self.assertEqual(session['user'], recorder.pseudonym('web', 'user'))
+        self.assertTrue(session['query'].startswith('query_'))
+        self.assertEqual(session['waitEvent'], 'Lock: transactionid')
+        self.assertEqual(session['seconds'], 45.0)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestCapture))
+    return suite
@@ -9,11 +9,31 @@
 
 import Globals
 import datetime
+import decimal
+import json
+import time
 from mock import MagicMock, patch
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
 
+from ZenPacks.zenoss.PostgreSQL.latency import (
+    LatencyProbe,
+    percentile,
+    summarize,
+)
 from ZenPacks.zenoss.PostgreSQL.util import (
+    Budget,
+    DeadlineExceeded,
+    HOT_TABLE_ROWS,
+    LONG_RUNNING_QUERY_LENGTH,
+    LONG_RUNNING_TOP,
     PgHelper,
+    RawJSON,
+    RawJSONObject,
+    TableShard,
+    TableStats,
+    blockingFromRows,
+    encodeJSON,
+    spanStats,
     datetimeToEpoch,
     datetimeDurationInSeconds,
     exclude_patterns_list,
@@ -61,6 +81,64 @@ class TestConnectionCaching(BaseTestCase):
         self.assertIn('db1', helper._connections)
         self.assertIn('db2', helper._connections)
 
+    @patch('psycopg2.connect')
+    def test_max_connections(self, mock_connect):
+        """Test that the least recently used connection is closed first"""
+        mock_connect.side_effect = lambda **kwargs: MagicMock()
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg', maxConnections=2
+        )
+
+        default = helper.getConnection('pg')
+        db1 = helper.getConnection('db1')
+        helper.getConnection('db2')
+
+        self.assertEqual(sorted(helper._connections), ['db2', 'pg'])
+        self.assertTrue(db1.close.called)
+        self.assertFalse(default.close.called)
+
+        helper.getConnection('pg')
+        helper.getConnection('db1')
+        self.assertEqual(sorted(helper._connections), ['db1', 'pg'])
+        self.assertEqual(mock_connect.call_count, 4)
+
+    @patch('psycopg2.connect')
+    def test_consistent_snapshot(self, mock_connect):
+        """Test that the default database's queries share one snapshot"""
+        connections = []
+
+        def connect(**kwargs):
+            connection = MagicMock()
+            connection.server_version = 150004
+            connections.append(connection)
+            return connection
+
+        mock_connect.side_effect = connect
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg', consistent=True
+        )
+
+        default = helper.getConnection('pg')
+        default.set_session.assert_called_once_with(
+            isolation_level='REPEATABLE READ', readonly=True)
+
+        # Sent with SELECT 1, without a round trip of its own.
+        cursor = default.cursor.return_value
+        cursor.execute.assert_called_once_with(
+            "SET LOCAL stats_fetch_consistency = snapshot; SELECT 1")
+
+        helper.endSnapshot()
+        helper.endSnapshot()
+        self.assertEqual(default.commit.call_count, 1)
+
+        other = helper.getConnection('db1')
+        self.assertFalse(other.set_session.called)
+        other.cursor.return_value.execute.assert_called_once_with("SELECT 1")
+
 
 class TestLatencyMeasurement(BaseTestCase):
     """Tests for latency measurement functionality"""
@@ -89,6 +167,52 @@ class TestLatencyMeasurement(BaseTestCase):
             helper._connections['testdb']['query_latency'], 0.1, places=2
         )
 
+    def test_latency_summary(self):
+        """Test the median, minimum, 95th percentile and maximum"""
+        self.assertEqual(summarize('queryLatency', [0.3, 0.1, 0.2]), dict(
+            queryLatency=0.2,
+            queryLatencyMin=0.1,
+            queryLatencyP95=0.3,
+            queryLatencyMax=0.3))
+
+        self.assertAlmostEqual(summarize('x', [0.1, 0.2])['x'], 0.15)
+        self.assertEqual(percentile(range(1, 101), 0.95), 95)
+        self.assertEqual(percentile([7], 0.95), 7)
+
+    @patch('psycopg2.connect')
+    @patch('ZenPacks.zenoss.PostgreSQL.util.probeHandshake')
+    def test_latency_probe(self, mock_handshake, mock_connect):
+        """Test that further samples don't replace the kept connection"""
+        mock_handshake.return_value = (0.0, None)
+        connections = [MagicMock(), MagicMock(), MagicMock()]
+        mock_connect.side_effect = connections
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        probe = LatencyProbe(helper, breakdown=True, spacing=0)
+        for _ in range(3):
+            probe.sample('db1')
+
+        self.assertEqual(probe.count('db1'), 3)
+        self.assertEqual(probe.databases, ['db1'])
+        self.assertEqual(mock_connect.call_count, 3)
+        self.assertIs(helper.getConnection('db1'), connections[0])
+        self.assertTrue(connections[1].close.called)
+        self.assertTrue(connections[2].close.called)
+        self.assertEqual(
+            connections[0].cursor.return_value.execute.call_count, 3)
+
+        stats = probe.stats('db1')
+        self.assertEqual(sorted(stats), [
+            'authLatency', 'connectionLatency', 'connectionLatencyMax',
+            'connectionLatencyMin', 'connectionLatencyP95', 'queryLatency',
+            'queryLatencyMax', 'queryLatencyMin', 'queryLatencyP95',
+            'tcpLatency'])
+        self.assertEqual(probe.stats('db2'), {})
+
 
 class TestDatabaseOperations(BaseTestCase):
     """Tests for parsing database query results into Python structures"""
@@ -143,6 +267,362 @@ class TestDatabaseOperations(BaseTestCase):
         self.assertEqual(stats['xactTotal'], expected_total_xact)
         self.assertAlmostEqual(stats['xactRollbackPct'], expected_rollback_pct, places=2)
 
+    @patch('psycopg2.connect')
+    def test_get_database_stats_subset(self, mock_connect):
+        """Test getDatabaseStats only selects columns for requested stats"""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [('testdb', 5, 1000, 50)]
+
+        mock_connection = MagicMock()
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        stats = helper.getDatabaseStats(
+            stats=['numBackends', 'xactRollbackPct'])['testdb']
+
+        query = mock_cursor.execute.call_args[0][0]
+        self.assertNotIn('pg_database_size', query)
+        self.assertIn('xact_rollback', query)
+
+        self.assertEqual(stats['numBackends'], 5)
+        self.assertNotIn('size', stats)
+        self.assertAlmostEqual(
+            stats['xactRollbackPct'], (50.0 / 1050) * 100, places=2)
+
+    @patch('psycopg2.connect')
+    def test_get_table_stats_subset(self, mock_connect):
+        """Test getTableStatsForDatabase skips pg_class unless size is used"""
+        mock_cursor = MagicMock()
+        mock_cursor.__iter__.return_value = iter([('users', 7, 3)])
+
+        mock_connection = MagicMock()
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        tables = helper.getTableStatsForDatabase(
+            'testdb', stats=['seqScan', 'nDeadTup'])
+
+        query = mock_cursor.execute.call_args[0][0]
+        self.assertNotIn('pg_class', query)
+        self.assertNotIn('pg_total_relation_size', query)
+        self.assertEqual(tables['users'].items(), [
+            ('seqScan', 7), ('nDeadTup', 3)])
+        self.assertIsNone(tables['users'].size)
+
+    @patch('psycopg2.connect')
+    def test_get_table_stats_shard(self, mock_connect):
+        """Test getTableStatsForDatabase limits a shard's tables"""
+        mock_cursor = MagicMock()
+        mock_cursor.__iter__.return_value = iter([('users', 7)])
+
+        mock_connection = MagicMock()
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        shard = TableShard(2, 4, hot=['orders', 'audit'])
+        for stats in (['seqScan'], ['seqScan', 'size']):
+            helper.getTableStatsForDatabase(
+                'testdb', stats=stats, shard=shard)
+
+            query, params = mock_cursor.execute.call_args[0]
+            self.assertIn('mod(relid::bigint, %(count)s) = %(index)s', query)
+            self.assertEqual(params, dict(
+                index=2, count=4, hot=['audit', 'orders'],
+                hotRows=HOT_TABLE_ROWS))
+
+    @patch('psycopg2.connect')
+    def test_get_table_stats_json(self, mock_connect):
+        """Test server-built table documents are passed through undecoded"""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (
+            '{"users": {"seqScan": 7}}', '{"seqScan": 7}')
+
+        mock_connection = MagicMock()
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        tables, summaries = helper.getTableStatsForDatabaseJSON(
+            'testdb', stats=['seqScan'], summaries=['seqScan', 'idxScan'])
+
+        query = mock_cursor.execute.call_args[0][0]
+        self.assertIn('json_object_agg', query)
+        self.assertNotIn('idxScan', query)
+
+        self.assertIsInstance(tables, RawJSON)
+        self.assertEqual(tables.text, '{"users": {"seqScan": 7}}')
+        self.assertEqual(summaries, dict(seqScan=7))
+
+    @patch('psycopg2.connect')
+    def test_cached_sizes(self, mock_connect):
+        """Test sizes are collected on their own and can be passed in"""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [('users', 8192)]
+        mock_cursor.fetchone.return_value = ('{}', '{}')
+
+        mock_connection = MagicMock()
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        self.assertEqual(helper.getTableSizes('testdb'), dict(users=8192))
+        query = mock_cursor.execute.call_args[0][0]
+        self.assertIn('pg_total_relation_size', query)
+
+        helper.getTableStatsForDatabaseJSON(
+            'testdb', stats=['seqScan', 'totalSize'],
+            totalSizes=dict(users=8192))
+
+        query, params = mock_cursor.execute.call_args[0]
+        self.assertNotIn('pg_total_relation_size', query)
+        self.assertIn('%(totalSizes)s::jsonb', query)
+        self.assertEqual(json.loads(params['totalSizes']), dict(users=8192))
+        self.assertEqual(
+            [span.name for span in helper.spans], ['tableSizes', 'tableStats'])
+
+    @patch('psycopg2.connect')
+    def test_iter_table_stats_uses_server_side_cursor(self, mock_connect):
+        """Test table stats are streamed through a named cursor"""
+        mock_cursor = MagicMock()
+        mock_cursor.__iter__.return_value = iter([('t1', 1), ('t2', 2)])
+
+        mock_connection = MagicMock()
+        mock_connection.cursor.side_effect = \
+            lambda name=None: mock_cursor if name else MagicMock()
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg', itersize=500
+        )
+
+        tables = helper.iterTableStatsForDatabase('testdb', stats=['seqScan'])
+        tableName, tableStats = next(tables)
+        self.assertEqual(tableName, 't1')
+        self.assertEqual(tableStats.seqScan, 1)
+
+        mock_connection.cursor.assert_called_with(name='zenoss_table_stats')
+        self.assertEqual(mock_cursor.itersize, 500)
+
+        self.assertEqual(
+            [(name, stats.seqScan) for name, stats in tables], [('t2', 2)])
+        self.assertEqual(mock_cursor.close.call_count, 1)
+
+    @patch('psycopg2.connect')
+    def test_connection_stats_durations(self, mock_connect):
+        """Test query duration summaries are true min/max/avg"""
+        now = datetime.datetime(2023, 1, 1, 12, 0, 10)
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            ('db1', None, now - datetime.timedelta(seconds=s), now, now)
+            for s in (1, 3, 5)
+        ]
+
+        mock_connection = MagicMock()
+        mock_connection.server_version = 90124
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        stats = helper.getConnectionStats()
+
+        self.assertEqual(stats['totalConnections'], 3)
+        self.assertAlmostEqual(stats['minQueryDuration'], 1.0)
+        self.assertAlmostEqual(stats['maxQueryDuration'], 5.0)
+        self.assertAlmostEqual(stats['avgQueryDuration'], 3.0)
+        self.assertAlmostEqual(
+            stats['databases']['db1']['avgQueryDuration'], 3.0)
+        self.assertNotIn('avgTxnDuration', stats)
+
+    @patch('psycopg2.connect')
+    def test_server_stats(self, mock_connect):
+        """Test server sections combined in one query parse as their own"""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (
+            '[{"datname": "db1", "numbackends": 3}]',
+            # Columns named alike keep their order.
+            '[{"datname": "db1", "count": 4, "count": 1, "count": 2,'
+            ' "min": 2.0, "max": 2.0, "sum": 2.0, "count": 1,'
+            ' "min": 2.0, "max": 8.0, "sum": 10.0, "count": 2,'
+            ' "min": 8.0, "max": 8.0, "sum": 8.0, "count": 1}]',
+            None,
+        )
+
+        mock_connection = MagicMock()
+        mock_connection.server_version = 90624
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        self.assertTrue(helper.supportsServerBatch())
+        stats = helper.getServerStats(
+            ['databaseStats', 'connectionStats', 'locks'],
+            stats=['numBackends'])
+
+        sql = mock_cursor.execute.call_args[0][0]
+        self.assertEqual(sql.count('json_agg(q)'), 3)
+        self.assertEqual(
+            [(s.name, s.database) for s in helper.spans],
+            [('serverStats', 'pg')])
+
+        self.assertEqual(stats['databaseStats']['db1'].numBackends, 3)
+
+        connections = stats['connectionStats']
+        self.assertEqual(connections['totalConnections'], 4)
+        self.assertEqual(connections['activeConnections'], 1)
+        self.assertEqual(connections['idleConnections'], 2)
+        self.assertAlmostEqual(connections['avgTxnDuration'], 5.0)
+        self.assertAlmostEqual(connections['maxIdleDuration'], 8.0)
+
+        self.assertEqual(stats['locks']['locksTotal'], 0)
+        self.assertEqual(stats['locks']['databases'], {})
+
+    @patch('psycopg2.connect')
+    def test_long_running(self, mock_connect):
+        """Test the server ranks long running sessions, longest first"""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            ('db1', 'active', 11, 'app', 'psql', None, 'SELECT 1', 5.0),
+            ('db1', 'idle in transaction', 12, 'app', 'web', None,
+             'UPDATE t SET x = 1', 40.0),
+            ('db2', 'active', 21, 'app', 'psql', 'Lock: relation',
+             'LOCK TABLE t', 7.5),
+        ]
+
+        mock_connection = MagicMock()
+        mock_connection.server_version = 90624
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        sessions = helper.getLongRunning()
+
+        sql = mock_cursor.execute.call_args[0][0]
+        self.assertIn('wait_event', sql)
+        self.assertIn('rank <= {0}'.format(LONG_RUNNING_TOP), sql)
+        self.assertIn(
+            'substr(query, 1, {0})'.format(LONG_RUNNING_QUERY_LENGTH), sql)
+
+        self.assertEqual([x['pid'] for x in sessions['db1']], [12, 11])
+        self.assertEqual(sessions['db2'][0]['waitEvent'], 'Lock: relation')
+        self.assertEqual(sessions['db2'][0]['user'], 'app')
+
+    @patch('psycopg2.connect')
+    def test_blocking(self, mock_connect):
+        """Test the head blockers of chains of sessions waiting on locks"""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            (1, [], 'db1', 'app', 'web', 'idle in transaction',
+             'UPDATE t SET x = 1', 90.0),
+            (2, [1], 'db1', 'app', 'web', 'active', None, 60.0),
+            (3, [2], 'db1', 'app', 'psql', 'active', None, 30.0),
+            (4, [1, 2], 'db1', 'app', 'psql', 'active', None, 10.0),
+            (5, [], 'db2', 'app', 'batch', 'active', 'LOCK TABLE u', 5.0),
+            (6, [5], 'db2', 'app', 'web', 'active', None, 2.0),
+        ]
+
+        mock_connection = MagicMock()
+        mock_connection.server_version = 90624
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        blocking = helper.getBlocking()
+
+        sql = mock_cursor.execute.call_args[0][0]
+        self.assertIn('pg_blocking_pids', sql)
+        self.assertIn(
+            'substr(query, 1, {0})'.format(LONG_RUNNING_QUERY_LENGTH), sql)
+
+        self.assertEqual(blocking['blockedSessions'], 4)
+        self.assertEqual(blocking['blockingChainDepth'], 2)
+
+        head = blocking['heads'][0]
+        self.assertEqual(head['pid'], 1)
+        self.assertEqual(head['blocked'], 3)
+        self.assertEqual(head['depth'], 2)
+        self.assertAlmostEqual(head['maxWait'], 60.0)
+        self.assertEqual(head['query'], 'UPDATE t SET x = 1')
+        self.assertEqual(
+            [(x['pid'], x['blocked']) for x in blocking['heads']],
+            [(1, 3), (5, 1)])
+
+    @patch('psycopg2.connect')
+    def test_query_spans(self, mock_connect):
+        """Test each query method records a span of its query"""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            ('db1', 'AccessShareLock', True),
+            ('db2', 'ExclusiveLock', False),
+        ]
+        mock_cursor.__iter__.return_value = iter([('t1', 7), ('t2', 8)])
+
+        mock_connection = MagicMock()
+        mock_connection.server_version = 90124
+        mock_connection.cursor.return_value = mock_cursor
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg'
+        )
+
+        helper.getLocks()
+        list(helper.iterTableStatsForDatabase('db1', stats=['seqScan']))
+
+        self.assertEqual(
+            [(s.name, s.database, s.rows) for s in helper.spans],
+            [('locks', 'pg', 2), ('tableStats', 'db1', 2)])
+
+        # Only the first row of so few is measured for the byte estimate.
+        self.assertEqual(
+            helper.spans[0].bytes, 2 * len('db1AccessShareLockTrue'))
+
+        stats = spanStats(helper.spans)
+        self.assertEqual(stats['rowsFetched'], 4)
+        self.assertIn('locksDuration', stats)
+        self.assertIn('tableStatsDuration', stats)
+        self.assertNotIn('connectionStatsDuration', stats)
+
 
 class TestHelperFunctions(BaseTestCase):
     """Tests for utility functions"""
@@ -156,6 +636,56 @@ class TestHelperFunctions(BaseTestCase):
         end = datetime.datetime(2023, 1, 1, 12, 0, 5, 500000)
         self.assertAlmostEqual(datetimeDurationInSeconds(begin, end), 5.5, places=2)
 
+    def test_blocking_cycles(self):
+        """Test blocking chains through deadlocks and unlisted blockers"""
+        blocking = blockingFromRows([
+            (1, [2], 'db1', 'app', 'web', 'active', None, 3.0),
+            (2, [1], 'db1', 'app', 'web', 'active', None, 2.0),
+            (3, [2], 'db1', 'app', 'web', 'active', None, 1.0),
+            (4, [0], 'db2', 'app', 'web', 'active', None, 8.0),
+        ])
+
+        self.assertEqual(blocking['blockedSessions'], 4)
+
+        # Each waiting session is counted against one head.
+        self.assertEqual(
+            sum(x['blocked'] for x in blocking['heads']), 3)
+
+        # A prepared transaction takes the database of what it blocks.
+        prepared = [x for x in blocking['heads'] if x['pid'] == 0][0]
+        self.assertEqual(prepared['datname'], 'db2')
+        self.assertEqual(prepared['blocked'], 1)
+
+        self.assertEqual(
+            blockingFromRows([]),
+            dict(blockedSessions=0, blockingChainDepth=0, heads=[]))
+
+    def test_encode_json_with_raw_fragments(self):
+        """Test encodeJSON merges raw fragments with regular values"""
+        database = RawJSONObject('{"size": 10}')
+        database.update(numBackends=2)
+        database['tables'] = RawJSON('{"users": {"seqScan": 7}}')
+
+        encoded = encodeJSON(dict(databases=dict(testdb=database)))
+
+        self.assertEqual(json.loads(encoded), dict(databases=dict(testdb=dict(
+            size=10,
+            numBackends=2,
+            tables=dict(users=dict(seqScan=7))))))
+
+    def test_stats_record(self):
+        """Test stat records behave like a sparse read-only dict"""
+        record = TableStats.fromValues(
+            ['size', 'seqScan'], [decimal.Decimal('8192'), 0])
+
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual(record.seqScan, 0)
+        self.assertIsNone(record.nDeadTup)
+        self.assertIn('seqScan', record)
+        self.assertNotIn('nDeadTup', record)
+        self.assertEqual(record['size'], decimal.Decimal('8192'))
+        self.assertEqual(record.toJSON(), dict(size='8192', seqScan=0))
+
     def test_exclude_patterns(self):
         """Test regex pattern compilation and filtering logic"""
         excludes = ['test_.*', '# Comment', '', '  ']
@@ -190,6 +720,69 @@ class TestConnectionCleanup(BaseTestCase):
         self.assertEqual(mock_conn2.close.call_count, 1)
 
 
+class TestTimeouts(BaseTestCase):
+    """Tests for statement timeouts and the poll deadline"""
+
+    @patch('psycopg2.connect')
+    def test_statement_timeout(self, mock_connect):
+        """Test that statement_timeout is set when connecting"""
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg', statementTimeout=2.5
+        )
+
+        helper.getConnection('db1')
+
+        kwargs = mock_connect.call_args[1]
+        self.assertEqual(kwargs['options'], '-c statement_timeout=2500')
+        self.assertEqual(kwargs['connect_timeout'], 10)
+
+    @patch('psycopg2.connect')
+    def test_deadline(self, mock_connect):
+        """Test that queries are cancelled and refused past the deadline"""
+        mock_connection = MagicMock()
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg', deadline=time.time() + 0.2
+        )
+
+        helper.getConnection('db1')
+        self.assertEqual(mock_connect.call_args[1]['connect_timeout'], 1)
+
+        time.sleep(0.3)
+        self.assertEqual(mock_connection.cancel.call_count, 1)
+        self.assertRaises(DeadlineExceeded, helper.getConnection, 'db2')
+        self.assertRaises(DeadlineExceeded, helper.checkDeadline)
+        helper.close()
+
+    @patch('time.time')
+    def test_budget(self, mock_time):
+        """Test that work is only started if projected to fit"""
+        mock_time.return_value = 100.0
+        self.assertTrue(Budget().allows('tableStats'))
+        self.assertEqual(Budget().remaining(), None)
+
+        budget = Budget(deadline=110.0)
+        self.assertTrue(budget.allows('tableStats'))
+
+        for seconds in (102.0, 106.0):
+            with budget.measure('tableStats'):
+                mock_time.return_value = seconds
+
+        self.assertEqual(budget.estimate('tableStats'), 3.0)
+        self.assertTrue(budget.allows('tableStats'))
+        self.assertTrue(budget.allows('locks'))
+
+        mock_time.return_value = 107.5
+        self.assertFalse(budget.allows('tableStats'))
+        self.assertTrue(budget.allows('locks'))
+
+        mock_time.return_value = 110.0
+        self.assertFalse(budget.allows('locks'))
+
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
@@ -198,4 +791,5 @@ def test_suite():
     suite.addTest(makeSuite(TestDatabaseOperations))
     suite.addTest(makeSuite(TestHelperFunctions))
     suite.addTest(makeSuite(TestConnectionCleanup))
+    suite.addTest(makeSuite(TestTimeouts))
     return suite
@@ -0,0 +1,327 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import collections
+import imp
+import os
+import shutil
+import tempfile
+
+import Globals
+import psycopg2
+from mock import patch
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.PostgreSQL.snapshots import (
+    RaisedEvents,
+    SizeCache,
+    TableSnapshots,
+    readDocument,
+    snapshotPath,
+)
+from ZenPacks.zenoss.PostgreSQL.util import Budget, DatabaseStats, TableStats
+
+# The poller is run as a script by zencommand, not imported as a module.
+poll_postgres = imp.load_source('poll_postgres', os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'libexec', 'poll_postgres.py'))
+
+
+class FakeHelper(object):
+    """
+    Stands in for PgHelper on a server with databases, a dict of each
+    database's number of tables. Counts the calls of each query method,
+    by name and by (name, database), and raises the errors in failures,
+    keyed the same way.
+    """
+
+    def __init__(self, databases, failures=None):
+        self.databases = databases
+        self.failures = failures or {}
+        self.calls = collections.defaultdict(int)
+        self.budget = Budget()
+        self.spans = []
+
+    def _call(self, name, db=None):
+        self.calls[name] += 1
+        self.calls[(name, db)] += 1
+        for key in (name, (name, db)):
+            if key in self.failures:
+                raise self.failures[key]
+
+    def tables(self, db):
+        return dict(
+            ('t{0}'.format(i), TableStats(seqScan=i, nLiveTup=10))
+            for i in range(self.databases[db]))
+
+    def getConnection(self, db):
+        self._call('connect', db)
+
+    def supportsServerJSON(self):
+        return False
+
+    def supportsServerBatch(self):
+        return False
+
+    def getDatabaseStats(self, stats=None):
+        self._call('databaseStats')
+        values = dict(numBackends=1, size=1000)
+        return dict(
+            (db, DatabaseStats(**dict(
+                (k, v) for k, v in values.iteritems()
+                if stats is None or k in stats)))
+            for db in self.databases)
+
+    def getDatabaseSizes(self):
+        self._call('databaseSizes')
+        return dict((db, 1000) for db in self.databases)
+
+    def getTableSizes(self, db):
+        self._call('tableSizes', db)
+        return dict((name, 10) for name in self.tables(db))
+
+    def getConnectionLatencyForDatabase(self, db):
+        self._call('latency', db)
+        return 0.01
+
+    def getQueryLatencyForDatabase(self, db):
+        return 0.001
+
+    def sampleConnection(self, db):
+        self._call('sampleConnection', db)
+        return 0.01
+
+    def sampleQuery(self, db):
+        return 0.001
+
+    def sampleHandshake(self):
+        self._call('handshake')
+        return 0.001, None
+
+    def getConnectionStats(self):
+        self._call('connectionStats')
+        return dict(
+            totalConnections=len(self.databases),
+            databases=dict(
+                (db, dict(totalConnections=1)) for db in self.databases))
+
+    def getLocks(self):
+        self._call('locks')
+        return dict(locksTotal=0, databases={})
+
+    def getBlocking(self):
+        self._call('blocking')
+        return dict(blockedSessions=0, blockingChainDepth=0, heads=[])
+
+    def getTableStatsForDatabase(self, db, stats=None, shard=None):
+        self._call('tableStats', db)
+        return dict(
+            (name, tableStats)
+            for name, tableStats in self.tables(db).iteritems()
+            if shard is None or tableStats.seqScan % shard.count ==
+            shard.index or name in shard.hot)
+
+    def iterTableStatsForDatabase(self, db, stats=None):
+        self._call('tableStats', db)
+        return self.tables(db).iteritems()
+
+    def rollback(self, db):
+        pass
+
+    def checkDeadline(self):
+        pass
+
+    def endSnapshot(self):
+        pass
+
+
+class TestPoller(BaseTestCase):
+    """Tests for the command poller over several polls"""
+
+    def setUp(self):
+        super(TestPoller, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestPoller, self).tearDown()
+
+    def poller(self, level, **kwargs):
+        return poll_postgres.PostgresPoller(
+            'localhost', 5432, 'pg', 'pw', False, 'postgres',
+            level=level, **kwargs)
+
+    def test_shard_warm_up(self):
+        """Test table sums are left out until every shard was collected"""
+        poller = self.poller('server', tableShards=3)
+        path = snapshotPath(self.directory, 'localhost', 5432, 'server')
+        databases = dict(db1=6, db2=6)
+
+        sums = []
+        for cycle in range(5):
+            if cycle == 3:
+                # A new database is warmed up on its own.
+                databases['db3'] = 3
+
+            pg = FakeHelper(databases)
+            snapshots = TableSnapshots(path)
+            data = poller.getData(pg, snapshots=snapshots)
+            snapshots.save()
+
+            self.assertEqual(pg.calls[('tableStats', 'db1')], 1)
+            sums.append((
+                data.get('nLiveTup'),
+                data['databases']['db1'].get('nLiveTup')))
+
+        self.assertEqual(sums, [
+            (None, None),
+            (None, None),
+            (120, 60),
+            (None, 60),
+            (None, 60),
+        ])
+
+        data = poller.getData(
+            FakeHelper(databases), snapshots=TableSnapshots(path))
+        self.assertEqual(data['nLiveTup'], 150)
+
+    def test_no_tables(self):
+        """Test a database without tables sums up to zero"""
+        data = self.poller('database').getData(FakeHelper(dict(db1=0, db2=2)))
+
+        self.assertEqual(data['databases']['db1']['nLiveTup'], 0)
+        self.assertEqual(data['databases']['db1']['seqScan'], 0)
+        self.assertEqual(data['databases']['db2']['nLiveTup'], 20)
+
+    def test_table_sizes(self):
+        """Test table sizes are kept between table polls"""
+        poller = self.poller('table', sizeInterval=3600)
+        path = snapshotPath(
+            self.directory, 'localhost', 5432, 'table', suffix='-sizes')
+
+        for databases in (dict(db1=2, db2=2),) * 3 + (dict(db1=2),):
+            pg = FakeHelper(databases)
+            sizes = SizeCache(path, 3600)
+            data = poller.getData(pg, sizes=sizes)
+            sizes.save()
+
+            self.assertEqual(
+                data['databases']['db1']['tables']['t1'].totalSize, 10)
+
+        # Only the first poll collected them.
+        self.assertEqual(pg.calls['tableSizes'], 0)
+        self.assertEqual(
+            sorted(readDocument(path)['tables']['db1']['sizes']),
+            ['t0', 't1'])
+
+        # A dropped database is forgotten.
+        self.assertNotIn('db2', readDocument(path)['tables'])
+
+    def test_missing_sizes(self):
+        """Test the server size is left out without every database's"""
+        path = snapshotPath(
+            self.directory, 'localhost', 5432, 'server', suffix='-sizes')
+
+        poller = self.poller('server', sizeInterval=3600)
+        pg = FakeHelper(dict(db1=1, db2=1), failures=dict(
+            databaseSizes=psycopg2.OperationalError('canceled')))
+        data = poller.getData(pg, sizes=SizeCache(path, 3600))
+
+        self.assertNotIn('size', data)
+        self.assertNotIn('size', data['databases']['db1'])
+        self.assertEqual(data['numBackends'], 2)
+
+        data = poller.getData(
+            FakeHelper(dict(db1=1, db2=1)), sizes=SizeCache(path, 3600))
+        self.assertEqual(data['size'], 2000)
+
+    @patch('time.sleep')
+    def test_latency_samples(self, mock_sleep):
+        """Test only the databases a level prints are sampled"""
+        databases = dict(db1=1, db2=1)
+        for level, sampled in (
+                ('server', ['postgres']),
+                ('database', ['db1', 'db2', 'postgres'])):
+            pg = FakeHelper(databases)
+            data = self.poller(level, latencySamples=3).getData(pg)
+
+            self.assertEqual(
+                sorted(key[1] for key in pg.calls
+                       if isinstance(key, tuple) and key[0] == 'latency'),
+                sampled)
+            for dbName in sampled:
+                self.assertEqual(
+                    pg.calls[('sampleConnection', dbName)], 2)
+
+            # The handshake is the same for every database.
+            self.assertEqual(pg.calls['handshake'], 1)
+            self.assertIn('tcpLatency', data)
+
+        self.assertIn('authLatency', data['databases']['db2'])
+
+    def events(self, data):
+        return sorted(
+            (event.get('component'), event['eventKey'], event['severity'])
+            for event in data['events'])
+
+    def test_database_failure(self):
+        """Test a failing database only costs its own stats"""
+        path = snapshotPath(
+            self.directory, 'localhost', 5432, None, suffix='-events')
+        failures = {('tableStats', 'db2'): psycopg2.OperationalError(
+            'relation does not exist')}
+
+        events = []
+        for failed in (True, False, False):
+            pg = FakeHelper(
+                dict(db1=2, db2=2), failures=failures if failed else None)
+            data = self.poller(None).getData(pg)
+
+            raised = RaisedEvents(path)
+            events.append(self.events(dict(
+                events=raised.filter(data['events']))))
+            raised.save()
+
+            if failed:
+                self.assertEqual(
+                    sorted(data['databases']['db1']['tables']), ['t0', 't1'])
+                self.assertEqual(data['databases']['db1']['nLiveTup'], 20)
+                self.assertNotIn('tables', data['databases']['db2'])
+                self.assertEqual(
+                    data['databases']['db2']['totalConnections'], 1)
+
+                # The server's sums would be missing db2.
+                self.assertNotIn('nLiveTup', data)
+                self.assertEqual(data['numBackends'], 2)
+
+        self.assertIn(
+            ('db2', 'postgresDatabaseFailure', 4), events[0])
+        self.assertEqual(events[1:], [
+            [('db2', 'postgresDatabaseFailure', 0)],
+            [],
+        ])
+
+    def test_section_failure(self):
+        """Test a failing server section only costs its own stats"""
+        pg = FakeHelper(dict(db1=2, db2=2), failures=dict(
+            locks=psycopg2.OperationalError('out of shared memory')))
+        data = self.poller(None).getData(pg)
+
+        self.assertNotIn('locksTotal', data)
+        self.assertEqual(data['totalConnections'], 2)
+        self.assertEqual(data['blockedSessions'], 0)
+        self.assertEqual(data['nLiveTup'], 40)
+        self.assertIn((None, 'postgresSectionFailure', 4), self.events(data))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestPoller))
+    return suite
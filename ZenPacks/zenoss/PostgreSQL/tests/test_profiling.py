@@ -0,0 +1,145 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import os
+import pstats
+import shutil
+import tempfile
+
+import mock
+
+import Globals
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from twisted.internet import defer
+
+from ZenPacks.zenoss.PostgreSQL.profiling import Profile, profiled
+
+
+class Device(object):
+    id = 'pg1'
+
+
+class Plugin(object):
+    @profiled('collect')
+    def collect(self, device, deferred):
+        return deferred
+
+    @profiled('process')
+    def process(self, device, results):
+        return [dict(id=i) for i in range(results)]
+
+
+class TestProfiling(BaseTestCase):
+    """Tests for opt-in profiling"""
+
+    def setUp(self):
+        super(TestProfiling, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestProfiling, self).tearDown()
+
+    def reports(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_profile(self):
+        """Test that a profile and its summary are written"""
+        with Profile(self.directory, 'localhost-server') as profile:
+            objects = [[i] for i in range(1000)]
+
+        self.assertEqual(len(objects), 1000)
+        self.assertEqual(
+            [os.path.basename(profile.path) + ext
+             for ext in ('.pstats', '.txt')],
+            self.reports())
+
+        stats = pstats.Stats(profile.path + '.pstats')
+        self.assertTrue(stats.total_calls > 0)
+
+        with open(profile.path + '.txt') as f:
+            summary = f.read()
+
+        self.assertIn('RSS at start', summary)
+        self.assertIn('RSS at end', summary)
+        self.assertIn('process peak RSS', summary)
+        self.assertIn('list', summary)
+
+    def test_profiled(self):
+        """Test that plugin methods are profiled only when enabled"""
+        plugin = Plugin()
+
+        with mock.patch.dict(os.environ, {'ZP_POSTGRESQL_PROFILE': ''}):
+            plugin.process(Device(), 10)
+
+        self.assertEqual(self.reports(), [])
+
+        with mock.patch.dict(
+                os.environ, {'ZP_POSTGRESQL_PROFILE': self.directory}):
+            self.assertEqual(len(plugin.process(Device(), 10)), 10)
+            self.assertEqual(len(self.reports()), 2)
+
+            d = defer.Deferred()
+            result = plugin.collect(Device(), d)
+            self.assertEqual(len(self.reports()), 2)
+
+            d.callback('results')
+            self.assertEqual(result.result, 'results')
+
+        reports = self.reports()
+        self.assertEqual(len(reports), 4)
+        self.assertTrue(reports[0].startswith('pg1-collect-'))
+        self.assertTrue(reports[2].startswith('pg1-process-'))
+
+    def test_overlapping(self):
+        """Test that only one profile runs at a time, each named apart"""
+        first = Profile(self.directory, 'pg1-collect').start()
+        second = Profile(self.directory, 'pg1-collect').start()
+        self.assertNotEqual(first.path, second.path)
+
+        second.stop()
+        first.stop()
+        self.assertEqual(len(self.reports()), 2)
+
+        with Profile(self.directory, 'pg1-collect'):
+            pass
+
+        self.assertEqual(len(self.reports()), 4)
+
+    def test_unwritable(self):
+        """Test that profiles that can't be written don't fail the run"""
+        plugin = Plugin()
+        directory = os.path.join(self.directory, 'profiles')
+
+        with mock.patch.dict(os.environ, {'ZP_POSTGRESQL_PROFILE': directory}):
+            self.assertEqual(len(plugin.process(Device(), 10)), 10)
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+            with mock.patch(
+                    'cProfile.Profile.dump_stats',
+                    side_effect=IOError(28, 'No space left on device')):
+                d = defer.Deferred()
+                result = plugin.collect(Device(), d)
+                d.callback('results')
+
+            self.assertEqual(result.result, 'results')
+
+        # Not even a directory.
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+        with mock.patch.dict(os.environ, {'ZP_POSTGRESQL_PROFILE': path}):
+            self.assertEqual(len(plugin.process(Device(), 10)), 10)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestProfiling))
+    return suite
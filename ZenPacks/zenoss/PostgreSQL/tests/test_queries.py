@@ -0,0 +1,233 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import os
+
+from mock import MagicMock, patch
+
+import Globals
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.PostgreSQL.capture import Replay
+from ZenPacks.zenoss.PostgreSQL.queries import Capabilities, QUERIES
+from ZenPacks.zenoss.PostgreSQL.util import PgHelper
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def replayHelper(name):
+    """Return a PgHelper answered by the capture in fixtures/name."""
+    replay = Replay(os.path.join(FIXTURES, name))
+    patcher = patch('ZenPacks.zenoss.PostgreSQL.util.psycopg2', replay)
+    patcher.start()
+
+    helper = PgHelper(
+        host='localhost', port=5432, username='pg', password='pw',
+        ssl=False, default_db=replay.defaultDatabase)
+
+    return helper, patcher
+
+
+class TestCapabilities(BaseTestCase):
+    """Tests for picking queries by what the server can do"""
+
+    def test_variants(self):
+        """Test that the most capable variant the server has is picked"""
+        self.assertEqual(
+            Capabilities(90124).query('connectionStats').name, 'backends')
+        self.assertEqual(
+            Capabilities(90624).query('connectionStats').name, 'aggregate')
+        self.assertEqual(
+            Capabilities(None).query('connectionStats').name, 'backends')
+        self.assertEqual(
+            Capabilities(90624).query('longRunning').name, 'waitEvent')
+        self.assertEqual(
+            Capabilities(90510).query('longRunning').name, 'waiting')
+        self.assertEqual(
+            Capabilities(90124).query('longRunning').name, 'currentQuery')
+        self.assertEqual(
+            Capabilities(90624).query('blocking').name, 'blockingPids')
+        self.assertEqual(
+            Capabilities(90510).query('blocking').name, 'lockJoin')
+        self.assertEqual(
+            Capabilities(90124).query('blocking').name, 'lockJoinProcpid')
+
+        for name, variants in QUERIES.iteritems():
+            # Every server gets a variant of every query.
+            self.assertIsNone(variants[-1].capability, name)
+
+    @patch('psycopg2.connect')
+    def test_options(self, mock_connect):
+        """Test that later connections get the server's settings"""
+        mock_connection = MagicMock()
+        mock_connection.server_version = 150004
+        mock_connect.return_value = mock_connection
+
+        helper = PgHelper(
+            host='localhost', port=5432, username='pg', password='pw',
+            ssl=False, default_db='pg', statementTimeout=5
+        )
+
+        helper.getConnection('pg')
+        self.assertEqual(
+            mock_connect.call_args[1]['options'], '-c statement_timeout=5000')
+
+        self.assertIn('statsFetchConsistency', helper.capabilities())
+        helper.getConnection('db1')
+        self.assertEqual(
+            mock_connect.call_args[1]['options'],
+            '-c statement_timeout=5000 -c stats_fetch_consistency=none')
+
+        self.assertEqual(Capabilities(140010).options(), [])
+
+
+class TestConnectionStatsVariants(BaseTestCase):
+    """Tests for each variant of getConnectionStats against captures"""
+
+    def tearDown(self):
+        self.patcher.stop()
+        super(TestConnectionStatsVariants, self).tearDown()
+
+    def test_backends(self):
+        """Test counting backends before pg_stat_activity.state"""
+        helper, self.patcher = replayHelper('connectionStats-backends.jsonl')
+
+        stats = helper.getConnectionStats()
+
+        self.assertEqual(stats['totalConnections'], 4)
+        self.assertEqual(stats['activeConnections'], 3)
+        self.assertEqual(stats['idleConnections'], 2)
+        self.assertAlmostEqual(stats['minQueryDuration'], 2.0)
+        self.assertAlmostEqual(stats['maxQueryDuration'], 6.0)
+        self.assertAlmostEqual(stats['avgQueryDuration'], 4.0)
+        self.assertAlmostEqual(stats['avgTxnDuration'], 9.0)
+
+        shop = stats['databases']['shop']
+        self.assertEqual(shop['totalConnections'], 3)
+        self.assertAlmostEqual(shop['maxIdleDuration'], 40.0)
+        self.assertNotIn('avgIdleDuration', stats['databases']['crm'])
+
+    def test_aggregate(self):
+        """Test the server's summaries by state of each database"""
+        helper, self.patcher = replayHelper('connectionStats-aggregate.jsonl')
+
+        stats = helper.getConnectionStats()
+
+        self.assertEqual(stats['totalConnections'], 4)
+        self.assertEqual(stats['activeConnections'], 2)
+        self.assertEqual(stats['idleConnections'], 2)
+        self.assertAlmostEqual(stats['minQueryDuration'], 2.0)
+        self.assertAlmostEqual(stats['maxQueryDuration'], 6.0)
+        self.assertAlmostEqual(stats['avgQueryDuration'], 4.0)
+        self.assertAlmostEqual(stats['avgTxnDuration'], 16.0)
+        self.assertAlmostEqual(stats['avgIdleDuration'], 25.0)
+
+        shop = stats['databases']['shop']
+        self.assertEqual(shop['totalConnections'], 3)
+        self.assertAlmostEqual(shop['minTxnDuration'], 12.0)
+        self.assertAlmostEqual(shop['maxTxnDuration'], 30.0)
+        self.assertAlmostEqual(shop['avgTxnDuration'], 21.0)
+        self.assertNotIn('avgIdleDuration', stats['databases']['crm'])
+
+
+class TestLongRunningVariants(BaseTestCase):
+    """Tests for each variant of getLongRunning against captures"""
+
+    def tearDown(self):
+        self.patcher.stop()
+        super(TestLongRunningVariants, self).tearDown()
+
+    def assertSessions(self, name, lockWait, idleWait, idleQuery):
+        helper, self.patcher = replayHelper(name)
+
+        sessions = helper.getLongRunning()
+
+        self.assertEqual(sorted(sessions), ['crm', 'shop'])
+        self.assertEqual(
+            [(s['pid'], s['kind']) for s in sessions['shop']],
+            [(102, 'idle in transaction'), (103, 'active'), (101, 'active')])
+
+        idle, _, locked = sessions['shop']
+        self.assertEqual(idle['user'], 'web')
+        self.assertEqual(idle['application'], 'shop-api')
+        self.assertEqual(idle['waitEvent'], idleWait)
+        self.assertEqual(idle['query'], idleQuery)
+        self.assertAlmostEqual(idle['seconds'], 610.0)
+        self.assertEqual(locked['waitEvent'], lockWait)
+
+        crm, = sessions['crm']
+        self.assertIsNone(crm['application'])
+        self.assertIsNone(crm['waitEvent'])
+
+    def test_wait_event(self):
+        """Test sessions with their wait events"""
+        self.assertSessions(
+            'longRunning-waitEvent.jsonl', 'Lock: transactionid',
+            'Client: ClientRead', 'UPDATE orders SET paid = true WHERE id = 7')
+
+    def test_waiting(self):
+        """Test sessions before wait events, only waiting on locks"""
+        self.assertSessions(
+            'longRunning-waiting.jsonl', 'Lock', None,
+            'UPDATE orders SET paid = true WHERE id = 7')
+
+    def test_current_query(self):
+        """Test sessions before pg_stat_activity.state"""
+        self.assertSessions(
+            'longRunning-currentQuery.jsonl', 'Lock', None,
+            '<IDLE> in transaction')
+
+
+class TestBlockingVariants(BaseTestCase):
+    """Tests for each variant of getBlocking against captures"""
+
+    def tearDown(self):
+        self.patcher.stop()
+        super(TestBlockingVariants, self).tearDown()
+
+    def assertBlocking(self, name, state):
+        helper, self.patcher = replayHelper(name)
+
+        blocking = helper.getBlocking()
+
+        self.assertEqual(blocking['blockedSessions'], 3)
+        self.assertEqual(blocking['blockingChainDepth'], 2)
+
+        head, = blocking['heads']
+        self.assertEqual(head['pid'], 301)
+        self.assertEqual(head['datname'], 'shop')
+        self.assertEqual(head['state'], state)
+        self.assertEqual(
+            head['query'], 'UPDATE orders SET paid = true WHERE id = 7')
+        self.assertEqual(head['blocked'], 3)
+        self.assertEqual(head['depth'], 2)
+        self.assertAlmostEqual(head['maxWait'], 70.0)
+
+    def test_blocking_pids(self):
+        """Test blocking sessions from pg_blocking_pids"""
+        self.assertBlocking(
+            'blocking-blockingPids.jsonl', 'idle in transaction')
+
+    def test_lock_join(self):
+        """Test blocking sessions from joining pg_locks"""
+        self.assertBlocking('blocking-lockJoin.jsonl', 'idle in transaction')
+
+    def test_lock_join_procpid(self):
+        """Test blocking sessions before pg_stat_activity.pid and state"""
+        self.assertBlocking('blocking-lockJoinProcpid.jsonl', None)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestCapabilities))
+    suite.addTest(makeSuite(TestConnectionStatsVariants))
+    suite.addTest(makeSuite(TestLongRunningVariants))
+    suite.addTest(makeSuite(TestBlockingVariants))
+    return suite
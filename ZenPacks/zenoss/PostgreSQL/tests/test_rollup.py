@@ -0,0 +1,110 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import Globals
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.PostgreSQL.rollup import (
+    Max,
+    Mean,
+    Min,
+    Ratio,
+    Rollups,
+    Sum,
+    WeightedMean,
+    batches,
+)
+from ZenPacks.zenoss.PostgreSQL.util import (
+    DATABASE_ROLLUPS,
+    DatabaseStats,
+    TableStats,
+)
+
+
+class TestRollups(BaseTestCase):
+    """Tests for the declarative rollup engine"""
+
+    def test_functions(self):
+        """Test each rollup function over dict members"""
+        members = [
+            dict(v=1, w=1),
+            dict(v=3, w=3),
+            dict(v=None, w=10),
+            dict(w=5),
+        ]
+
+        rollups = Rollups((
+            Sum('sum', 'v'),
+            Min('min', 'v'),
+            Max('max', 'v'),
+            Mean('mean', 'v'),
+            WeightedMean('weighted', 'w', 'v'),
+            Ratio('ratio', 'v', 'w', scale=100),
+        ), mapping=True)
+
+        self.assertEqual(rollups.evaluate(members), dict(
+            sum=4,
+            min=1,
+            max=3,
+            mean=2.0,
+            weighted=2.5,
+            ratio=(4.0 / 19) * 100,
+        ))
+
+    def test_empty(self):
+        """Test sums and ratios default to zero and the rest are left out"""
+        rollups = Rollups((
+            Sum('sum', 'v'),
+            Min('min', 'v'),
+            Mean('mean', 'v'),
+            Ratio('ratio', 'v', 'w'),
+        ), mapping=True)
+
+        self.assertEqual(rollups.evaluate([]), dict(sum=0, ratio=0))
+
+    def test_merged_batches_match_single_pass(self):
+        """Test merging batch states gives the same result as one batch"""
+        tables = [TableStats(seqScan=i, nLiveTup=i * 2) for i in range(10)]
+        rollups = Rollups((
+            Sum('seqScan'),
+            Max('nLiveTup'),
+            Mean('avgLive', 'nLiveTup'),
+        ))
+
+        merged = rollups.merge(*[
+            rollups.state(batch) for batch in batches(tables, 3)])
+
+        self.assertEqual(rollups.results(merged), rollups.evaluate(tables))
+
+    def test_percentages_are_weighted(self):
+        """Test server percentages are ratios of sums, not averages"""
+        databases = [
+            DatabaseStats(xactRollback=1, xactTotal=1000),
+            DatabaseStats(xactRollback=1, xactTotal=1),
+            DatabaseStats(xactRollback=0, xactTotal=0),
+        ]
+
+        summaries = Rollups(
+            DATABASE_ROLLUPS, names=['xactRollbackPct']).evaluate(databases)
+
+        self.assertAlmostEqual(
+            summaries['xactRollbackPct'], (2.0 / 1001) * 100, places=6)
+
+        # Order of the databases doesn't matter.
+        self.assertEqual(
+            summaries,
+            Rollups(DATABASE_ROLLUPS, names=['xactRollbackPct']).evaluate(
+                reversed(databases)))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestRollups))
+    return suite
@@ -0,0 +1,229 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import os
+import shutil
+import tempfile
+
+import Globals
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.PostgreSQL.snapshots import (
+    RaisedEvents,
+    SizeCache,
+    TableDigests,
+    TableSnapshots,
+    snapshotPath,
+)
+from ZenPacks.zenoss.PostgreSQL.util import TableStats
+
+
+class TestTableSnapshots(BaseTestCase):
+    """Tests for filling in tables missing from sharded polls"""
+
+    def setUp(self):
+        super(TestTableSnapshots, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = snapshotPath(self.directory, '10.0.0.1', 5432, 'table')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestTableSnapshots, self).tearDown()
+
+    def poll(self, now, fresh, shards=2):
+        """Return the tables of one poll collecting fresh at now."""
+        snapshots = TableSnapshots(self.path)
+        tables = snapshots.merge('db1', dict(
+            (name, TableStats(**stats)) for name, stats in fresh.items()),
+            shards, now=now)
+        snapshots.save()
+        return snapshots, tables
+
+    def test_estimates(self):
+        """Test missing tables are extrapolated without going backwards"""
+        self.poll(0, dict(
+            orders=dict(nTupIns=100, nLiveTup=10),
+            audit=dict(nTupIns=5, nLiveTup=5)))
+        snapshots, tables = self.poll(300, dict(
+            orders=dict(nTupIns=400, nLiveTup=12),
+            audit=dict(nTupIns=5, nLiveTup=5)))
+        self.assertEqual(snapshots.cycle, 1)
+        self.assertEqual(snapshots.hotTables('db1'), ['orders'])
+
+        # orders grew at one insert a second, audit not at all.
+        snapshots, tables = self.poll(600, {})
+        self.assertEqual(tables['orders'].nTupIns, 700)
+        self.assertEqual(tables['orders'].nLiveTup, 12)
+        self.assertEqual(tables['audit'].nTupIns, 5)
+
+        # Estimates that ran ahead are held until the table catches up.
+        snapshots, tables = self.poll(900, dict(
+            orders=dict(nTupIns=650, nLiveTup=13)))
+        self.assertEqual(tables['orders'].nTupIns, 700)
+        self.assertEqual(tables['orders'].nLiveTup, 13)
+
+        snapshots, tables = self.poll(1200, dict(
+            orders=dict(nTupIns=900, nLiveTup=13)))
+        self.assertEqual(tables['orders'].nTupIns, 900)
+
+    def test_reset_and_dropped(self):
+        """Test stats resets are passed on and dropped tables forgotten"""
+        self.poll(0, dict(orders=dict(nTupIns=100), audit=dict(nTupIns=5)))
+        self.poll(300, dict(orders=dict(nTupIns=400), audit=dict(nTupIns=5)))
+
+        snapshots, tables = self.poll(600, dict(orders=dict(nTupIns=3)))
+        self.assertEqual(tables['orders'].nTupIns, 3)
+        self.assertEqual(snapshots.hotTables('db1'), [])
+
+        self.poll(900, dict(orders=dict(nTupIns=4)))
+        snapshots, tables = self.poll(1200, dict(orders=dict(nTupIns=5)))
+        self.assertNotIn('audit', tables)
+
+    def test_targets(self):
+        """Test targets polling the same server keep their own snapshots"""
+        paths = [
+            snapshotPath(self.directory, '10.0.0.1', 5432, 'table',
+                         suffix='-sizes', target=target)
+            for target in (None, 'pg1/table', 'pg1-table-2')]
+
+        self.assertEqual(len(set(paths)), 3)
+        self.assertEqual(
+            os.path.basename(paths[1]),
+            '10.0.0.1_5432_table_pg1_table-sizes.json')
+
+    def test_unreadable(self):
+        """Test an unreadable snapshot file starts over"""
+        with open(self.path, 'w') as f:
+            f.write('{')
+
+        snapshots, tables = self.poll(0, dict(orders=dict(nTupIns=1)))
+        self.assertEqual(snapshots.cycle, 0)
+        self.assertEqual(tables.keys(), ['orders'])
+        self.assertTrue(os.path.exists(self.path))
+
+
+class TestSizeCache(BaseTestCase):
+    """Tests for sizes collected less often than other stats"""
+
+    def setUp(self):
+        super(TestSizeCache, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = snapshotPath(
+            self.directory, '10.0.0.1', 5432, 'table', suffix='-sizes')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestSizeCache, self).tearDown()
+
+    def test_due(self):
+        """Test sizes are due every interval and kept in between"""
+        sizes = SizeCache(self.path, 3600)
+        self.assertTrue(sizes.due(now=0))
+        self.assertTrue(sizes.due('db1', now=0))
+
+        sizes.set({'db1': 100, 'db2': 200}, now=0)
+        sizes.set({'orders': 10}, dbName='db1', now=60)
+        sizes.set({'audit': 20}, dbName='gone', now=60)
+        sizes.retain(['db1', 'db2'])
+        sizes.save()
+
+        sizes = SizeCache(self.path, 3600)
+        self.assertFalse(sizes.due(now=3599))
+        self.assertTrue(sizes.due(now=3600))
+        self.assertFalse(sizes.due('db1', now=3600))
+        self.assertTrue(sizes.due('db2', now=3600))
+        self.assertEqual(sizes.get(), {'db1': 100, 'db2': 200})
+        self.assertEqual(sizes.get('db1'), {'orders': 10})
+        self.assertEqual(sizes.get('gone'), {})
+
+        sizes.expire()
+        self.assertTrue(sizes.due(now=1))
+        self.assertEqual(sizes.get(), {'db1': 100, 'db2': 200})
+
+
+class TestTableDigests(BaseTestCase):
+    """Tests for printing only the tables whose stats are changing"""
+
+    def setUp(self):
+        super(TestTableDigests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = snapshotPath(
+            self.directory, '10.0.0.1', 5432, 'table', suffix='-digests')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestTableDigests, self).tearDown()
+
+    def test_changed(self):
+        """Test idle tables are left out between full refreshes"""
+        printed = []
+        for seqScan in (1, 2, 3, 4, 5, 6):
+            digests = TableDigests(self.path, 4)
+            printed.append(sorted(digests.changed('db1', dict(
+                orders=TableStats(seqScan=seqScan),
+                audit=TableStats(seqScan=7),
+                ))))
+            digests.save()
+
+        self.assertEqual(printed, [
+            ['audit', 'orders'],
+            ['audit', 'orders'],
+            ['orders'],
+            ['orders'],
+            ['audit', 'orders'],
+            ['orders'],
+        ])
+
+
+class TestRaisedEvents(BaseTestCase):
+    """Tests for only clearing the events that were raised"""
+
+    def setUp(self):
+        super(TestRaisedEvents, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = snapshotPath(
+            self.directory, '10.0.0.1', 5432, 'server', suffix='-events')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestRaisedEvents, self).tearDown()
+
+    def poll(self, *severities):
+        """Return the (component, severity) of the events kept of a poll."""
+        raised = RaisedEvents(self.path)
+        events = raised.filter([
+            dict(component=dbName, eventKey='failure', severity=severity)
+            for dbName, severity in severities])
+        raised.save()
+
+        return [(event['component'], event['severity']) for event in events]
+
+    def test_filter(self):
+        """Test clears are only kept for events raised by earlier polls"""
+        # The first poll clears everything, not knowing what was raised.
+        self.assertEqual(
+            self.poll(('db1', 0), ('db2', 4)), [('db1', 0), ('db2', 4)])
+        self.assertEqual(
+            self.poll(('db1', 0), ('db2', 4)), [('db2', 4)])
+
+        # Without a word about db2, it stays raised.
+        self.assertEqual(self.poll(('db1', 0)), [])
+        self.assertEqual(
+            self.poll(('db1', 0), ('db2', 0)), [('db2', 0)])
+        self.assertEqual(self.poll(('db1', 0), ('db2', 0)), [])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestTableSnapshots))
+    suite.addTest(makeSuite(TestSizeCache))
+    suite.addTest(makeSuite(TestTableDigests))
+    suite.addTest(makeSuite(TestRaisedEvents))
+    return suite
@@ -11,13 +11,20 @@
 #
 ###########################################################################
 
+import contextlib
 import copy
+import decimal
+import json
 import math
-import sys
+import threading
 import time
 import re
 import logging
 
+from latency import probeHandshake
+from queries import Capabilities
+from rollup import Max, Mean, Min, Ratio, Rollups, Sum
+
 LOG = logging.getLogger('zen.PostgreSQL.utils')
 
 
@@ -81,12 +88,931 @@ def CollectedOrModeledProperty(propertyName):
 
 addLocalLibPath()
 import psycopg2
+from psycopg2.extensions import QueryCanceledError
+
+
+class DeadlineExceeded(Exception):
+    """A query was about to start after the poll's deadline."""
+
+
+# Errors that only cost the query they happened in: statement_timeout,
+# cancellation at the deadline and refusing to start past it.
+TIMEOUT_ERRORS = (DeadlineExceeded, QueryCanceledError)
+
+# Errors that only cost the section and database they happened in, like
+# lacking permission, a database being dropped or the connection limit.
+# Catch TIMEOUT_ERRORS first, which are among them.
+DATABASE_ERRORS = (psycopg2.Error,)
+
+
+class Budget(object):
+    """
+    The time left before a deadline, and how long each kind of work has
+    taken so far, to tell whether more of a kind can still finish in time.
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self._seconds = {}
+
+    def remaining(self):
+        """Return the seconds left, or None without a deadline."""
+        if self.deadline is None:
+            return None
+
+        return self.deadline - time.time()
+
+    def estimate(self, kind):
+        """Return the mean seconds kind has taken, or 0 if never done."""
+        seconds = self._seconds.get(kind)
+        if not seconds:
+            return 0.0
+
+        return sum(seconds) / len(seconds)
+
+    def allows(self, kind):
+        """Return True if another kind of work is projected to fit."""
+        remaining = self.remaining()
+        if remaining is None:
+            return True
+
+        return remaining > 0 and self.estimate(kind) < remaining
+
+    @contextlib.contextmanager
+    def measure(self, kind):
+        """Record how long the block takes, even if it fails, as kind."""
+        begin = time.time()
+        try:
+            yield
+        finally:
+            self._seconds.setdefault(kind, []).append(time.time() - begin)
+
+
+# Columns selected by getDatabaseStats, keyed by the stat they produce. The
+# order is the column order of the query.
+DATABASE_STAT_COLUMNS = (
+    ('size', 'pg_database_size(s.datid)'),
+    ('numBackends', 'numbackends'),
+    ('xactCommit', 'xact_commit'),
+    ('xactRollback', 'xact_rollback'),
+    ('blksRead', 'blks_read'),
+    ('blksHit', 'blks_hit'),
+    ('tupReturned', 'tup_returned'),
+    ('tupFetched', 'tup_fetched'),
+    ('tupInserted', 'tup_inserted'),
+    ('tupUpdated', 'tup_updated'),
+    ('tupDeleted', 'tup_deleted'),
+)
+
+# Database stats calculated from other columns instead of being selected.
+DATABASE_DERIVED_STATS = {
+    'xactTotal': ('xactCommit', 'xactRollback'),
+    'xactRollbackPct': ('xactCommit', 'xactRollback'),
+    'tupTotal': ('tupReturned', 'tupFetched'),
+    'tupFetchedPct': ('tupReturned', 'tupFetched'),
+}
+
+# SQL for each of DATABASE_DERIVED_STATS in terms of the stats it uses. Used
+# when the server builds the stat documents itself.
+DATABASE_DERIVED_STAT_EXPRESSIONS = (
+    ('xactTotal', '{xactCommit} + {xactRollback}'),
+    ('xactRollbackPct',
+     'CASE WHEN {xactCommit} + {xactRollback} > 0'
+     ' THEN {xactRollback} * 100.0 / ({xactCommit} + {xactRollback})'
+     ' ELSE 0 END'),
+    ('tupTotal', '{tupReturned} + {tupFetched}'),
+    ('tupFetchedPct',
+     'CASE WHEN {tupReturned} + {tupFetched} > 0'
+     ' THEN {tupFetched} * 100.0 / ({tupReturned} + {tupFetched})'
+     ' ELSE 0 END'),
+)
+
+# Columns selected by getTableStatsForDatabase from pg_stat_user_tables,
+# except for size which is calculated from pg_class.
+TABLE_STAT_COLUMNS = (
+    ('size', "relpages * (current_setting('block_size'))::numeric"),
+    ('totalSize', 'pg_total_relation_size(relid)'),
+    ('seqScan', 'seq_scan'),
+    ('seqTupRead', 'seq_tup_read'),
+    ('idxScan', 'idx_scan'),
+    ('idxTupFetch', 'idx_tup_fetch'),
+    ('nTupIns', 'n_tup_ins'),
+    ('nTupUpd', 'n_tup_upd'),
+    ('nTupDel', 'n_tup_del'),
+    ('nTupHotUpd', 'n_tup_hot_upd'),
+    ('nLiveTup', 'n_live_tup'),
+    ('nDeadTup', 'n_dead_tup'),
+    ('lastVacuum', 'last_vacuum'),
+    ('lastAutoVacuum', 'last_autovacuum'),
+    ('lastAnalyze', 'last_analyze'),
+    ('lastAutoAnalyze', 'last_autoanalyze'),
+)
+
+# How database stats are summarized for the server. Percentages are
+# ratios of the summed counters, so busy databases weigh more.
+DATABASE_ROLLUPS = tuple(
+    Sum(name) for name in (
+        'size',
+        'numBackends',
+        'xactCommit',
+        'xactRollback',
+        'xactTotal',
+        'blksRead',
+        'blksHit',
+        'tupReturned',
+        'tupFetched',
+        'tupTotal',
+        'tupInserted',
+        'tupUpdated',
+        'tupDeleted',
+    )) + (
+    Ratio('xactRollbackPct', 'xactRollback', 'xactTotal', scale=100),
+    Ratio('tupFetchedPct', 'tupFetched', 'tupTotal', scale=100),
+)
+
+# Table stats summed up for each database and the server.
+TABLE_SUMMARY_STATS = (
+    'seqScan',
+    'seqTupRead',
+    'idxScan',
+    'idxTupFetch',
+    'nTupIns',
+    'nTupUpd',
+    'nTupDel',
+    'nTupHotUpd',
+    'nLiveTup',
+    'nDeadTup',
+)
+
+TABLE_ROLLUPS = tuple(Sum(name) for name in TABLE_SUMMARY_STATS)
+
+# Table stats that only grow, until the server's stats are reset. They are
+# graphed as rates.
+TABLE_COUNTER_STATS = (
+    'seqScan',
+    'seqTupRead',
+    'idxScan',
+    'idxTupFetch',
+    'nTupIns',
+    'nTupUpd',
+    'nTupDel',
+    'nTupHotUpd',
+)
+
+# Tables with at least this many live and dead rows are in every shard.
+HOT_TABLE_ROWS = 1000000
+
+# Stats whose functions add up the size of every file of a database or
+# table. They change slowly and can be collected on a slower cadence than
+# the others, with getDatabaseSizes and getTableSizes.
+DATABASE_SIZE_STAT = 'size'
+TABLE_SIZE_STAT = 'totalSize'
+
+# Table stats that are timestamps and get converted to epoch seconds.
+TABLE_TIMESTAMP_STATS = (
+    'lastVacuum',
+    'lastAutoVacuum',
+    'lastAnalyze',
+    'lastAutoAnalyze',
+)
+
+CONNECTION_STATS = (
+    'totalConnections',
+    'activeConnections',
+    'idleConnections',
+    'minQueryDuration',
+    'maxQueryDuration',
+    'avgQueryDuration',
+    'minTxnDuration',
+    'maxTxnDuration',
+    'avgTxnDuration',
+    'minIdleDuration',
+    'maxIdleDuration',
+    'avgIdleDuration',
+)
+
+# How the duration of each backend is summarized per database and server.
+CONNECTION_ROLLUPS = tuple(
+    rollup('{0}{1}Duration'.format(prefix, kind), '{0}Duration'.format(
+        kind.lower()))
+    for kind in ('Query', 'Txn', 'Idle')
+    for prefix, rollup in (('min', Min), ('max', Max), ('avg', Mean)))
+
+LOCK_MODES = (
+    'AccessShare',
+    'RowShare',
+    'RowExclusive',
+    'ShareUpdateExclusive',
+    'Share',
+    'ShareRowExclusive',
+    'Exclusive',
+    'AccessExclusive',
+    'Other',
+)
+
+LOCK_STATS = ('locksTotal', 'locksTotalGranted', 'locksTotalWaiting') + tuple(
+    'locks{0}{1}'.format(mode, suffix)
+    for mode in LOCK_MODES
+    for suffix in ('', 'Granted', 'Waiting'))
+
+
+# Query of the locks counted by getLocks.
+LOCKS_QUERY = (
+    "SELECT d.datname, l.mode, l.granted"
+    "  FROM pg_database AS d"
+    "  INNER JOIN pg_locks AS l ON l.database = d.oid"
+    " WHERE NOT d.datistemplate AND d.datallowconn"
+    "   AND d.datname != 'bdr_supervisordb'"
+    "   AND pid <> pg_backend_pid()"
+)
+
+# Sessions of each kind reported per database by getLongRunning, and the
+# characters of their query text kept.
+LONG_RUNNING_TOP = 5
+LONG_RUNNING_QUERY_LENGTH = 200
+
+# Stats of the sessions waiting on locks, from getBlocking.
+BLOCKING_STATS = ('blockedSessions', 'blockingChainDepth')
+
+# Sections of the server stats, queried on the default database, that
+# getServerStats can collect together.
+SERVER_SECTIONS = (
+    'databaseStats', 'connectionStats', 'locks', 'longRunning', 'blocking')
+
+# Query used to model the tables of a database.
+TABLES_QUERY = (
+    "SELECT a.relname, a.relid, a.schemaname, b.size, a.total_size from"
+    " ( select relname, "
+    "   relid, schemaname,"
+    "   pg_total_relation_size(relid) total_size"
+    " FROM pg_stat_user_tables) a, "
+    " (select relname, relpages * (current_setting('block_size'))::numeric size FROM pg_class) b "
+    " where a.relname=b.relname"
+)
+
+# Rows fetched per round trip by server-side cursors.
+ITERSIZE = 2000
+
+# Self-monitoring stats describing the cost of a poll, see spanStats().
+COLLECTION_STATS = (
+    'collectionDuration',
+    'databaseStatsDuration',
+    'tableStatsDuration',
+    'connectionStatsDuration',
+    'locksDuration',
+    'serverStatsDuration',
+    'rowsFetched',
+    'bytesFetched',
+)
+
+# The size of one in this many rows is measured to estimate bytesFetched.
+BYTES_SAMPLE = 64
+
+
+class StatsRecord(object):
+    """
+    Fixed-layout record of the stats for one table or database.
+
+    Subclasses list their fields in __slots__, so a record takes a fraction
+    of the memory of an equivalent dict. Fields that weren't collected are
+    None and are left out when the record is serialized. Enough of the dict
+    interface is provided for read-only use by name.
+    """
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+
+        for name, value in kwargs.iteritems():
+            setattr(self, name, value)
+
+    @classmethod
+    def fromValues(cls, names, values):
+        """Return a record with each of names set to its value."""
+        if len(names) == len(cls.__slots__):
+            # Full rows are always selected in field order.
+            return cls(*values)
+
+        record = cls()
+        for name, value in zip(names, values):
+            setattr(record, name, value)
+
+        return record
+
+    def __contains__(self, name):
+        return getattr(self, name, None) is not None
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def iteritems(self):
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                yield name, value
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return [name for name, _ in self.iteritems()]
+
+    def toJSON(self):
+        """Return the collected fields as a dict ready for json.dumps."""
+        return dict(
+            (name, str(value) if isinstance(value, decimal.Decimal) else value)
+            for name, value in self.iteritems())
+
+    def __repr__(self):
+        return '{0}({1})'.format(
+            self.__class__.__name__,
+            ', '.join('{0}={1!r}'.format(k, v) for k, v in self.iteritems()))
+
+
+class DatabaseStats(StatsRecord):
+    """Stats for one database as returned by getDatabaseStats."""
+    __slots__ = tuple(name for name, _ in DATABASE_STAT_COLUMNS) + (
+        'xactTotal',
+        'xactRollbackPct',
+        'tupTotal',
+        'tupFetchedPct',
+    )
+
+
+class TableStats(StatsRecord):
+    """Stats for one table as returned by getTableStatsForDatabase."""
+    __slots__ = tuple(name for name, _ in TABLE_STAT_COLUMNS)
+
+
+class TableShard(object):
+    """
+    The tables of a database collected by one poll when they are spread
+    over count polls: those whose OID modulo count is index, plus the hot
+    ones, named in hot or with at least hotRows rows.
+    """
+
+    # Limits pg_stat_user_tables to the shard.
+    WHERE = (
+        " WHERE mod(relid::bigint, %(count)s) = %(index)s"
+        "    OR n_live_tup + n_dead_tup >= %(hotRows)s"
+        "    OR relname = ANY(%(hot)s)")
+
+    def __init__(self, index, count, hot=(), hotRows=HOT_TABLE_ROWS):
+        self.index = index
+        self.count = count
+        self.hot = sorted(hot)
+        self.hotRows = hotRows
+
+    def params(self):
+        return dict(
+            index=self.index,
+            count=self.count,
+            hot=self.hot,
+            hotRows=self.hotRows)
+
+
+class TableDetails(StatsRecord):
+    """Modeled properties of one table as returned by getTablesInDatabase."""
+    __slots__ = ('oid', 'schema', 'size', 'totalSize')
+
+
+def tableFromRow(row):
+    """Return (name, details) for a row of TABLES_QUERY."""
+    return row[0], TableDetails(row[1], row[2], row[3], row[4])
+
+
+class RawJSON(object):
+    """
+    JSON value that was already encoded, usually by PostgreSQL.
+
+    encodeJSON writes it to the output verbatim.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+
+class RawJSONObject(dict):
+    """
+    Dict carrying the members of an already encoded JSON object.
+
+    encodeJSON writes the pre-encoded members followed by the dict's own
+    items as a single object, so values can still be added with update().
+    """
+
+    def __init__(self, text, *args, **kwargs):
+        super(RawJSONObject, self).__init__(*args, **kwargs)
+        self.text = text
+
+
+def encodeJSON(value):
+    """
+    Like json.dumps, but writes RawJSON and RawJSONObject without decoding.
+    """
+    if isinstance(value, RawJSON):
+        return value.text
+
+    if isinstance(value, StatsRecord):
+        return json.dumps(value.toJSON())
+
+    if isinstance(value, dict):
+        members = ['{0}: {1}'.format(json.dumps(k), encodeJSON(v))
+                   for k, v in value.iteritems()]
+
+        if isinstance(value, RawJSONObject):
+            raw = value.text.strip()[1:-1].strip()
+            if raw:
+                members.insert(0, raw)
+
+        return '{{{0}}}'.format(', '.join(members))
+
+    if isinstance(value, (list, tuple)):
+        return '[{0}]'.format(', '.join(encodeJSON(v) for v in value))
+
+    return json.dumps(value)
+
+
+def selectStatColumns(columns, derived, stats=None):
+    """
+    Return the (name, expression) columns needed to produce stats.
+
+    All columns are returned if stats is None. Derived stats pull in the
+    columns they are calculated from.
+    """
+    if stats is None:
+        return list(columns)
+
+    needed = set(stats)
+    for stat in stats:
+        needed.update(derived.get(stat, ()))
+
+    return [(name, expr) for name, expr in columns if name in needed]
+
+
+def rowBytes(row):
+    """Approximate size of row in PostgreSQL's text format."""
+    size = 0
+    for value in row:
+        if value is None:
+            continue
+        elif isinstance(value, basestring):
+            size += len(value)
+        else:
+            size += len(str(value))
+
+    return size
+
+
+class QuerySpan(object):
+    """
+    Wall time, rows and estimated bytes of one query made by a PgHelper
+    method. The time runs from execute until the cursor is closed, so it
+    includes processing the rows as they are fetched.
+    """
+    __slots__ = ('name', 'database', 'seconds', 'rows', 'bytes')
+
+    def __init__(self, name, database):
+        self.name = name
+        self.database = database
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+
+class SpanCursor(object):
+    """Cursor recording its query in a QuerySpan when closed."""
+
+    def __init__(self, cursor, span, spans):
+        self._cursor = cursor
+        self._span = span
+        self._spans = spans
+        self._begin = None
+        self._sampledRows = 0
+        self._sampledBytes = 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+    def _sample(self, row):
+        self._sampledRows += 1
+        self._sampledBytes += rowBytes(row)
+
+    def execute(self, *args, **kwargs):
+        self._begin = time.time()
+        return self._cursor.execute(*args, **kwargs)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            if self._span.rows % BYTES_SAMPLE == 0:
+                self._sample(row)
+            self._span.rows += 1
+
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._span.rows += len(rows)
+        for row in rows[::BYTES_SAMPLE]:
+            self._sample(row)
+
+        return rows
+
+    def __iter__(self):
+        span = self._span
+        for row in self._cursor:
+            if span.rows % BYTES_SAMPLE == 0:
+                self._sample(row)
+            span.rows += 1
+            yield row
+
+    def close(self):
+        span = self._span
+        if self._begin is not None:
+            span.seconds = time.time() - self._begin
+            if self._sampledRows:
+                span.bytes = int(
+                    float(self._sampledBytes) / self._sampledRows * span.rows)
+            self._spans.append(span)
+            self._begin = None
+
+        self._cursor.close()
+
+
+def spanStats(spans):
+    """
+    Return the self-monitoring stats for spans: the total duration of the
+    spans of each name as <name>Duration, rowsFetched and bytesFetched.
+    """
+    stats = dict(rowsFetched=0, bytesFetched=0)
+    for span in spans:
+        key = '{0}Duration'.format(span.name)
+        stats[key] = stats.get(key, 0) + span.seconds
+        stats['rowsFetched'] += span.rows
+        stats['bytesFetched'] += span.bytes
+
+    return stats
+
+
+def databaseStatsFromRows(names, rows):
+    """
+    Return the DatabaseStats of each row of datname followed by the stats
+    of names, with the stats derived from them added.
+    """
+    databaseStats = {}
+
+    for row in rows:
+        dbStats = DatabaseStats.fromValues(names, row[1:])
+
+        if dbStats.xactCommit is not None \
+                and dbStats.xactRollback is not None:
+            dbStats.xactTotal = \
+                dbStats.xactCommit + dbStats.xactRollback
+            dbStats.xactRollbackPct = 0
+            if dbStats.xactTotal > 0:
+                dbStats.xactRollbackPct = (
+                    float(dbStats.xactRollback) /
+                    dbStats.xactTotal) * 100
+
+        if dbStats.tupReturned is not None \
+                and dbStats.tupFetched is not None:
+            dbStats.tupTotal = \
+                dbStats.tupReturned + dbStats.tupFetched
+            dbStats.tupFetchedPct = 0
+            if dbStats.tupTotal > 0:
+                dbStats.tupFetchedPct = (
+                    float(dbStats.tupFetched) /
+                    dbStats.tupTotal) * 100
+
+        databaseStats[row[0]] = dbStats
+
+    return databaseStats
+
+
+def connectionStatsFromBackends(rows):
+    """
+    Return the connection stats of the rows of each backend, as (datname,
+    xact_start, query_start, backend_start, now), for servers without
+    pg_stat_activity.state.
+    """
+    connectionStats = dict(
+        databases={},
+        totalConnections=0,
+        activeConnections=0,
+        idleConnections=0,
+    )
+
+    # Query, transaction and idle durations of each backend by database.
+    # They are rolled up into the min/max/avg summaries at the end.
+    durations = {}
+
+    for row in rows:
+        datname, xact_start, query_start, backend_start, now = row
+
+        database = connectionStats['databases'].get(datname, None)
+        if database is None:
+            database = dict(
+                totalConnections=0,
+                activeConnections=0,
+                idleConnections=0,
+            )
+
+        # Connection counts.
+        connectionStats['totalConnections'] += 1
+        database['totalConnections'] += 1
+
+        if xact_start is not None:
+            connectionStats['activeConnections'] += 1
+            database['activeConnections'] += 1
+        else:
+            connectionStats['idleConnections'] += 1
+            database['idleConnections'] += 1
+
+        backend = {}
+
+        # Individual query duration.
+        if query_start is not None:
+            backend['queryDuration'] = max(
+                datetimeDurationInSeconds(query_start, now), 0)
+
+        # Active transaction duration.
+        if xact_start is not None and query_start is not None:
+            backend['txnDuration'] = max(
+                datetimeDurationInSeconds(xact_start, now), 0)
+
+        # Idle transaction duration.
+        elif xact_start is not None and query_start is None:
+            connectionStats['idleConnections'] += 1
+            database['idleConnections'] += 1
+
+            backend['idleDuration'] = max(
+                datetimeDurationInSeconds(backend_start, now), 0)
+
+        durations.setdefault(datname, []).append(backend)
+        connectionStats['databases'][datname] = database
+
+    rollups = Rollups(CONNECTION_ROLLUPS, mapping=True)
+    states = []
+    for datname, backends in durations.iteritems():
+        state = rollups.state(backends)
+        states.append(state)
+        connectionStats['databases'][datname].update(
+            rollups.results(state))
+
+    connectionStats.update(rollups.results(rollups.merge(*states)))
+
+    return connectionStats
+
+
+def connectionStatsFromSummaries(rows):
+    """
+    Return the connection stats of the row of each database summarized by
+    the server: datname, the number of backends, active and idle ones, and
+    the minimum, maximum, sum and count of their query, transaction and
+    idle in transaction durations.
+    """
+    connectionStats = dict(
+        databases={},
+        totalConnections=0,
+        activeConnections=0,
+        idleConnections=0,
+    )
+
+    rollups = Rollups(CONNECTION_ROLLUPS, mapping=True)
+    states = []
+
+    for row in rows:
+        datname = row[0]
+        database = dict(zip(
+            ('totalConnections', 'activeConnections', 'idleConnections'),
+            row[1:4]))
+
+        for name, value in database.iteritems():
+            connectionStats[name] += value
+
+        summaries = dict(zip(
+            ('queryDuration', 'txnDuration', 'idleDuration'),
+            (row[i:i + 4] for i in (4, 8, 12))))
+
+        state = [
+            summaryState(rollup, summaries[rollup.source])
+            for rollup in rollups.rollups]
+        states.append(state)
+
+        database.update(rollups.results(state))
+        connectionStats['databases'][datname] = database
+
+    connectionStats.update(rollups.results(rollups.merge(*states)))
+
+    return connectionStats
+
+
+def summaryState(rollup, summary):
+    """
+    Return the state of rollup over values the server summarized as
+    (minimum, maximum, sum, count).
+    """
+    minimum, maximum, total, count = summary
+    if not count:
+        return None
 
-# Twisted imports for async support
-from twisted.enterprise import adbapi
-from twisted.internet import defer
+    if isinstance(rollup, Min):
+        return minimum
 
-LOG.debug("Twisted async methods enabled")
+    if isinstance(rollup, Max):
+        return maximum
+
+    return (total, count)
+
+
+
+def locksFromRows(rows):
+    """
+    Return the lock stats of the server and each database from rows of
+    datname, mode and granted of each lock.
+    """
+    locksTemplate = dict(
+        locksTotal=0,
+        locksTotalGranted=0,
+        locksTotalWaiting=0,
+    )
+
+    for mode in LOCK_MODES:
+        locksTemplate.update({
+            'locks{0}'.format(mode): 0,
+            'locks{0}Granted'.format(mode): 0,
+            'locks{0}Waiting'.format(mode): 0,
+        })
+
+    locks = dict(databases={})
+    locks.update(locksTemplate)
+
+    for row in rows:
+        datname, mode, granted = row
+
+        database = locks['databases'].get(
+            datname, copy.copy(locksTemplate))
+
+        locks['locksTotal'] += 1
+        database['locksTotal'] += 1
+
+        statKey = 'locks{0}'.format(mode.replace('Lock', ''))
+        if statKey not in locks:
+            statKey = 'locksOther'
+
+        locks[statKey] += 1
+
+        if granted:
+            locks['locksTotalGranted'] += 1
+            locks['{0}Granted'.format(statKey)] += 1
+            database['locksTotalGranted'] += 1
+            database['{0}Granted'.format(statKey)] += 1
+        else:
+            locks['locksTotalWaiting'] += 1
+            locks['{0}Waiting'.format(statKey)] += 1
+            database['locksTotalGranted'] += 1
+            database['{0}Waiting'.format(statKey)] += 1
+
+        locks['databases'][datname] = database
+
+    return locks
+
+
+def longRunningFromRows(rows):
+    """
+    Return the sessions of each database, longest running first, from rows
+    of datname, kind, pid, usename, application_name, wait, query and
+    seconds. kind is active or idle in transaction.
+    """
+    sessions = {}
+    for row in rows:
+        datname, kind, pid, user, application, wait, query, seconds = row
+        sessions.setdefault(datname, []).append(dict(
+            kind=kind,
+            pid=pid,
+            user=user,
+            application=application,
+            waitEvent=wait,
+            query=query,
+            seconds=seconds,
+        ))
+
+    for databaseSessions in sessions.itervalues():
+        databaseSessions.sort(key=lambda x: x['seconds'], reverse=True)
+
+    return sessions
+
+
+def blockingFromRows(rows):
+    """
+    Return the sessions waiting on locks, the depth of the longest chain of
+    them and the head blockers at the end of the chains, from rows of pid,
+    the pids blocking it, datname, usename, application_name, state, query
+    and seconds.
+
+    Each session is visited once, following the pids blocking it, so this
+    is linear in the number of sessions and blocking pids. A session found
+    again while following its own chain, in a deadlock not yet broken,
+    heads the chain. The head of each waiting session is the one at the
+    end of its longest chain, so each is counted against one head. Heads
+    without a database, like prepared transactions, take that of a session
+    they block.
+    """
+    sessions = {}
+    for row in rows:
+        pid, blockers, datname, user, application, state, query, seconds = \
+            row
+        sessions[pid] = dict(
+            pid=pid,
+            blockers=blockers or [],
+            datname=datname,
+            user=user,
+            application=application,
+            state=state,
+            query=query,
+            seconds=seconds,
+        )
+
+    # Blockers the server didn't list a backend for.
+    for session in sessions.values():
+        for blocker in session['blockers']:
+            if blocker not in sessions:
+                sessions[blocker] = dict(
+                    pid=blocker, blockers=[], datname=None, user=None,
+                    application=None, state=None, query=None, seconds=None)
+
+    # The depth of the longest chain of each session and its head.
+    chains = {}
+    seen = set()
+    for start in sessions:
+        if start in seen:
+            continue
+
+        seen.add(start)
+        stack = [(start, iter(sessions[start]['blockers']))]
+        while stack:
+            pid, blockers = stack[-1]
+            for blocker in blockers:
+                if blocker not in seen:
+                    seen.add(blocker)
+                    stack.append(
+                        (blocker, iter(sessions[blocker]['blockers'])))
+                    break
+            else:
+                stack.pop()
+                chain = (0, pid)
+                for blocker in sessions[pid]['blockers']:
+                    # Blockers seen but without a chain are in a cycle.
+                    if blocker in chains:
+                        depth, head = chains[blocker]
+                        chain = max(chain, (depth + 1, head))
+
+                chains[pid] = chain
+
+    blocked = {}
+    for pid, (depth, head) in chains.iteritems():
+        if head != pid:
+            blocked.setdefault(head, []).append(sessions[pid])
+
+    heads = []
+    for pid, waiting in blocked.iteritems():
+        head = dict(sessions[pid])
+        del head['blockers']
+        head.update(
+            blocked=len(waiting),
+            depth=max(chains[session['pid']][0] for session in waiting),
+            maxWait=max(session['seconds'] for session in waiting))
+        if head['datname'] is None:
+            head['datname'] = waiting[0]['datname']
+
+        heads.append(head)
+
+    heads.sort(key=lambda x: (x['blocked'], x['depth']), reverse=True)
+
+    return dict(
+        blockedSessions=sum(
+            1 for session in sessions.itervalues() if session['blockers']),
+        blockingChainDepth=max(
+            [depth for depth, _ in chains.itervalues()] or [0]),
+        heads=heads,
+    )
 
 
 class PgHelper(object):
@@ -96,39 +1022,110 @@ class PgHelper(object):
     _password = None
     _ssl = None
     _default_db = None
+    _itersize = None
+    _capture = None
+    _maxConnections = None
+    _statementTimeout = None
+    _deadline = None
+    _watchdog = None
+    _capabilities = None
+    _consistent = None
     _connections = None
-    _pool = None  # Twisted connection pool for async
+    _used = None
+    spans = None
+    budget = None
 
-    def __init__(self, host, port, username, password, ssl, default_db):
+    def __init__(self, host, port, username, password, ssl, default_db,
+                 itersize=ITERSIZE, capture=None, maxConnections=None,
+                 statementTimeout=None, deadline=None, consistent=False):
         self._host = host
         self._port = port
         self._username = username
         self._password = password
         self._ssl = ssl
         self._default_db = default_db
+        self._itersize = itersize
+        self._capture = capture
+        self._maxConnections = maxConnections
+        self._statementTimeout = statementTimeout
+        self._deadline = deadline
+        self._consistent = consistent
         self._connections = {}
-        self._pool = None
+        self._used = []
+        self.spans = []
+        self.budget = Budget(deadline)
+
+        if deadline is not None:
+            self._watchdog = threading.Timer(
+                max(0, deadline - time.time()), self._cancelQueries)
+            self._watchdog.daemon = True
+            self._watchdog.start()
 
     def close(self):
+        if self._watchdog is not None:
+            # Waited for so it can't outlive the interpreter.
+            self._watchdog.cancel()
+            self._watchdog.join()
+
         for value in self._connections.values():
             try:
                 value['connection'].close()
             except Exception:
                 pass
 
-        # Close Twisted connection pool if exists
-        if self._pool is not None:
+    def _cancelQueries(self):
+        """Cancel the queries running when the deadline passes."""
+        for value in list(self._connections.values()):
             try:
-                self._pool.close()
-                self._pool = None
+                value['connection'].cancel()
             except Exception:
                 pass
 
-    def getConnection(self, db):
-        if db in self._connections and self._connections[db]:
-            return self._connections[db]['connection']
+    def checkDeadline(self):
+        """Raise DeadlineExceeded if the deadline has passed."""
+        if self._deadline is not None and time.time() >= self._deadline:
+            raise DeadlineExceeded("poll deadline passed")
 
-        connection_begin = time.time()
+    def rollback(self, db):
+        """
+        Make db's connection usable again after a query on it failed,
+        dropping it if it can't be.
+        """
+        if db not in self._connections:
+            return
+
+        try:
+            self._connections[db]['connection'].rollback()
+        except Exception:
+            try:
+                self._connections.pop(db)['connection'].close()
+            except Exception:
+                pass
+
+            if db in self._used:
+                self._used.remove(db)
+
+    def _makeRoom(self):
+        """
+        Close the least recently used connections until another can be
+        opened without having more than maxConnections open. The default
+        database's connection is closed last since most queries use it.
+        """
+        if not self._maxConnections:
+            return
+
+        while len(self._connections) >= self._maxConnections:
+            others = [db for db in self._used if db != self._default_db]
+            db = (others or self._used)[0]
+            self._used.remove(db)
+
+            try:
+                self._connections.pop(db)['connection'].close()
+            except Exception:
+                pass
+
+    def _connectionArguments(self, db, begin):
+        """Return the arguments for connecting to db at begin."""
         conn_kwargs = {
             'host': self._host,
             'port': int(self._port),
@@ -142,12 +1139,49 @@ class PgHelper(object):
         else:
             conn_kwargs['sslmode'] = 'disable'
 
-        connection = psycopg2.connect(**conn_kwargs)
+        if self._deadline is not None:
+            conn_kwargs['connect_timeout'] = int(max(1, min(
+                10, self._deadline - begin)))
+
+        # Set with the connection instead of a query of its own. Settings
+        # depending on the server are known once connected to it.
+        settings = []
+        if self._statementTimeout:
+            settings.append('statement_timeout={0:d}'.format(
+                int(self._statementTimeout * 1000)))
+
+        if self._capabilities is not None:
+            settings.extend(self._capabilities.options())
+
+        if settings:
+            conn_kwargs['options'] = ' '.join(
+                '-c {0}'.format(setting) for setting in settings)
+
+        return conn_kwargs
+
+    def getConnection(self, db):
+        if db in self._connections and self._connections[db]:
+            if self._maxConnections:
+                self._used.remove(db)
+                self._used.append(db)
+
+            return self._connections[db]['connection']
+
+        self.checkDeadline()
+        self._makeRoom()
+
+        connection_begin = time.time()
+        conn_kwargs = self._connectionArguments(db, connection_begin)
+        connection = self._dbapi(psycopg2).connect(**conn_kwargs)
         connection_latency = time.time() - connection_begin
 
+        statement = "SELECT 1"
+        if self._consistent and db == self._default_db:
+            statement = self._beginSnapshot(connection, statement)
+
         query_begin = time.time()
         cursor = connection.cursor()
-        cursor.execute("SELECT 1")
+        cursor.execute(statement)
         cursor.fetchall()
         cursor.close()
         query_latency = time.time() - query_begin
@@ -157,11 +1191,71 @@ class PgHelper(object):
             connection_latency=connection_latency,
             query_latency=query_latency,
         )
+        self._used.append(db)
 
         return self._connections[db]['connection']
 
+    def _beginSnapshot(self, connection, statement):
+        """
+        Have connection's queries until endSnapshot read one snapshot,
+        returning statement with what it takes sent along with it.
+
+        They share a read only REPEATABLE READ transaction, begun by
+        statement, so catalogs are read as of then. Stats are read once
+        per transaction as of the first query of each view, which needs
+        stats_fetch_consistency set to snapshot since 15.
+        """
+        connection.set_session(
+            isolation_level='REPEATABLE READ', readonly=True)
+
+        self._capabilities = Capabilities(
+            getattr(connection, 'server_version', 0))
+        if 'statsFetchConsistency' in self._capabilities:
+            statement = "SET LOCAL stats_fetch_consistency = snapshot; " + \
+                statement
+
+        return statement
+
+    def endSnapshot(self):
+        """
+        End the default database's transaction begun for consistent
+        stats, so its snapshot isn't held back while the rest are polled.
+        """
+        if not self._consistent:
+            return
+
+        self._consistent = False
+        if self._default_db not in self._connections:
+            return
+
+        try:
+            self._connections[self._default_db]['connection'].commit()
+        except psycopg2.Error:
+            self.rollback(self._default_db)
+
+    def _cursor(self, db, span, name=None):
+        """
+        Return a cursor on db whose query is recorded in self.spans under
+        span. Named cursors are server-side.
+        """
+        self.checkDeadline()
+        connection = self.getConnection(db)
+        if name:
+            cursor = connection.cursor(name=name)
+        else:
+            cursor = connection.cursor()
+
+        return SpanCursor(cursor, QuerySpan(span, db), self.spans)
+
+    def _dbapi(self, dbapi):
+        """Return dbapi, recording its queries if capturing."""
+        if self._capture is None:
+            return dbapi
+
+        return self._capture.wrap(dbapi)
+
     def getDatabases(self):
-        cursor = self.getConnection(self._default_db).cursor()
+        cursor = self._cursor(self._default_db, 'databases')
 
         databases = {}
 
@@ -184,58 +1278,64 @@ class PgHelper(object):
 
         return databases
 
-    def getDatabaseStats(self):
-        cursor = self.getConnection(self._default_db).cursor()
-
-        databaseStats = {}
-
-        try:
-            cursor.execute(
-                "SELECT d.datname,"
-                "       pg_database_size(s.datid) AS size,"
-                "       numbackends,"
-                "       xact_commit, xact_rollback,"
-                "       blks_read, blks_hit,"
-                "       tup_returned, tup_fetched, tup_inserted,"
-                "       tup_updated, tup_deleted"
+    def _serverQuery(self, section, stats=None):
+        """
+        Return the SQL of section, one of SERVER_SECTIONS, and the function
+        returning its stats from the rows it selects.
+        """
+        if section == 'databaseStats':
+            columns = selectStatColumns(
+                DATABASE_STAT_COLUMNS, DATABASE_DERIVED_STATS, stats)
+            names = [name for name, _ in columns]
+
+            sql = (
+                "SELECT d.datname{0}"
                 "  FROM pg_database AS d"
                 "  JOIN pg_stat_database AS s ON s.datname = d.datname"
                 "    AND d.datname != 'bdr_supervisordb'"
-                " WHERE NOT datistemplate AND datallowconn"
-            )
+                " WHERE NOT datistemplate AND datallowconn".format(
+                    ''.join(', {0}'.format(expr) for _, expr in columns)))
 
-            for row in cursor.fetchall():
-                xactTotal = row[3] + row[4]
-                xactRollbackPct = 0
-                if xactTotal > 0:
-                    xactRollbackPct = (float(row[4]) / xactTotal) * 100
-
-                tupTotal = row[7] + row[8]
-                tupFetchedPct = 0
-                if tupTotal > 0:
-                    tupFetchedPct = (float(row[8]) / tupTotal) * 100
-
-                databaseStats[row[0]] = dict(
-                    size=row[1],
-                    numBackends=row[2],
-                    xactCommit=row[3],
-                    xactRollback=row[4],
-                    xactTotal=xactTotal,
-                    xactRollbackPct=xactRollbackPct,
-                    blksRead=row[5],
-                    blksHit=row[6],
-                    tupReturned=row[7],
-                    tupFetched=row[8],
-                    tupTotal=tupTotal,
-                    tupFetchedPct=tupFetchedPct,
-                    tupInserted=row[9],
-                    tupUpdated=row[10],
-                    tupDeleted=row[11],
-                )
+            return sql, lambda rows: databaseStatsFromRows(names, rows)
+
+        if section == 'connectionStats':
+            variant = self.capabilities().query('connectionStats')
+            if variant.name == 'aggregate':
+                return variant.sql, connectionStatsFromSummaries
+
+            return variant.sql, connectionStatsFromBackends
+
+        if section == 'locks':
+            return LOCKS_QUERY, locksFromRows
+
+        if section == 'longRunning':
+            variant = self.capabilities().query('longRunning')
+            sql = variant.sql.format(
+                top=LONG_RUNNING_TOP, length=LONG_RUNNING_QUERY_LENGTH)
+            return sql, longRunningFromRows
+
+        if section == 'blocking':
+            variant = self.capabilities().query('blocking')
+            sql = variant.sql.format(length=LONG_RUNNING_QUERY_LENGTH)
+            return sql, blockingFromRows
+
+        raise ValueError("not a server section: {0}".format(section))
+
+    def _getServerSection(self, section, stats=None):
+        """Return the stats of section, by a query of its own."""
+        sql, parse = self._serverQuery(section, stats)
+        cursor = self._cursor(self._default_db, section)
+
+        try:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
         finally:
             cursor.close()
 
-        return databaseStats
+        return parse(rows)
+
+    def getDatabaseStats(self, stats=None):
+        return self._getServerSection('databaseStats', stats=stats)
 
     def getConnectionLatencyForDatabase(self, db):
         self.getConnection(db)
@@ -245,480 +1345,374 @@ class PgHelper(object):
         self.getConnection(db)
         return self._connections[db]['query_latency']
 
-    def getTablesInDatabase(self, db):
-        cursor = self.getConnection(db).cursor()
+    def sampleConnection(self, db):
+        """
+        Return the seconds taken to open another connection to db, which
+        is closed again right away.
+        """
+        self.checkDeadline()
+        self._makeRoom()
 
-        tables = {}
+        begin = time.time()
+        connection = self._dbapi(psycopg2).connect(
+            **self._connectionArguments(db, begin))
+        latency = time.time() - begin
+        connection.close()
 
-        try:
-            cursor.execute(
-                "SELECT a.relname, a.relid, a.schemaname, b.size, a.total_size from"
-                " ( select relname, "
-                "   relid, schemaname,"
-                "   pg_total_relation_size(relid) total_size"
-                " FROM pg_stat_user_tables) a, "
-                " (select relname, relpages * (current_setting('block_size'))::numeric size FROM pg_class) b "
-                " where a.relname=b.relname"
-            )
+        return latency
 
-            for row in cursor.fetchall():
-                tables[row[0]] = dict(
-                    oid=row[1],
-                    schema=row[2],
-                    size=row[3],
-                    totalSize=row[4],
-                )
+    def sampleQuery(self, db):
+        """Return the seconds taken by a SELECT 1 round trip on db."""
+        cursor = self.getConnection(db).cursor()
+        try:
+            begin = time.time()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return time.time() - begin
         finally:
             cursor.close()
 
-        return tables
+    def sampleHandshake(self):
+        """
+        Return the seconds taken to open a TCP connection to the server,
+        and to negotiate TLS on it, or None without SSL.
+        """
+        self.checkDeadline()
+        timeout = 10
+        if self._deadline is not None:
+            timeout = max(1, min(10, self._deadline - time.time()))
 
-    def getConnectionStats(self):
-        cursor = self.getConnection(self._default_db).cursor()
+        return probeHandshake(self._host, self._port, self._ssl, timeout)
 
-        connectionStats = dict(databases={})
+    def getTablesInDatabase(self, db):
+        return dict(self.iterTablesInDatabase(db))
 
-        try:
-            cursor.execute(
-                "SELECT datname, xact_start, query_start, backend_start,"
-                "       now() AS now"
-                "  FROM pg_stat_activity"
-                "  WHERE datname !='bdr_supervisordb'"
-            )
+    def iterTablesInDatabase(self, db, itersize=None):
+        """
+        Yield (name, details) for each table in db as rows arrive.
 
-            connectionStats.update(
-                totalConnections=0,
-                activeConnections=0,
-                idleConnections=0,
-            )
+        Uses a server-side cursor so only itersize rows are held at a time.
+        """
+        cursor = self._cursor(db, 'tables', name='zenoss_tables')
+        cursor.itersize = itersize or self._itersize
 
-            for row in cursor.fetchall():
-                datname, xact_start, query_start, backend_start, now = row
-
-                database = connectionStats['databases'].get(datname, None)
-                if database is None:
-                    database = dict(
-                        totalConnections=0,
-                        activeConnections=0,
-                        idleConnections=0,
-                    )
-
-                # Connection counts.
-                connectionStats['totalConnections'] += 1
-                database['totalConnections'] += 1
-
-                if xact_start is not None:
-                    connectionStats['activeConnections'] += 1
-                    database['activeConnections'] += 1
-                else:
-                    connectionStats['idleConnections'] += 1
-                    database['idleConnections'] += 1
-
-                # Individual query duration summaries.
-                if query_start is not None:
-                    queryDuration = max(
-                        datetimeDurationInSeconds(query_start, now), 0)
-
-                    connectionStats['minQueryDuration'] = min(
-                        connectionStats.get('minQueryDuration', sys.maxint),
-                        queryDuration)
-
-                    connectionStats['maxQueryDuration'] = max(
-                        connectionStats.get('maxQueryDuration', 0),
-                        queryDuration)
-
-                    if 'avgQueryDuration' not in connectionStats:
-                        connectionStats['avgQueryDuration'] = queryDuration
-                    else:
-                        connectionStats['avgQueryDuration'] = (
-                                (connectionStats['avgQueryDuration'] + queryDuration)
-                                / 2)
-
-                    database['minQueryDuration'] = min(
-                        database.get('minQueryDuration', sys.maxint),
-                        queryDuration)
-
-                    database['maxQueryDuration'] = max(
-                        database.get('maxQueryDuration', 0),
-                        queryDuration)
-
-                    if 'avgQueryDuration' not in database:
-                        database['avgQueryDuration'] = queryDuration
-                    else:
-                        database['avgQueryDuration'] = (
-                                (database['avgQueryDuration'] + queryDuration)
-                                / 2)
-
-                # Active transaction duration summaries.
-                if xact_start is not None and query_start is not None:
-                    txnDuration = max(
-                        datetimeDurationInSeconds(xact_start, now), 0)
-
-                    connectionStats['minTxnDuration'] = min(
-                        connectionStats.get('minTxnDuration', sys.maxint),
-                        txnDuration)
-
-                    connectionStats['maxTxnDuration'] = max(
-                        connectionStats.get('maxTxnDuration', 0),
-                        txnDuration)
-
-                    if 'avgTxnDuration' not in connectionStats:
-                        connectionStats['avgTxnDuration'] = txnDuration
-                    else:
-                        connectionStats['avgTxnDuration'] = (
-                                (connectionStats['avgTxnDuration'] + txnDuration)
-                                / 2)
-
-                    database['minTxnDuration'] = min(
-                        database.get('minTxnDuration', sys.maxint),
-                        txnDuration)
-
-                    database['maxTxnDuration'] = max(
-                        database.get('maxTxnDuration', 0),
-                        txnDuration)
-
-                    if 'avgTxnDuration' not in database:
-                        database['avgTxnDuration'] = txnDuration
-                    else:
-                        database['avgTxnDuration'] = (
-                                (database['avgTxnDuration'] + txnDuration)
-                                / 2)
-
-                # Idle transaction duration summaries.
-                elif xact_start is not None and query_start is None:
-                    connectionStats['idleConnections'] += 1
-                    database['idleConnections'] += 1
-
-                    idleDuration = max(
-                        datetimeDurationInSeconds(backend_start, now), 0)
-
-                    connectionStats['minIdleDuration'] = min(
-                        connectionStats.get('minIdleDuration', sys.maxint),
-                        idleDuration)
-
-                    connectionStats['maxIdleDuration'] = max(
-                        connectionStats.get('maxIdleDuration', 0),
-                        idleDuration)
-
-                    if 'avgIdleDuration' not in connectionStats:
-                        connectionStats['avgIdleDuration'] = idleDuration
-                    else:
-                        connectionStats['avgIdleDuration'] = (
-                                (connectionStats['avgIdleDuration'] + idleDuration)
-                                / 2)
-
-                    database['minIdleDuration'] = min(
-                        database.get('minIdleDuration', sys.maxint),
-                        idleDuration)
-
-                    database['maxIdleDuration'] = max(
-                        database.get('maxIdleDuration', 0),
-                        idleDuration)
-
-                    if 'avgIdleDuration' not in database:
-                        database['avgIdleDuration'] = idleDuration
-                    else:
-                        database['avgIdleDuration'] = (
-                                (database['avgIdleDuration'] + idleDuration)
-                                / 2)
-
-                connectionStats['databases'][datname] = database
+        try:
+            cursor.execute(TABLES_QUERY)
 
+            for row in cursor:
+                yield tableFromRow(row)
         finally:
             cursor.close()
 
-        return connectionStats
+    def capabilities(self):
+        """
+        Return the Capabilities of the server, worked out from the default
+        database's connection the first time.
+        """
+        if self._capabilities is None:
+            connection = self.getConnection(self._default_db)
+            self._capabilities = Capabilities(
+                getattr(connection, 'server_version', 0))
 
-    def getLocks(self):
-        cursor = self.getConnection(self._default_db).cursor()
+        return self._capabilities
 
-        locksTemplate = dict(
-            locksTotal=0,
-            locksTotalGranted=0,
-            locksTotalWaiting=0,
-        )
+    def getConnectionStats(self):
+        return self._getServerSection('connectionStats')
 
-        modes = (
-            'AccessShare',
-            'RowShare',
-            'RowExclusive',
-            'ShareUpdateExclusive',
-            'Share',
-            'ShareRowExclusive',
-            'Exclusive',
-            'AccessExclusive',
-            'Other',
-        )
+    def getLocks(self):
+        return self._getServerSection('locks')
+
+    def getLongRunning(self):
+        """
+        Return the longest running active queries and the sessions idle in
+        transaction the longest of each database, as longRunningFromRows.
+        Only the top LONG_RUNNING_TOP of each are sent by the server.
+        """
+        return self._getServerSection('longRunning')
+
+    def getBlocking(self):
+        """
+        Return the sessions waiting on locks, the longest chain of them and
+        the sessions heading the chains, as blockingFromRows.
+        """
+        return self._getServerSection('blocking')
+
+    def supportsServerBatch(self):
+        """
+        Return True if the server can answer several server sections with
+        one query. json_agg needs 9.3.
+        """
+        return 'jsonAgg' in self.capabilities()
+
+    def getServerStats(self, sections, stats=None):
+        """
+        Return a dict of the stats of each of sections, as their own
+        methods would, from a single query and round trip.
+
+        Each section's query is run as a subquery whose rows the server
+        aggregates into a JSON array of objects. The objects are decoded
+        into lists of their values in column order, as rows, so each
+        section's rows are parsed as if it had been run on its own.
+        """
+        queries = [self._serverQuery(section, stats) for section in sections]
+
+        cursor = self._cursor(self._default_db, 'serverStats')
 
-        for mode in modes:
-            locksTemplate.update({
-                'locks{0}'.format(mode): 0,
-                'locks{0}Granted'.format(mode): 0,
-                'locks{0}Waiting'.format(mode): 0,
-            })
+        try:
+            cursor.execute("SELECT {0}".format(', '.join(
+                "(SELECT json_agg(q)::text FROM ({0}) AS q)".format(sql)
+                for sql, _ in queries)))
+            documents = cursor.fetchone()
+        finally:
+            cursor.close()
 
-        locks = dict(databases={})
+        results = {}
+        for section, (_, parse), document in zip(
+                sections, queries, documents):
+            rows = []
+            if document is not None:
+                # Column names repeat, so objects are only read in order.
+                rows = json.loads(
+                    document,
+                    object_pairs_hook=lambda pairs: [v for _, v in pairs])
+
+            results[section] = parse(rows)
+
+        return results
+
+    def _tableStatsQuery(self, columns, where=''):
+        """
+        Return SQL selecting relname and each of columns aliased by its name
+        from the tables of pg_stat_user_tables matching where.
+        """
+        names = [name for name, _ in columns]
+        if 'size' not in names:
+            return (
+                "SELECT relname{0}"
+                "  FROM pg_stat_user_tables{1}".format(''.join(
+                    ', {0} AS {1}'.format(expr, name)
+                    for name, expr in columns), where))
+
+        # Relation size comes from pg_class, everything else from
+        # pg_stat_user_tables.
+        return (
+            "SELECT a.relname{0}"
+            " FROM"
+            " (SELECT relname{1}"
+            "  from pg_stat_user_tables{3}) a,"
+            " (select relname, {2} pg_relation_size FROM pg_class) b"
+            " where a.relname=b.relname".format(
+                ''.join(
+                    ', b.pg_relation_size AS size' if name == 'size'
+                    else ', a.{0}'.format(name)
+                    for name in names),
+                ''.join(
+                    ', {0} AS {1}'.format(expr, name)
+                    for name, expr in columns if name != 'size'),
+                dict(columns)['size'],
+                where))
+
+    def getDatabaseSizes(self):
+        """Return the size of each database, as getDatabaseStats would."""
+        cursor = self._cursor(self._default_db, 'databaseSizes')
 
         try:
             cursor.execute(
-                "SELECT d.datname, l.mode, l.granted"
+                "SELECT d.datname, {0}"
                 "  FROM pg_database AS d"
-                "  INNER JOIN pg_locks AS l ON l.database = d.oid"
-                " WHERE NOT d.datistemplate AND d.datallowconn"
-                "   AND d.datname != 'bdr_supervisordb'"
-                "   AND pid <> pg_backend_pid()"
+                "  JOIN pg_stat_database AS s ON s.datname = d.datname"
+                "    AND d.datname != 'bdr_supervisordb'"
+                " WHERE NOT datistemplate AND datallowconn".format(
+                    dict(DATABASE_STAT_COLUMNS)[DATABASE_SIZE_STAT])
             )
 
-            locks.update(locksTemplate)
+            return dict(cursor.fetchall())
+        finally:
+            cursor.close()
 
-            for row in cursor.fetchall():
-                datname, mode, granted = row
+    def getTableSizes(self, db):
+        """Return the total size of each table in db."""
+        cursor = self._cursor(db, 'tableSizes')
 
-                database = locks['databases'].get(
-                    datname, copy.copy(locksTemplate))
+        try:
+            cursor.execute(
+                "SELECT relname, {0}"
+                "  FROM pg_stat_user_tables".format(
+                    dict(TABLE_STAT_COLUMNS)[TABLE_SIZE_STAT])
+            )
 
-                locks['locksTotal'] += 1
-                database['locksTotal'] += 1
+            return dict(cursor.fetchall())
+        finally:
+            cursor.close()
 
-                statKey = 'locks{0}'.format(mode.replace('Lock', ''))
-                if statKey not in locks:
-                    statKey = 'locksOther'
+    def getTableStatsForDatabase(self, db, stats=None, shard=None):
+        return dict(self.iterTableStatsForDatabase(
+            db, stats=stats, shard=shard))
 
-                locks[statKey] += 1
+    def iterTableStatsForDatabase(self, db, stats=None, itersize=None,
+                                  shard=None):
+        """
+        Yield (name, stats) for each table in db as rows arrive, or only for
+        the tables of shard if given.
 
-                if granted:
-                    locks['locksTotalGranted'] += 1
-                    locks['{0}Granted'.format(statKey)] += 1
-                    database['locksTotalGranted'] += 1
-                    database['{0}Granted'.format(statKey)] += 1
-                else:
-                    locks['locksTotalWaiting'] += 1
-                    locks['{0}Waiting'.format(statKey)] += 1
-                    database['locksTotalGranted'] += 1
-                    database['{0}Waiting'.format(statKey)] += 1
+        Uses a server-side cursor so only itersize rows are held at a time.
+        """
+        columns = selectStatColumns(TABLE_STAT_COLUMNS, {}, stats)
+        names = [name for name, _ in columns]
+        timestamps = [
+            i for i, name in enumerate(names)
+            if name in TABLE_TIMESTAMP_STATS]
 
-                locks['databases'][datname] = database
+        cursor = self._cursor(
+            db, 'tableStats', name='zenoss_table_stats')
+        cursor.itersize = itersize or self._itersize
 
+        try:
+            if shard is None:
+                cursor.execute(self._tableStatsQuery(columns))
+            else:
+                cursor.execute(
+                    self._tableStatsQuery(columns, where=shard.WHERE),
+                    shard.params())
+
+            for row in cursor:
+                values = list(row[1:])
+                for i in timestamps:
+                    if values[i] is not None:
+                        values[i] = datetimeToEpoch(values[i])
+
+                yield row[0], TableStats.fromValues(names, values)
         finally:
             cursor.close()
 
-        return locks
-
-    def getTableStatsForDatabase(self, db):
-        cursor = self.getConnection(db).cursor()
+    def supportsServerJSON(self):
+        """
+        Return True if the server can build stat documents itself.
+
+        json_build_object needs 9.4 and json_strip_nulls needs 9.5.
+        """
+        return 'serverJSON' in self.capabilities()
+
+    def getDatabaseStatsJSON(self, stats=None):
+        """
+        Server-built alternative to getDatabaseStats.
+
+        Returns a (databases, summaries) tuple. databases maps each database
+        name to a RawJSONObject holding the JSON document PostgreSQL built
+        for it, so it is never decoded here. summaries holds server-wide
+        sums, with percentages calculated as ratios of those sums.
+        """
+        columns = selectStatColumns(
+            DATABASE_STAT_COLUMNS, DATABASE_DERIVED_STATS, stats)
+        names = [name for name, _ in columns]
+        derived = [
+            (name, expr) for name, expr in DATABASE_DERIVED_STAT_EXPRESSIONS
+            if (stats is None or name in stats)
+            and all(dep in names for dep in DATABASE_DERIVED_STATS[name])]
+
+        def buildObject(wrap):
+            pairs = ["'{0}', {1}".format(name, wrap(name)) for name in names]
+            pairs.extend(
+                "'{0}', {1}".format(name, expr.format(**dict(
+                    (dep, wrap(dep)) for dep in names)))
+                for name, expr in derived)
+
+            return "json_strip_nulls(json_build_object({0}))::text".format(
+                ', '.join(pairs))
+
+        cursor = self._cursor(self._default_db, 'databaseStats')
 
-        tableStats = {}
+        databases = {}
+        summaries = {}
 
         try:
             cursor.execute(
-                "SELECT "
-                "   a.relname,"
-                "   b.pg_relation_size,"
-                "   a.pg_total_relation_size,"
-                "   a.seq_scan,"
-                "   a.seq_tup_read,"
-                "   a.idx_scan,"
-                "   a.idx_tup_fetch,"
-                "   a.n_tup_ins,"
-                "   a.n_tup_upd,"
-                "   a.n_tup_del,"
-                "   a.n_tup_hot_upd,"
-                "   a.n_live_tup,"
-                "   a.n_dead_tup,"
-                "   a.last_vacuum,"
-                "   a.last_autovacuum,"
-                "   a.last_analyze,"
-                "   a.last_autoanalyze"
-                " FROM"
-                " (SELECT relname,"
-                "        pg_total_relation_size(relid),"
-                "        seq_scan, seq_tup_read,"
-                "        idx_scan, idx_tup_fetch,"
-                "        n_tup_ins, n_tup_upd, n_tup_del,"
-                "        n_tup_hot_upd, n_live_tup, n_dead_tup,"
-                "        last_vacuum, last_autovacuum,"
-                "        last_analyze, last_autoanalyze"
-                "  from pg_stat_user_tables) a,"
-                " (select relname, relpages * (current_setting('block_size'))::numeric pg_relation_size FROM pg_class) b"
-                " where a.relname=b.relname"
+                "WITH stats AS ("
+                "SELECT d.datname{0}"
+                "  FROM pg_database AS d"
+                "  JOIN pg_stat_database AS s ON s.datname = d.datname"
+                "    AND d.datname != 'bdr_supervisordb'"
+                " WHERE NOT datistemplate AND datallowconn"
+                ")"
+                " SELECT datname, {1} FROM stats"
+                " UNION ALL"
+                " SELECT NULL, {2} FROM stats".format(
+                    ''.join(
+                        ', {0} AS {1}'.format(expr, name)
+                        for name, expr in columns),
+                    buildObject(lambda name: name),
+                    buildObject(lambda name: 'sum({0})'.format(name)))
             )
 
-            for row in cursor.fetchall():
-                row = list(row)
-                for i in range(13, 17):
-                    if row[i] is not None:
-                        row[i] = datetimeToEpoch(row[i])
-
-                tableStats[row[0]] = dict(
-                    size=row[1],
-                    totalSize=row[2],
-                    seqScan=row[3],
-                    seqTupRead=row[4],
-                    idxScan=row[5],
-                    idxTupFetch=row[6],
-                    nTupIns=row[7],
-                    nTupUpd=row[8],
-                    nTupDel=row[9],
-                    nTupHotUpd=row[10],
-                    nLiveTup=row[11],
-                    nDeadTup=row[12],
-                    lastVacuum=row[13],
-                    lastAutoVacuum=row[14],
-                    lastAnalyze=row[15],
-                    lastAutoAnalyze=row[16],
-                )
+            for datname, document in cursor.fetchall():
+                if datname is None:
+                    summaries = json.loads(document)
+                else:
+                    databases[datname] = RawJSONObject(document)
         finally:
             cursor.close()
 
-        return tableStats
-
-    def _getConnectionPool(self):
-        """Get or create Twisted connection pool for async operations."""
-        if self._pool is None:
-            conn_kwargs = {
-                'host': self._host,
-                'port': int(self._port),
-                'user': self._username,
-                'password': self._password,
-                'database': str(self._default_db),
-            }
-
-            if self._ssl:
-                conn_kwargs['sslmode'] = 'require'
-            else:
-                conn_kwargs['sslmode'] = 'disable'
-
-            self._pool = adbapi.ConnectionPool(
-                'psycopg2',
-                cp_min=1,
-                cp_max=3,
-                cp_reconnect=True,
-                **conn_kwargs
-            )
-            LOG.debug("Created Twisted connection pool with psycopg2")
+        return databases, summaries
 
-        return self._pool
+    def getTableStatsForDatabaseJSON(self, db, stats=None, summaries=(),
+                                     documents=True, totalSizes=None):
+        """
+        Server-built alternative to getTableStatsForDatabase.
 
-    @defer.inlineCallbacks
-    def getDatabasesAsync(self):
-        """Async version of getDatabases() - returns Deferred."""
-        try:
-            LOG.debug("Creating connection pool for async getDatabases")
-            pool = self._getConnectionPool()
-            LOG.debug("Running async query for databases")
-            rows = yield pool.runQuery(
-                "SELECT d.datname, s.datid, pg_database_size(s.datid) AS size"
-                "  FROM pg_database AS d"
-                "  JOIN pg_stat_database AS s ON s.datname = d.datname"
-                " WHERE NOT datistemplate AND datallowconn"
-                "   AND d.datname != 'bdr_supervisordb'"
-            )
+        Returns a (tables, summaries) tuple. tables is a RawJSON object
+        mapping table names to their stats exactly as PostgreSQL encoded it,
+        or empty if documents is False. summaries holds the sum of each of
+        the requested summary stats over all tables.
 
-            LOG.debug("Processing {0} database rows".format(len(rows)))
-            databases = {}
-            for row in rows:
-                databases[row[0]] = dict(
-                    oid=row[1],
-                    size=row[2]
-                )
+        If totalSizes maps table names to their total sizes, those are
+        passed to the server for the documents rather than calculated.
+        """
+        columns = selectStatColumns(TABLE_STAT_COLUMNS, {}, stats)
+        names = [name for name, _ in columns]
+
+        params = None
+        if totalSizes is not None:
+            columns = [
+                (name, "(%(totalSizes)s::jsonb ->> relname)::bigint"
+                 if name == TABLE_SIZE_STAT else expr)
+                for name, expr in columns]
+            params = dict(totalSizes=json.dumps(totalSizes))
+
+        def value(name):
+            if name in TABLE_TIMESTAMP_STATS:
+                return 'extract(epoch FROM {0})'.format(name)
+            return name
+
+        cursor = self._cursor(db, 'tableStats')
 
-            LOG.debug("Async getDatabases successful, returning {0} databases".format(len(databases)))
-            defer.returnValue(databases)
-        except Exception as ex:
-            msg = str(ex).strip()
-            fatal_errors = [
-                "no pg_hba.conf entry",
-                "password authentication failed"
-            ]
-            if any(err in msg for err in fatal_errors):
-                LOG.error("Async getDatabases failed due to fatal config error: %s. Skipping sync fallback.", msg)
-                defer.returnValue({})
-
-            LOG.error("Async getDatabases failed: %s, falling back to sync", ex)
-            import traceback
-            LOG.error("Traceback: %s", traceback.format_exc())
-            try:
-                LOG.info("Attempting sync fallback for getDatabases")
-                result = self.getDatabases()
-                LOG.info("Sync fallback successful, got {0} databases".format(len(result)))
-                defer.returnValue(result)
-            except Exception as ex2:
-                LOG.error("Sync fallback also failed: %s", ex2)
-                defer.returnValue({})
-
-    @defer.inlineCallbacks
-    def getTablesInDatabaseAsync(self, db):
-        """Async version of getTablesInDatabase() - returns Deferred."""
         try:
-            LOG.debug("Getting tables for database: %s (async)", db)
-            # Creating a separate pool for database
-            conn_kwargs = {
-                'host': self._host,
-                'port': int(self._port),
-                'user': self._username,
-                'password': self._password,
-                'database': str(db),
-            }
-            if self._ssl:
-                conn_kwargs['sslmode'] = 'require'
+            if documents:
+                tablesObject = (
+                    "coalesce(json_object_agg(relname,"
+                    " json_strip_nulls(json_build_object({0}))),"
+                    " '{{}}')::text".format(', '.join(
+                        "'{0}', {1}".format(name, value(name))
+                        for name in names)))
             else:
-                conn_kwargs['sslmode'] = 'disable'
-
-            db_pool = adbapi.ConnectionPool(
-                'psycopg2',
-                cp_min=1,
-                cp_max=2,
-                cp_reconnect=True,
-                **conn_kwargs
-            )
+                tablesObject = "'{}'::text"
 
-            try:
-                rows = yield db_pool.runQuery(
-                    "SELECT a.relname, a.relid, a.schemaname, b.size, a.total_size from"
-                    " ( select relname, "
-                    "   relid, schemaname,"
-                    "   pg_total_relation_size(relid) total_size"
-                    " FROM pg_stat_user_tables) a, "
-                    " (select relname, relpages * (current_setting('block_size'))::numeric size FROM pg_class) b "
-                    " where a.relname=b.relname"
-                )
+            cursor.execute(
+                "WITH t AS ({0})"
+                " SELECT {1}, json_build_object({2})::text"
+                "   FROM t".format(
+                    self._tableStatsQuery(columns),
+                    tablesObject,
+                    ', '.join(
+                        "'{0}', coalesce(sum({0}), 0)".format(name)
+                        for name in summaries if name in names)),
+                params
+            )
 
-                tables = {}
-                for row in rows:
-                    tables[row[0]] = dict(
-                        oid=row[1],
-                        schema=row[2],
-                        size=row[3],
-                        totalSize=row[4],
-                    )
-
-                LOG.debug("Got %d tables from database %s (async)", len(tables), db)
-                defer.returnValue(tables)
-            finally:
-                # Close the database-specific pool
-                db_pool.close()
-        except Exception as ex:
-            msg = str(ex).strip()
-            fatal_errors = [
-                "no pg_hba.conf entry",
-                "password authentication failed"
-            ]
-            if any(err in msg for err in fatal_errors):
-                LOG.error("Async getTablesInDatabase(%s) failed due to fatal config error: %s. Skipping sync fallback.",
-                          db, msg)
-                defer.returnValue({})
-
-            LOG.error("Async getTablesInDatabase(%s) failed: %s, falling back to sync", db, ex)
-            import traceback
-            LOG.error("Traceback: %s", traceback.format_exc())
+            tables, tableSummaries = cursor.fetchone()
+        finally:
+            cursor.close()
 
-            try:
-                result = self.getTablesInDatabase(db)
-                LOG.info("Sync fallback successful for database %s, got %d tables", db, len(result))
-                defer.returnValue(result)
-            except Exception as ex2:
-                LOG.error("Sync fallback also failed for database %s: %s", db, ex2)
-                defer.returnValue({})
+        return RawJSON(tables), json.loads(tableSummaries)
 
 
 def exclude_patterns_list(excludes):
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Compare the row-based and server-built JSON (json_agg) collection paths.
+
+Runs PostgresPoller.getData plus output encoding against a live server once
+per path and iteration, each in a fresh child process so peak RSS is
+comparable. Point it at a server with a large catalog to see the difference.
+
+    bench_json_agg.py <host> <port> <username> <password> <ssl> <defaultDB>
+        [--iterations N] [--type server|database|table]
+"""
+
+import json
+import optparse
+import time
+
+from benchlib import load_poller, max_rss, run_child
+
+PATHS = ('rows', 'json')
+
+
+def run_once(connection, level, path):
+    """Poll once using path and return a dict of measurements."""
+    poll_postgres = load_poller()
+    serverJSON = path == 'json'
+
+    poller = poll_postgres.PostgresPoller(
+        *connection, level=level, serverJSON=serverJSON)
+
+    pg = poll_postgres.PgHelper(*connection)
+    try:
+        wall_begin = time.time()
+        cpu_begin = time.clock()
+
+        data = poll_postgres.clean_dict_data(poller.getData(pg))
+        collected = time.time()
+
+        output = poller.encode(data)
+
+        wall_end = time.time()
+        cpu_end = time.clock()
+    finally:
+        pg.close()
+
+    tables = sum(
+        len(db.get('tables', {}))
+        for db in json.loads(output).get('databases', {}).values())
+
+    return dict(
+        path=path,
+        wall=wall_end - wall_begin,
+        collect=collected - wall_begin,
+        encode=wall_end - collected,
+        cpu=cpu_end - cpu_begin,
+        outputBytes=len(output),
+        tables=tables,
+        maxRSSKiB=max_rss(),
+    )
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage="%prog <host> <port> <username> <password> <ssl> <defaultDB>")
+    parser.add_option('--iterations', type='int', default=3)
+    parser.add_option('--type', dest='level', default='table')
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if len(args) != 6:
+        parser.error("connection arguments are required")
+
+    connection = args[:4] + [args[4] != 'False', args[5]]
+
+    if options.child:
+        print json.dumps(run_once(connection, options.level, options.child))
+        return
+
+    results = dict((path, []) for path in PATHS)
+    for _ in range(options.iterations):
+        for path in PATHS:
+            results[path].append(run_child(
+                __file__, args + ['--type', options.level, '--child', path]))
+
+    print "{0:<6} {1:>8} {2:>9} {3:>8} {4:>8} {5:>11} {6:>10} {7:>8}".format(
+        'path', 'wall(s)', 'collect', 'encode', 'cpu(s)', 'output(B)',
+        'maxRSS(KiB)', 'tables')
+
+    for path in PATHS:
+        runs = results[path]
+        best = min(runs, key=lambda r: r['wall'])
+        print (
+            "{path:<6} {wall:>8.3f} {collect:>9.3f} {encode:>8.3f}"
+            " {cpu:>8.3f} {outputBytes:>11} {maxRSSKiB:>10} {tables:>8}"
+            .format(**best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Benchmark the command poller and parsers offline against synthetic catalogs.
+
+For each number of tables and each poll type (server, database, table) a
+fresh child process polls a fake server (see fakepg.py) for the datapoints
+the monitoring templates define, then measures:
+
+    getData   PostgresPoller.getData, including row processing and rollups
+    clean     clean_dict_data
+    encode    PostgresPoller.encode
+    parse     the parser for the poll type, called once per component the
+              way zencommand does for a sample of components, and
+              extrapolated to all of them
+
+along with the output size and the peak RSS after each phase. Timings are
+the fastest of --repeat runs. With --table-shards, each database's tables
+are collected in that many shards, after as many polls to fill in the
+snapshots of the tables outside the shard.
+
+The report is written as JSON so runs of different versions can be compared:
+
+    bench_poller.py --output before.json
+    bench_poller.py --output after.json
+    bench_poller.py --compare before.json after.json
+
+Parsers need Products.ZenRRD, so they are only measured when run with the
+Zenoss python; the rest runs with any python that can import psycopg2.
+"""
+
+import json
+import optparse
+import shutil
+import tempfile
+
+from benchlib import (
+    Timer, environment, load_poller, max_rss, measure_parse, run_child,
+    template_datapoints)
+from fakepg import Catalog, install
+
+LEVELS = ('server', 'database', 'table')
+
+SCALES = '10,100,1000,10000,100000'
+
+# Metrics shown by --compare, as paths into each result.
+COMPARED = (
+    ('getData', 'seconds'),
+    ('clean', 'seconds'),
+    ('encode', 'seconds'),
+    ('parse', 'estimatedSeconds'),
+    ('outputBytes',),
+    ('maxRSSKiB', 'peak'),
+)
+
+
+def components(catalog, level, sample):
+    """Return (sample of component ids, number of components) for level."""
+    if level == 'server':
+        return [''], 1
+
+    databases = catalog.databaseNames()
+    if level == 'database':
+        return databases[:sample], len(databases)
+
+    # Take tables from every database in turn.
+    ids = []
+    for i in range(max(1, sample // len(databases))):
+        for database in databases:
+            if i < catalog.tableCount(catalog.databaseIndex(database)):
+                ids.append('{0}_table_{1:07d}'.format(database, i))
+
+    return ids[:sample], catalog.tables
+
+
+def run_once(options, level, tables):
+    """Measure one poll type at one scale and return a dict of results."""
+    poll_postgres = load_poller()
+    catalog = Catalog(
+        databases=options.databases,
+        tables=tables,
+        backends=options.backends,
+        locks=options.locks)
+    fake = install(catalog)
+
+    datapoints = template_datapoints()[level]
+    connection = ('localhost', 5432, 'zenoss', '', False, 'postgres')
+    poller = poll_postgres.PostgresPoller(
+        *connection,
+        datapoints=None if options.all_datapoints else datapoints,
+        level=level,
+        itersize=options.itersize,
+        tableShards=options.table_shards)
+
+    # Snapshots of the tables, filled in by polling every shard once.
+    directory = path = None
+    if options.table_shards > 1:
+        import snapshots
+        directory = tempfile.mkdtemp()
+        path = snapshots.snapshotPath(directory, 'localhost', 5432, level)
+
+    def poll():
+        kept = None
+        if path is not None:
+            kept = snapshots.TableSnapshots(path)
+
+        pg = poll_postgres.PgHelper(*connection, itersize=options.itersize)
+        try:
+            with Timer() as timer:
+                data = poller.getData(pg, snapshots=kept)
+        finally:
+            pg.close()
+
+        if kept is not None:
+            kept.save()
+
+        return timer, data
+
+    if path is not None:
+        for _ in range(options.table_shards):
+            poll()
+
+    rss = dict(start=max_rss())
+    timers = dict(getData=[], clean=[], encode=[])
+    for _ in range(options.repeat):
+        timer, data = poll()
+        timers['getData'].append(timer)
+        rss.setdefault('afterGetData', max_rss())
+
+        with Timer() as timer:
+            data = poll_postgres.clean_dict_data(data)
+        timers['clean'].append(timer)
+        rss.setdefault('afterClean', max_rss())
+
+        with Timer() as timer:
+            output = poller.encode(data)
+        timers['encode'].append(timer)
+        rss.setdefault('afterEncode', max_rss())
+
+        del data
+
+    if directory is not None:
+        shutil.rmtree(directory)
+
+    result = dict(
+        level=level,
+        tables=tables,
+        databases=catalog.databases,
+        outputBytes=len(output),
+        queries=sum(c.queries for c in fake.connections),
+        connections=len(fake.connections),
+    )
+
+    for phase, runs in timers.items():
+        result[phase] = min(runs, key=lambda t: t.wall).asdict()
+
+    result['parse'] = measure_parse(
+        level, output, datapoints,
+        *components(catalog, level, options.parser_sample))
+    rss['afterParse'] = rss['peak'] = max_rss()
+    result['maxRSSKiB'] = rss
+
+    return result
+
+
+def lookup(result, path):
+    for key in path:
+        if result is None:
+            return None
+        result = result.get(key)
+
+    return result
+
+
+def compare(base, new):
+    """Print the change of each compared metric between two reports."""
+    baseResults = dict(
+        ((r['level'], r['tables']), r) for r in base['results'])
+
+    print "base: {0}".format(base['environment'].get('revision'))
+    print "new:  {0}".format(new['environment'].get('revision'))
+    print "{0:<9} {1:>7} {2:<28} {3:>12} {4:>12} {5:>7}".format(
+        'type', 'tables', 'metric', 'base', 'new', 'ratio')
+
+    for result in new['results']:
+        key = (result['level'], result['tables'])
+        if key not in baseResults:
+            continue
+
+        for path in COMPARED:
+            a = lookup(baseResults[key], path)
+            b = lookup(result, path)
+            if a is None or b is None:
+                continue
+
+            print "{0:<9} {1:>7} {2:<28} {3:>12.4g} {4:>12.4g} {5:>7}".format(
+                key[0], key[1], '.'.join(path), a, b,
+                '{0:.2f}'.format(float(b) / a) if a else '-')
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage="%prog [options] | --compare <base.json> <new.json>")
+    parser.add_option(
+        '--tables', default=SCALES,
+        help="comma-separated numbers of tables [default: %default]")
+    parser.add_option(
+        '--types', default=','.join(LEVELS),
+        help="comma-separated poll types [default: %default]")
+    parser.add_option('--databases', type='int', default=10)
+    parser.add_option(
+        '--backends', type='int', default=20,
+        help="backends per database [default: %default]")
+    parser.add_option(
+        '--locks', type='int', default=50,
+        help="locks per database [default: %default]")
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--itersize', type='int', default=2000)
+    parser.add_option(
+        '--table-shards', type='int', default=1,
+        help="polls each database's tables are spread over"
+             " [default: %default]")
+    parser.add_option(
+        '--parser-sample', type='int', default=20,
+        help="components to call each parser for [default: %default]")
+    parser.add_option(
+        '--all-datapoints', action='store_true', default=False,
+        help="collect everything instead of the template datapoints")
+    parser.add_option('--output', help="write the JSON report here")
+    parser.add_option(
+        '--compare', action='store_true', default=False,
+        help="compare two reports")
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error("--compare needs two reports")
+
+        compare(*[json.load(open(path)) for path in args])
+        return
+
+    if options.child:
+        level, tables = options.child.split(':')
+        print json.dumps(run_once(options, level, int(tables)))
+        return
+
+    childArgs = [
+        '--databases', str(options.databases),
+        '--backends', str(options.backends),
+        '--locks', str(options.locks),
+        '--repeat', str(options.repeat),
+        '--itersize', str(options.itersize),
+        '--table-shards', str(options.table_shards),
+        '--parser-sample', str(options.parser_sample),
+    ]
+    if options.all_datapoints:
+        childArgs.append('--all-datapoints')
+
+    print "{0:<9} {1:>7} {2:>9} {3:>8} {4:>8} {5:>10} {6:>11} {7:>11}".format(
+        'type', 'tables', 'getData', 'clean', 'encode', 'parse(est)',
+        'output(B)', 'maxRSS(KiB)')
+
+    results = []
+    for tables in [int(t) for t in options.tables.split(',')]:
+        for level in options.types.split(','):
+            result = run_child(
+                __file__,
+                childArgs + ['--child', '{0}:{1}'.format(level, tables)])
+            results.append(result)
+
+            parse = result['parse']
+            print (
+                "{0:<9} {1:>7} {2:>9.3f} {3:>8.3f} {4:>8.3f} {5:>10} {6:>11}"
+                " {7:>11}".format(
+                    level, tables,
+                    result['getData']['seconds'],
+                    result['clean']['seconds'],
+                    result['encode']['seconds'],
+                    '{0:.3f}'.format(parse['estimatedSeconds'])
+                    if parse else '-',
+                    result['outputBytes'],
+                    result['maxRSSKiB']['peak']))
+
+    if options.output:
+        report = dict(
+            environment=environment(),
+            options=dict(
+                (k, v) for k, v in vars(options).items()
+                if k not in ('output', 'compare', 'child')),
+            results=results)
+
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Run the real PgHelper queries against a throwaway PostgreSQL instance.
+
+Starts a private server (see pgfixture.py), fills it with generated
+databases, tables, partitions and sessions, and calls each PgHelper
+collection method. Every query they send is traced for:
+
+    seconds   from execute until the last row was fetched
+    rows      rows transferred to the client
+    locks     locks the query's transaction held once it was done, by mode
+
+so changes to the catalog SQL can be judged on real plans.
+
+    bench_queries.py [--tables N] [--databases N] [--output report.json]
+"""
+
+import json
+import optparse
+import sys
+import time
+
+from benchlib import environment, load_poller
+
+# PgHelper methods measured, and whether they run once per database.
+METHODS = (
+    ('getDatabases', False),
+    ('getDatabaseStats', False),
+    ('getConnectionStats', False),
+    ('getLocks', False),
+    ('getTablesInDatabase', True),
+    ('getTableStatsForDatabase', True),
+)
+
+JSON_METHODS = (
+    ('getDatabaseStatsJSON', False),
+    ('getTableStatsForDatabaseJSON', True),
+)
+
+
+class Tracer(object):
+    """Collects a trace of every query sent through traced connections."""
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.method = None
+        self.traces = []
+
+    def locks(self, pid):
+        cursor = self.monitor.cursor()
+        try:
+            cursor.execute(
+                "SELECT mode, count(*) FROM pg_locks"
+                " WHERE pid = %s GROUP BY mode", (pid,))
+            return dict(cursor.fetchall())
+        finally:
+            cursor.close()
+
+
+class TracedPsycopg2(object):
+    """Stands in for the psycopg2 module imported by util."""
+
+    def __init__(self, psycopg2, tracer):
+        self._psycopg2 = psycopg2
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        return getattr(self._psycopg2, name)
+
+    def connect(self, **kwargs):
+        return TracedConnection(
+            self._psycopg2.connect(**kwargs), kwargs.get('database'),
+            self._tracer)
+
+
+class TracedConnection(object):
+    def __init__(self, connection, database, tracer):
+        self._connection = connection
+        self._database = database
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, name=None):
+        if name:
+            cursor = self._connection.cursor(name=name)
+        else:
+            cursor = self._connection.cursor()
+
+        return TracedCursor(cursor, self)
+
+
+class TracedCursor(object):
+    """
+    Traces the query of one cursor. Each query runs in a transaction of its
+    own, so the locks seen when the cursor is closed are the query's.
+    """
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+        self._trace = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+    def execute(self, sql, params=None):
+        self._connection._connection.rollback()
+        self._trace = dict(
+            method=self._connection._tracer.method,
+            database=self._connection._database,
+            sql=sql,
+            rows=0,
+            begin=time.time())
+
+        self._cursor.execute(sql, params)
+        self._trace['end'] = time.time()
+
+    def _fetched(self, rows):
+        self._trace['rows'] += rows
+        self._trace['end'] = time.time()
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._fetched(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._cursor.fetchmany(size or self._cursor.arraysize)
+        self._fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._fetched(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._fetched(1)
+            yield row
+
+    def close(self):
+        trace, self._trace = self._trace, None
+        if trace is not None:
+            tracer = self._connection._tracer
+            trace['seconds'] = trace.pop('end') - trace.pop('begin')
+            trace['locks'] = tracer.locks(
+                self._connection._connection.get_backend_pid())
+            tracer.traces.append(trace)
+
+        self._cursor.close()
+
+
+def summarize(traces):
+    """Aggregate traces of the same method and SQL over databases."""
+    queries = {}
+    for trace in traces:
+        query = queries.setdefault((trace['method'], trace['sql']), dict(
+            method=trace['method'],
+            sql=trace['sql'],
+            calls=0,
+            seconds=[],
+            rows=0,
+            locks={},
+        ))
+        query['calls'] += 1
+        query['seconds'].append(trace['seconds'])
+        query['rows'] += trace['rows']
+        for mode, count in trace['locks'].items():
+            query['locks'][mode] = max(query['locks'].get(mode, 0), count)
+
+    for query in queries.values():
+        seconds = sorted(query.pop('seconds'))
+        query.update(
+            totalSeconds=sum(seconds),
+            minSeconds=seconds[0],
+            medianSeconds=seconds[len(seconds) // 2],
+            maxSeconds=seconds[-1])
+
+    return sorted(queries.values(), key=lambda q: q['method'])
+
+
+def run(options):
+    poll_postgres = load_poller()
+
+    # psycopg2 can only be imported once util has set up the lib path.
+    from pgfixture import Activity, TemporaryCluster, database_names, populate
+
+    util = sys.modules['util']
+
+    with TemporaryCluster(bindir=options.bindir, keep=options.keep) as cluster:
+        populate(
+            cluster,
+            databases=options.databases,
+            tables=options.tables,
+            schemas=options.schemas,
+            partitions=options.partitions,
+            rows=options.rows)
+
+        monitor = cluster.connect()
+        tracer = Tracer(monitor)
+        util.psycopg2 = TracedPsycopg2(util.psycopg2, tracer)
+
+        databases = database_names(options.databases)
+        activities = [
+            Activity(cluster, name, options.activity).start()
+            for name in databases]
+
+        try:
+            for _ in range(options.repeat):
+                pg = poll_postgres.PgHelper(*cluster.connection())
+                methods = METHODS
+                if pg.supportsServerJSON():
+                    methods += JSON_METHODS
+
+                try:
+                    for method, perDatabase in methods:
+                        tracer.method = method
+                        for args in ([(db,) for db in databases]
+                                     if perDatabase else [()]):
+                            getattr(pg, method)(*args)
+                finally:
+                    tracer.method = None
+                    pg.close()
+        finally:
+            for activity in activities:
+                activity.stop()
+            monitor.close()
+
+        serverVersion = cluster.serverVersion()
+
+    # The SELECT 1 of each new connection is traced too, but isn't what's
+    # being measured.
+    traces = [
+        t for t in tracer.traces
+        if t['method'] is not None and t['sql'] != 'SELECT 1']
+
+    return dict(
+        environment=environment(),
+        serverVersion=serverVersion,
+        options=dict(
+            (k, v) for k, v in vars(options).items()
+            if k not in ('output', 'keep')),
+        queries=summarize(traces))
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option(
+        '--bindir', help="PostgreSQL bin directory [default: pg_config]")
+    parser.add_option('--databases', type='int', default=3)
+    parser.add_option(
+        '--tables', type='int', default=1000,
+        help="tables per database [default: %default]")
+    parser.add_option('--schemas', type='int', default=10)
+    parser.add_option(
+        '--partitions', type='int', default=20,
+        help="partitions of a partitioned table per database"
+             " [default: %default]")
+    parser.add_option(
+        '--rows', type='int', default=10,
+        help="rows per table [default: %default]")
+    parser.add_option(
+        '--activity', type='int', default=5,
+        help="sessions of each kind per database [default: %default]")
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--output', help="write the JSON report here")
+    parser.add_option(
+        '--keep', action='store_true', default=False,
+        help="keep the instance's directory for its logs")
+    options, args = parser.parse_args()
+
+    report = run(options)
+
+    print "PostgreSQL {0}".format(report['serverVersion'])
+    print "{0:<30} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9}  {6}".format(
+        'method', 'calls', 'total(s)', 'median(s)', 'max(s)', 'rows',
+        'locks')
+
+    for query in report['queries']:
+        print (
+            "{method:<30} {calls:>6} {totalSeconds:>9.4f}"
+            " {medianSeconds:>9.4f} {maxSeconds:>9.4f} {rows:>9}  {0}".format(
+                ', '.join(
+                    '{0}={1}'.format(mode, count)
+                    for mode, count in sorted(query['locks'].items())),
+                **query))
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
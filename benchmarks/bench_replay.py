@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Benchmark the poller, parsers and modeler against a recorded capture.
+
+Captures are recorded from a real server, for example a customer's, with
+
+    poll_postgres.py <host> <port> <user> <password> <ssl> <defaultDB> \\
+        --capture poll.jsonl.gz --anonymize
+
+for everything the poller collects, or by running zenmodeler with
+ZP_POSTGRESQL_CAPTURE set to a directory for the modeler's queries. Each
+poll type (and the modeler, with --modeler) is then measured in a fresh
+child process the same way as bench_poller.py, with the capture served
+back by capture.Replay instead of a server.
+
+Only queries that were recorded can be replayed. A capture of a full poll
+like the one above is replayed collecting everything for each type. With
+--template-datapoints each type only collects the datapoints of its
+template, which needs a capture of those polls: add --capture to the
+commands of the datasources instead.
+
+    bench_replay.py <capture> [--types server,database,table] [--modeler]
+        [--output report.json]
+
+Parsers and the modeler need the Zenoss python.
+"""
+
+import json
+import logging
+import optparse
+import sys
+
+from benchlib import (
+    Timer, environment, load_poller, max_rss, measure_parse, run_child,
+    template_datapoints)
+
+LEVELS = ('server', 'database', 'table')
+
+
+def load_replay(path):
+    """Return poll_postgres with util connecting to the capture at path."""
+    poll_postgres = load_poller()
+    import capture
+
+    replay = capture.Replay(path)
+    sys.modules['util'].psycopg2 = replay
+    return poll_postgres, replay
+
+
+def components(data, level, sample):
+    """Return (sample of component ids, number of components) for level."""
+    if level == 'server':
+        return [''], 1
+
+    databases = sorted(data.get('databases', {}))
+    if level == 'database':
+        return databases[:sample], len(databases)
+
+    ids = sorted(
+        '{0}_{1}'.format(dbName, tableName)
+        for dbName in databases
+        for tableName in data['databases'][dbName].get('tables', {}))
+
+    step = max(1, len(ids) // max(1, sample))
+    return ids[::step][:sample], len(ids)
+
+
+def run_poll(options, level):
+    poll_postgres, replay = load_replay(options.capture)
+
+    datapoints = template_datapoints()[level]
+    connection = ('localhost', 5432, 'zenoss', '', False,
+                  replay.defaultDatabase)
+    poller = poll_postgres.PostgresPoller(
+        *connection,
+        datapoints=datapoints if options.template_datapoints else None,
+        level=level)
+
+    rss = dict(start=max_rss())
+    timers = dict(getData=[], clean=[], encode=[])
+    for _ in range(options.repeat):
+        pg = poll_postgres.PgHelper(*connection)
+        try:
+            with Timer() as timer:
+                data = poller.getData(pg)
+        finally:
+            pg.close()
+        timers['getData'].append(timer)
+        rss.setdefault('afterGetData', max_rss())
+
+        with Timer() as timer:
+            data = poll_postgres.clean_dict_data(data)
+        timers['clean'].append(timer)
+        rss.setdefault('afterClean', max_rss())
+
+        with Timer() as timer:
+            output = poller.encode(data)
+        timers['encode'].append(timer)
+        rss.setdefault('afterEncode', max_rss())
+
+        del data
+
+    result = dict(level=level, outputBytes=len(output))
+    for phase, runs in timers.items():
+        result[phase] = min(runs, key=lambda t: t.wall).asdict()
+
+    result['parse'] = measure_parse(
+        level, output, datapoints,
+        *components(json.loads(output), level, options.parser_sample))
+    rss['afterParse'] = rss['peak'] = max_rss()
+    result['maxRSSKiB'] = rss
+
+    return result
+
+
+class Device(object):
+    """The device properties the modeler plugin reads."""
+
+    def __init__(self, defaultDB):
+        self.id = 'replay'
+        self.manageIp = 'localhost'
+        self.zPostgreSQLPort = 5432
+        self.zPostgreSQLUsername = 'zenoss'
+        self.zPostgreSQLPassword = ''
+        self.zPostgreSQLUseSSL = False
+        self.zPostgreSQLDefaultDB = defaultDB
+        self.zPostgreSQLTableRegex = []
+
+
+def replayConnection(defer):
+    """
+    Return a stand-in for asyncutil.AsyncConnection that runs queries
+    synchronously against the replay it is given as dbapi, so no reactor is
+    needed.
+    """
+    class ReplayAsyncConnection(object):
+        def __init__(self, dbapi, **kwargs):
+            self.dbapi = dbapi
+            self.kwargs = kwargs
+            self.connection = None
+
+        def connect(self):
+            try:
+                self.connection = self.dbapi.connect(**self.kwargs)
+            except Exception:
+                return defer.fail()
+
+            return defer.succeed(self)
+
+        def runQuery(self, sql, params=None):
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(sql, params)
+                return defer.succeed(cursor.fetchall())
+            except Exception:
+                return defer.fail()
+            finally:
+                cursor.close()
+
+        def runOperation(self, sql, params=None):
+            # Transaction and cursor statements aren't recorded.
+            return defer.succeed(None)
+
+        def close(self):
+            if self.connection is not None:
+                self.connection.close()
+
+    return ReplayAsyncConnection
+
+
+def run_modeler(options):
+    try:
+        from twisted.internet import defer
+        from ZenPacks.zenoss.PostgreSQL import asyncutil, capture, util
+        from ZenPacks.zenoss.PostgreSQL.modeler.plugins.zenoss.PostgreSQL \
+            import PostgreSQL
+    except ImportError, ex:
+        return dict(level='modeler', skipped=str(ex))
+
+    replay = capture.Replay(options.capture)
+    util.psycopg2 = asyncutil.psycopg2 = replay
+    asyncutil.AsyncConnection = replayConnection(defer)
+
+    log = logging.getLogger('zen.PostgreSQL')
+    device = Device(replay.defaultDatabase)
+    plugin = PostgreSQL()
+
+    rss = dict(start=max_rss())
+    timers = dict(collect=[], process=[])
+    for _ in range(options.repeat):
+        results = []
+        with Timer() as timer:
+            plugin.collect(device, log).addBoth(results.append)
+        timers['collect'].append(timer)
+        rss.setdefault('afterCollect', max_rss())
+
+        if not isinstance(results[0], dict):
+            raise RuntimeError("collect failed: {0}".format(results[0]))
+
+        tables = sum(
+            len(db.get('tables', {}))
+            for db in results[0]['databases'].values())
+
+        with Timer() as timer:
+            maps = plugin.process(device, results[0], log)
+        timers['process'].append(timer)
+        rss.setdefault('afterProcess', max_rss())
+
+        del results, maps
+
+    result = dict(level='modeler', tables=tables)
+    for phase, runs in timers.items():
+        result[phase] = min(runs, key=lambda t: t.wall).asdict()
+
+    rss['peak'] = max_rss()
+    result['maxRSSKiB'] = rss
+
+    return result
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] <capture>")
+    parser.add_option(
+        '--types', default=','.join(LEVELS),
+        help="comma-separated poll types [default: %default]")
+    parser.add_option(
+        '--modeler', action='store_true', default=False,
+        help="also measure the modeler plugin's collect and process")
+    parser.add_option(
+        '--template-datapoints', action='store_true', default=False,
+        help="collect only the datapoints of each type's template")
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option(
+        '--parser-sample', type='int', default=20,
+        help="components to call each parser for [default: %default]")
+    parser.add_option('--output', help="write the JSON report here")
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("a capture file is required")
+
+    options.capture = args[0]
+
+    if options.child == 'modeler':
+        print json.dumps(run_modeler(options))
+        return
+    elif options.child:
+        print json.dumps(run_poll(options, options.child))
+        return
+
+    childArgs = [
+        '--repeat', str(options.repeat),
+        '--parser-sample', str(options.parser_sample),
+        options.capture,
+    ]
+    if options.template_datapoints:
+        childArgs.append('--template-datapoints')
+
+    kinds = [kind for kind in options.types.split(',') if kind]
+    if options.modeler:
+        kinds.append('modeler')
+
+    results = []
+    for kind in kinds:
+        result = run_child(__file__, childArgs + ['--child', kind])
+        results.append(result)
+
+        if 'skipped' in result:
+            print "{0:<9} skipped: {1}".format(kind, result['skipped'])
+            continue
+
+        print "{0:<9} {1}  maxRSS {2} KiB".format(
+            kind,
+            '  '.join(
+                '{0} {1:.3f}s'.format(phase, result[phase]['seconds'])
+                for phase in ('getData', 'clean', 'encode', 'collect',
+                              'process')
+                if phase in result),
+            result['maxRSSKiB']['peak'])
+
+    if options.output:
+        report = dict(
+            environment=environment(),
+            options=dict(
+                (k, v) for k, v in vars(options).items()
+                if k not in ('output', 'child')),
+            results=results)
+
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
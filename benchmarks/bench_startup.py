@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Benchmark the start-up time of the command poller.
+
+zencommand starts poll_postgres.py for every datasource of every component
+each cycle, so whatever it does before polling is paid thousands of times.
+This times --repeat fresh processes of each of
+
+    interpreter  python -c pass
+    poller       poll_postgres.py without arguments, which imports
+                 everything a poll needs and exits with its usage message
+
+and lists the modules the poller imports. It exits with status 1 when the
+poller imports a module it never needs (Twisted, Zope, Zenoss, or the
+capture, profiling and snapshot support that is imported on demand), or
+when the poller's median takes longer than --budget-ms on top of the
+interpreter's.
+
+    bench_startup.py [--repeat 20] [--budget-ms 100] [--output report.json]
+"""
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+from benchlib import ZP_DIR, environment, load_poller, run_child
+
+# Top-level modules the command poller must not import.
+FORBIDDEN = (
+    'Globals',
+    'Products',
+    'capture',
+    'profiling',
+    'snapshots',
+    'twisted',
+    'zope',
+)
+
+
+def run_modules():
+    """Return the top-level modules importing the poller adds."""
+    before = set(sys.modules)
+    load_poller()
+
+    return dict(modules=sorted(set(
+        name.split('.')[0] for name, module in sys.modules.items()
+        if name not in before and module is not None)))
+
+
+def time_command(args, repeat):
+    """Return the wall seconds of each of repeat runs of args."""
+    seconds = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            begin = time.time()
+            subprocess.call(args, stdout=devnull, stderr=devnull)
+            seconds.append(time.time() - begin)
+
+    return seconds
+
+
+def summary(seconds):
+    seconds = sorted(seconds)
+    return dict(
+        minSeconds=seconds[0],
+        medianSeconds=seconds[len(seconds) // 2],
+        maxSeconds=seconds[-1])
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('--repeat', type='int', default=20)
+    parser.add_option(
+        '--budget-ms', type='float',
+        help="fail if the poller's median start-up exceeds the interpreter's"
+             " by more than this")
+    parser.add_option('--output', help="write the JSON report here")
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.child == 'modules':
+        print json.dumps(run_modules())
+        return
+
+    poller = os.path.join(ZP_DIR, 'libexec', 'poll_postgres.py')
+    results = dict(
+        interpreter=summary(time_command(
+            [sys.executable, '-c', 'pass'], options.repeat)),
+        poller=summary(time_command(
+            [sys.executable, poller], options.repeat)),
+    )
+
+    modules = run_child(__file__, ['--child', 'modules'])['modules']
+    forbidden = sorted(set(modules).intersection(FORBIDDEN))
+    overhead = (
+        results['poller']['medianSeconds'] -
+        results['interpreter']['medianSeconds']) * 1000
+
+    for name in ('interpreter', 'poller'):
+        print "{0:<12} min {1:.1f} ms  median {2:.1f} ms".format(
+            name,
+            results[name]['minSeconds'] * 1000,
+            results[name]['medianSeconds'] * 1000)
+
+    print "{0:<12} {1:.1f} ms".format('overhead', overhead)
+    print "{0:<12} {1}".format('modules', ' '.join(modules))
+
+    failures = []
+    if forbidden:
+        failures.append("imports {0}".format(', '.join(forbidden)))
+
+    if options.budget_ms is not None and overhead > options.budget_ms:
+        failures.append("start-up overhead {0:.1f} ms exceeds {1:.1f} ms".format(
+            overhead, options.budget_ms))
+
+    if options.output:
+        report = dict(
+            environment=environment(),
+            options=dict(
+                (k, v) for k, v in vars(options).items()
+                if k not in ('output', 'child')),
+            results=results,
+            overheadMilliseconds=overhead,
+            modules=modules,
+            failures=failures)
+
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    for failure in failures:
+        print >> sys.stderr, "FAIL: poller {0}".format(failure)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Helpers shared by the benchmark scripts.
+"""
+
+import imp
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+ZP_DIR = os.path.join(REPO_DIR, 'ZenPacks', 'zenoss', 'PostgreSQL')
+
+# Monitoring template for each value of poll_postgres.py's <type> argument.
+TEMPLATES = {
+    'server': 'PostgreSQLServer',
+    'database': 'PostgreSQLDatabase',
+    'table': 'PostgreSQLTable',
+}
+
+
+def load_poller():
+    """Import libexec/poll_postgres.py the way zencommand runs it."""
+    return imp.load_source(
+        'poll_postgres', os.path.join(ZP_DIR, 'libexec', 'poll_postgres.py'))
+
+
+def template_datapoints():
+    """Return {level: set of datapoint ids} from objects.xml."""
+    tree = ElementTree.parse(os.path.join(ZP_DIR, 'objects', 'objects.xml'))
+    prefix = '/zport/dmd/Devices/rrdTemplates/'
+
+    datapoints = {}
+    for template in tree.getroot().findall('object'):
+        name = template.get('id', '')[len(prefix):]
+        for level, templateName in TEMPLATES.items():
+            if name == templateName:
+                datapoints[level] = set(
+                    dp.get('id') for dp in template.iter('object')
+                    if dp.get('module') == 'Products.ZenModel.RRDDataPoint')
+
+    return datapoints
+
+
+def max_rss():
+    """Peak resident set size of this process in KiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Timer(object):
+    """Context manager recording wall and CPU seconds."""
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = time.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = time.time() - self.wall
+        self.cpu = time.clock() - self.cpu
+
+    def asdict(self):
+        return dict(seconds=self.wall, cpuSeconds=self.cpu)
+
+
+def run_child(script, args):
+    """
+    Run script with args in a fresh interpreter and return the JSON object
+    it printed last. Used so each measurement gets its own peak RSS.
+    """
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(script)] + list(args))
+    return json.loads(output.splitlines()[-1])
+
+
+def environment():
+    """Describe the code and interpreter being measured."""
+    try:
+        revision = subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=REPO_DIR, stderr=subprocess.STDOUT).strip()
+    except Exception:
+        revision = None
+
+    return dict(
+        revision=revision,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+    )
+
+
+class Output(object):
+    def __init__(self, output):
+        self.output = output
+
+
+class Point(object):
+    def __init__(self, id, component):
+        self.id = id
+        self.component = component
+
+
+class Command(object):
+    """What zencommand passes to a parser for one datasource."""
+
+    def __init__(self, output, points):
+        self.result = Output(output)
+        self.points = points
+
+
+class ParsedResult(object):
+    def __init__(self):
+        self.values = []
+        self.events = []
+
+
+def load_parser(level):
+    """Return the parser class for level, or None if it can't be imported."""
+    try:
+        module = imp.load_source(
+            'parser_{0}'.format(level),
+            os.path.join(ZP_DIR, 'parsers', '{0}.py'.format(level)))
+    except ImportError:
+        return None
+
+    return getattr(module, level)
+
+
+def measure_parse(level, output, datapoints, sampled, total):
+    """
+    Call the parser for level once per component in sampled, the way
+    zencommand does, and extrapolate the time to all total components.
+    Returns None if the parser can't be imported.
+    """
+    parser = load_parser(level)
+    if parser is None:
+        return None
+
+    values = 0
+    with Timer() as timer:
+        for component in sampled:
+            result = ParsedResult()
+            parser().processResults(
+                Command(output, [
+                    Point(dp, component) for dp in sorted(datapoints)]),
+                result)
+            values += len(result.values)
+
+    perCall = timer.wall / len(sampled) if sampled else 0
+    return dict(
+        calls=len(sampled),
+        components=total,
+        values=values,
+        seconds=timer.wall,
+        secondsPerCall=perCall,
+        estimatedSeconds=perCall * total,
+    )
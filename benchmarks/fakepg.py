@@ -0,0 +1,427 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Fake psycopg2 connections serving a synthetic catalog.
+
+Answers the queries PgHelper sends with generated rows, so the poller can be
+measured at any scale without a PostgreSQL server. Rows are generated from
+the catalog's dimensions as they are fetched, so the fake itself holds
+nothing in memory. Values are deterministic for a given catalog.
+
+The columns of each row are taken from the outer select list of the query,
+so the subsets of stats selected for the requested datapoints are honored.
+Server-built JSON is not supported: the fake reports a server version too
+old for it.
+
+    catalog = Catalog(databases=10, tables=10000)
+    install(catalog)
+"""
+
+import datetime
+import decimal
+import json
+import re
+import sys
+
+# Older than 9.5, so PgHelper.supportsServerJSON() is False.
+SERVER_VERSION = 90400
+
+NOW = datetime.datetime(2026, 1, 1, 12, 0, 0)
+
+# Rows added to the large tables, as many as util.HOT_TABLE_ROWS.
+HOT_ROWS = 1000000
+
+LOCK_MODES = (
+    'AccessShareLock',
+    'RowShareLock',
+    'RowExclusiveLock',
+    'ShareUpdateExclusiveLock',
+    'ShareLock',
+    'ShareRowExclusiveLock',
+    'ExclusiveLock',
+    'AccessExclusiveLock',
+    'SIReadLock',
+)
+
+# Column expressions selected without an alias, by the name used here.
+EXPRESSIONS = {
+    'pg_database_size(s.datid)': 'size',
+}
+
+SELECT_LIST = re.compile(r'^\s*SELECT\s+(.*?)\s+FROM\s', re.I | re.S)
+
+# The queries combined by PgHelper.getServerStats.
+SUBQUERY = re.compile(r'json_agg\(q\)::text FROM \((.*?)\) AS q\)', re.S)
+
+
+def columnNames(sql):
+    """Return the name of each column in the outer select list of sql."""
+    match = SELECT_LIST.match(sql)
+    if not match:
+        return []
+
+    names = []
+    for column in split(match.group(1)):
+        column = column.strip()
+        alias = re.search(r'\s+AS\s+(\w+)$', column, re.I)
+        if alias:
+            names.append(alias.group(1))
+        elif column in EXPRESSIONS:
+            names.append(EXPRESSIONS[column])
+        else:
+            names.append(column.split('.')[-1])
+
+    return names
+
+
+def split(selectList):
+    """Split a select list on the commas that are not inside parentheses."""
+    columns, depth, current = [], 0, []
+    for char in selectList:
+        if char == ',' and depth == 0:
+            columns.append(''.join(current))
+            current = []
+            continue
+
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+
+        current.append(char)
+
+    columns.append(''.join(current))
+    return columns
+
+
+class Catalog(object):
+    """
+    Dimensions of a synthetic server.
+
+    tables are spread evenly over databases. backends and locks are per
+    database.
+    """
+
+    def __init__(self, databases=10, tables=1000, backends=20, locks=50):
+        self.databases = max(1, min(databases, tables or 1))
+        self.tables = tables
+        self.backends = backends
+        self.locks = locks
+
+    def databaseNames(self):
+        return ['db{0:04d}'.format(i) for i in range(self.databases)]
+
+    def databaseIndex(self, name):
+        return int(name[2:])
+
+    def tableCount(self, database):
+        """Number of tables in the database with index database."""
+        count, extra = divmod(self.tables, self.databases)
+        return count + (1 if database < extra else 0)
+
+    def value(self, seed, name):
+        """Deterministic counter value for column name of an object."""
+        return (seed * 7919 + hash(name) % 104729) % 1000003
+
+    def timestamp(self, seed, name):
+        """Timestamp for column name, or None for a third of objects."""
+        if (seed + len(name)) % 3 == 0:
+            return None
+
+        return NOW - datetime.timedelta(seconds=self.value(seed, name))
+
+    def databaseRows(self, names):
+        for i, datname in enumerate(self.databaseNames()):
+            row = [datname]
+            for name in names[1:]:
+                if name == 'datid':
+                    row.append(16384 + i)
+                elif name == 'numbackends':
+                    row.append(self.backends)
+                else:
+                    row.append(self.value(i, name))
+
+            yield tuple(row)
+
+    def tupleCount(self, i, seed, name):
+        """
+        Live or dead rows of a table. One table in a thousand is large
+        enough to be in every shard.
+        """
+        count = self.value(seed, name) % 100000
+        if i % 1000 == 0:
+            count += HOT_ROWS
+
+        return count
+
+    def inShard(self, i, seed, shard):
+        """Return True if table i matches TableShard.WHERE for shard."""
+        return (
+            (16384 + i) % shard['count'] == shard['index'] or
+            self.tupleCount(i, seed, 'nLiveTup') +
+            self.tupleCount(i, seed, 'nDeadTup') >= shard['hotRows'] or
+            'table_{0:07d}'.format(i) in shard['hot'])
+
+    def tableRows(self, datname, names, params=None):
+        database = self.databaseIndex(datname)
+        shard = params if params and 'count' in params else None
+        for i in range(self.tableCount(database)):
+            seed = database * 1000003 + i
+            if shard is not None and not self.inShard(i, seed, shard):
+                continue
+
+            row = []
+            for name in names:
+                if name == 'relname':
+                    row.append('table_{0:07d}'.format(i))
+                elif name == 'relid':
+                    row.append(16384 + i)
+                elif name in ('nLiveTup', 'nDeadTup'):
+                    row.append(self.tupleCount(i, seed, name))
+                elif name == 'schemaname':
+                    row.append('schema_{0:02d}'.format(i % 10))
+                elif name == 'size':
+                    row.append(decimal.Decimal(8192 * (i % 1000 + 1)))
+                elif name.startswith('last'):
+                    row.append(self.timestamp(seed, name))
+                else:
+                    row.append(self.value(seed, name))
+
+            yield tuple(row)
+
+    def backendStates(self, datname):
+        """Yield (state, xact_start, query_start, backend_start) of each."""
+        for i in range(self.backends):
+            backend_start = NOW - datetime.timedelta(seconds=3600 + i)
+            state = i % 4
+            if state == 0:
+                yield 'idle', None, None, backend_start
+            elif state == 1:
+                yield ('idle in transaction',
+                       NOW - datetime.timedelta(seconds=i), None,
+                       backend_start)
+            else:
+                yield ('active', NOW - datetime.timedelta(seconds=i),
+                       NOW - datetime.timedelta(seconds=i / 2.0),
+                       backend_start)
+
+    def activityRows(self):
+        for datname in self.databaseNames():
+            for _, xact_start, query_start, backend_start in \
+                    self.backendStates(datname):
+                yield (datname, xact_start, query_start, backend_start, NOW)
+
+    def activitySummaryRows(self):
+        """The backends of each database summarized like the server does."""
+        for datname in self.databaseNames():
+            counts = [0, 0, 0]
+            durations = dict(query=[], txn=[], idle=[])
+            for state, xact_start, query_start, backend_start in \
+                    self.backendStates(datname):
+                counts[0] += 1
+                if state == 'active':
+                    counts[1] += 1
+                    durations['query'].append(
+                        (NOW - query_start).total_seconds())
+                else:
+                    counts[2] += 1
+
+                if xact_start is not None:
+                    durations['txn'].append(
+                        (NOW - xact_start).total_seconds())
+
+                if state == 'idle in transaction':
+                    durations['idle'].append(
+                        (NOW - xact_start).total_seconds())
+
+            row = [datname] + counts
+            for kind in ('query', 'txn', 'idle'):
+                values = durations[kind]
+                row.extend((
+                    min(values) if values else None,
+                    max(values) if values else None,
+                    sum(values) if values else None,
+                    len(values)))
+
+            yield tuple(row)
+
+    def longRunningRows(self, top):
+        """The top longest running backends of each kind per database."""
+        for datname in self.databaseNames():
+            sessions = dict(active=[])
+            sessions['idle in transaction'] = []
+            for pid, (state, xact_start, query_start, _) in enumerate(
+                    self.backendStates(datname), 1000):
+                if state == 'active':
+                    seconds = (NOW - query_start).total_seconds()
+                elif state == 'idle in transaction':
+                    seconds = (NOW - xact_start).total_seconds()
+                else:
+                    continue
+
+                sessions[state].append((
+                    datname, state, pid, 'zenoss', 'app', None,
+                    'SELECT {0}'.format(pid), seconds))
+
+            for kind in sorted(sessions):
+                ranked = sorted(
+                    sessions[kind], key=lambda x: x[-1], reverse=True)
+                for row in ranked[:top]:
+                    yield row
+
+    def blockingRows(self):
+        """
+        A chain of each database: a session idle in transaction blocking
+        one waiting session, which blocks another, and blocking a third.
+        """
+        for i, datname in enumerate(self.databaseNames()):
+            head = 3000 + 10 * i
+            yield (head, [], datname, 'zenoss', 'app',
+                   'idle in transaction', 'UPDATE t SET x = 1', 90.0)
+            yield (head + 1, [head], datname, 'zenoss', 'app', 'active',
+                   None, 60.0)
+            yield (head + 2, [head + 1], datname, 'zenoss', 'app', 'active',
+                   None, 30.0)
+            yield (head + 3, [head], datname, 'zenoss', 'app', 'active',
+                   None, 10.0)
+
+    def lockRows(self):
+        for datname in self.databaseNames():
+            for i in range(self.locks):
+                yield (datname, LOCK_MODES[i % len(LOCK_MODES)], i % 10 != 0)
+
+    def rows(self, datname, sql, params=None):
+        """Return an iterator of the rows answering sql in datname."""
+        names = columnNames(sql)
+        if sql.strip() == 'SELECT 1':
+            return iter([(1,)])
+        elif 'json_agg(q)' in sql:
+            return iter([tuple(
+                self.aggregate(datname, subquery)
+                for subquery in SUBQUERY.findall(sql))])
+        elif 'json_build_object' in sql:
+            raise NotImplementedError(
+                "the fake catalog cannot build JSON documents")
+        elif 'pg_blocking_pids' in sql or 'pg_locks AS w' in sql:
+            return self.blockingRows()
+        elif 'pg_stat_activity' in sql and 'row_number()' in sql:
+            return self.longRunningRows(
+                int(re.search(r'rank <= (\d+)', sql).group(1)))
+        elif 'pg_stat_activity' in sql and 'GROUP BY' in sql:
+            return self.activitySummaryRows()
+        elif 'pg_stat_activity' in sql:
+            return self.activityRows()
+        elif 'pg_locks' in sql:
+            return self.lockRows()
+        elif 'pg_stat_user_tables' in sql:
+            return self.tableRows(datname, names, params)
+        elif 'pg_stat_database' in sql:
+            return self.databaseRows(names)
+
+        raise NotImplementedError("unrecognized query: {0}".format(sql))
+
+    def aggregate(self, datname, sql):
+        """Return the JSON array of objects json_agg makes of sql's rows."""
+        names = columnNames(sql)
+        objects = [
+            '{{{0}}}'.format(', '.join(
+                '{0}: {1}'.format(json.dumps(name), json.dumps(
+                    value, default=float))
+                # Only the order of the columns is read back, so those of
+                # a select list not parsed here are named by position.
+                for name, value in zip(
+                    names or map(str, range(len(row))), row)))
+            for row in self.rows(datname, sql)]
+
+        return '[{0}]'.format(', '.join(objects)) if objects else None
+
+
+class Cursor(object):
+    """Client-side or named (server-side) cursor over generated rows."""
+
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.itersize = 2000
+        self.rowcount = -1
+        self.description = None
+        self._rows = iter(())
+
+    def execute(self, sql, params=None):
+        self.connection.queries += 1
+        self.description = tuple(
+            (name, None, None, None, None, None, None)
+            for name in columnNames(sql)) or None
+        self._rows = self.connection.catalog.rows(
+            self.connection.database, sql, params)
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=None):
+        size = size or self.itersize
+        return [row for _, row in zip(range(size), self._rows)]
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def close(self):
+        self._rows = iter(())
+
+
+class Connection(object):
+    server_version = SERVER_VERSION
+
+    def __init__(self, catalog, database):
+        self.catalog = catalog
+        self.database = database
+        self.queries = 0
+        self.closed = 0
+
+    def cursor(self, name=None):
+        return Cursor(self, name)
+
+    def set_session(self, **kwargs):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePsycopg2(object):
+    """Stands in for the psycopg2 module imported by util."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.connections = []
+
+    def connect(self, database=None, **kwargs):
+        connection = Connection(self.catalog, database)
+        self.connections.append(connection)
+        return connection
+
+
+def install(catalog):
+    """
+    Make PgHelper connect to catalog. Call after util has been imported,
+    for example by benchlib.load_poller().
+    """
+    fake = FakePsycopg2(catalog)
+    sys.modules['util'].psycopg2 = fake
+    return fake
@@ -0,0 +1,335 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2026, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Throwaway PostgreSQL instances for end-to-end query benchmarks.
+
+TemporaryCluster runs initdb in a temporary directory and starts a private
+server on a random local port. populate() fills it with generated
+databases, schemas, tables and partitions, and Activity opens idle, busy,
+idle in transaction and blocked sessions against it. Everything is removed
+again when the cluster is stopped.
+
+    with TemporaryCluster() as cluster:
+        populate(cluster, databases=3, tables=10000)
+        with Activity(cluster, 'bench_0000'):
+            pg = PgHelper(*cluster.connection())
+
+The PostgreSQL binaries are found with pg_config or on the PATH unless a
+bindir is given. psycopg2 must be importable, so import this module after
+benchlib.load_poller() has added the ZenPack's lib directory.
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+SUPERUSER = 'postgres'
+
+# Settings for a disposable server. Creating many tables in one transaction
+# needs plenty of lock slots.
+SETTINGS = {
+    'listen_addresses': "'127.0.0.1'",
+    'fsync': 'off',
+    'synchronous_commit': 'off',
+    'full_page_writes': 'off',
+    'max_connections': '200',
+    'max_locks_per_transaction': '1024',
+    'track_counts': 'on',
+}
+
+# Tables created per transaction by populate().
+CREATE_BATCH = 500
+
+
+def find_bindir():
+    """Return the directory holding initdb and pg_ctl."""
+    try:
+        return subprocess.check_output(['pg_config', '--bindir']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        if os.path.exists(os.path.join(directory, 'initdb')):
+            return directory
+
+    raise RuntimeError("initdb not found, pass the PostgreSQL bindir")
+
+
+def free_port():
+    """Return a local TCP port nobody is listening on right now."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class TemporaryCluster(object):
+    """A private PostgreSQL server living in a temporary directory."""
+
+    def __init__(self, bindir=None, port=None, settings=None, keep=False):
+        self.bindir = bindir or find_bindir()
+        self.port = port or free_port()
+        self.settings = dict(SETTINGS, **(settings or {}))
+        self.keep = keep
+        self.directory = None
+
+    @property
+    def datadir(self):
+        return os.path.join(self.directory, 'data')
+
+    def command(self, name, *args):
+        with open(os.path.join(self.directory, 'commands.log'), 'a') as log:
+            subprocess.check_call(
+                [os.path.join(self.bindir, name)] + list(args),
+                stdout=log, stderr=subprocess.STDOUT)
+
+    def start(self):
+        self.directory = tempfile.mkdtemp(prefix='zenpg-')
+        try:
+            self.command(
+                'initdb', '-D', self.datadir, '-U', SUPERUSER, '-A', 'trust',
+                '-E', 'UTF8', '--no-locale', '-N')
+
+            options = ' '.join(
+                ['-p {0:d}'.format(self.port),
+                 '-k {0}'.format(self.directory)] +
+                ['-c {0}={1}'.format(k, v) for k, v in self.settings.items()])
+
+            self.command(
+                'pg_ctl', '-D', self.datadir, '-w', '-t', '60',
+                '-l', os.path.join(self.directory, 'server.log'),
+                '-o', options, 'start')
+        except Exception:
+            if not self.keep:
+                shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+            raise
+
+        return self
+
+    def stop(self):
+        if self.directory is None:
+            return
+
+        try:
+            self.command(
+                'pg_ctl', '-D', self.datadir, '-w', '-m', 'immediate', 'stop')
+        finally:
+            if not self.keep:
+                shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def connection(self, database=SUPERUSER):
+        """Return the PgHelper/PostgresPoller connection arguments."""
+        return ('127.0.0.1', self.port, SUPERUSER, '', False, database)
+
+    def connect(self, database=SUPERUSER, autocommit=True):
+        connection = psycopg2.connect(
+            host='127.0.0.1', port=self.port, user=SUPERUSER,
+            database=database, sslmode='disable')
+        if autocommit:
+            connection.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+        return connection
+
+    def serverVersion(self):
+        connection = self.connect()
+        try:
+            return connection.server_version
+        finally:
+            connection.close()
+
+
+def database_names(databases):
+    return ['bench_{0:04d}'.format(i) for i in range(databases)]
+
+
+def populate(cluster, databases=3, tables=1000, schemas=10, partitions=0,
+             rows=10):
+    """
+    Create databases, each with tables spread over schemas.
+
+    Every table gets rows rows and is analyzed so its stats are filled in.
+    With partitions, each database also gets a range-partitioned table with
+    that many partitions (PostgreSQL 10 and newer).
+    """
+    admin = cluster.connect()
+    try:
+        cursor = admin.cursor()
+        for name in database_names(databases):
+            cursor.execute('CREATE DATABASE "{0}"'.format(name))
+    finally:
+        admin.close()
+
+    for name in database_names(databases):
+        connection = cluster.connect(name, autocommit=False)
+        try:
+            populate_database(
+                connection, tables, schemas, partitions, rows)
+        finally:
+            connection.close()
+
+
+def populate_database(connection, tables, schemas, partitions, rows):
+    cursor = connection.cursor()
+    for schema in range(schemas):
+        cursor.execute('CREATE SCHEMA s{0:03d}'.format(schema))
+    connection.commit()
+
+    for first in range(0, tables, CREATE_BATCH):
+        cursor.execute(
+            "DO $$ BEGIN"
+            " FOR i IN {0:d}..{1:d} LOOP"
+            "  EXECUTE format("
+            "   'CREATE TABLE s%s.t%s (id integer PRIMARY KEY, value text)',"
+            "   lpad((i % {2:d})::text, 3, '0'), lpad(i::text, 7, '0'));"
+            "  EXECUTE format("
+            "   'INSERT INTO s%s.t%s SELECT g, md5(g::text)"
+            "    FROM generate_series(1, {3:d}) AS g',"
+            "   lpad((i % {2:d})::text, 3, '0'), lpad(i::text, 7, '0'));"
+            " END LOOP;"
+            " END $$".format(
+                first, min(first + CREATE_BATCH, tables) - 1, schemas, rows))
+        connection.commit()
+
+    if partitions and connection.server_version >= 100000:
+        cursor.execute(
+            "CREATE TABLE parted (id integer, value text)"
+            " PARTITION BY RANGE (id)")
+        cursor.execute(
+            "DO $$ BEGIN"
+            " FOR i IN 0..{0:d} LOOP"
+            "  EXECUTE format("
+            "   'CREATE TABLE parted_%s PARTITION OF parted"
+            "    FOR VALUES FROM (%s) TO (%s)', i, i * 1000, (i + 1) * 1000);"
+            " END LOOP;"
+            " END $$".format(partitions - 1))
+        cursor.execute(
+            "INSERT INTO parted SELECT g, md5(g::text)"
+            "  FROM generate_series(0, {0:d}) AS g".format(
+                partitions * 1000 - 1))
+        connection.commit()
+
+    connection.set_isolation_level(
+        psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cursor.execute('ANALYZE')
+
+    # Give some tables sequential and index scans.
+    cursor.execute(
+        "SELECT schemaname, relname FROM pg_stat_user_tables"
+        " ORDER BY relname LIMIT 100")
+    for schema, table in cursor.fetchall():
+        cursor.execute('SELECT count(*) FROM "{0}"."{1}"'.format(
+            schema, table))
+        cursor.execute('SELECT value FROM "{0}"."{1}" WHERE id = 1'.format(
+            schema, table))
+    cursor.close()
+
+
+class Activity(object):
+    """
+    Sessions against database for the activity and lock queries to see.
+
+    Opens count sessions of each kind: idle, idle in transaction, running a
+    long query, holding a lock and waiting for that lock. Sessions running
+    or waiting on something are cancelled when stopped.
+    """
+
+    def __init__(self, cluster, database, count=5):
+        self.cluster = cluster
+        self.database = database
+        self.count = count
+        self.connections = []
+        self.threads = []
+
+    def background(self, sql):
+        connection = self.cluster.connect(self.database)
+        self.connections.append(connection)
+
+        def run():
+            try:
+                connection.cursor().execute(sql)
+            except psycopg2.Error:
+                # Cancelled by stop().
+                pass
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def start(self):
+        admin = self.cluster.connect(self.database)
+        try:
+            cursor = admin.cursor()
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS activity_lock (id integer)")
+        finally:
+            admin.close()
+
+        for i in range(self.count):
+            # Idle.
+            self.connections.append(self.cluster.connect(self.database))
+
+            # Idle in transaction.
+            connection = self.cluster.connect(self.database, autocommit=False)
+            connection.cursor().execute("SELECT 1")
+            self.connections.append(connection)
+
+            # Running a long query.
+            self.background("SELECT pg_sleep(3600)")
+
+        # Holding a lock, and waiting for it.
+        holder = self.cluster.connect(self.database, autocommit=False)
+        holder.cursor().execute(
+            "LOCK TABLE activity_lock IN ACCESS EXCLUSIVE MODE")
+        self.connections.append(holder)
+
+        for i in range(self.count):
+            self.background("SELECT count(*) FROM activity_lock")
+
+        return self
+
+    def stop(self):
+        for connection in self.connections:
+            try:
+                connection.cancel()
+            except psycopg2.Error:
+                pass
+
+        for thread in self.threads:
+            thread.join(10)
+
+        for connection in self.connections:
+            connection.close()
+
+        self.connections = []
+        self.threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()